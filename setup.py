@@ -32,6 +32,8 @@ setup(
     entry_points={
         "console_scripts": [
             "grafana-k8-sidecar=sidecar.sidecar:scan",
+            "grafana-k8-sidecar-history=sidecar.history:cli",
+            "grafana-k8-sidecar-convert=sidecar.conversion:cli",
         ],
     },
     python_requires=">3.10",
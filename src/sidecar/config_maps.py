@@ -0,0 +1,83 @@
+"""Dashboard json referenced from ConfigMaps (`spec.jsonFrom.configMapKeyRef`)."""
+
+import threading
+from typing import Callable, Dict, Tuple
+
+import kubernetes
+from urllib3.exceptions import HTTPError
+
+# Local Libraries
+import sidecar.exceptions as exceptions
+
+
+def read_config_map(namespace: str, name: str) -> Tuple[str, Dict[str, str]]:
+    """Resource version and data of a ConfigMap from the api server, raises configMapKeyNotFound."""
+    try:
+        config_map = kubernetes.client.CoreV1Api().read_namespaced_config_map(
+            name, namespace
+        )
+    except kubernetes.client.ApiException as e:
+        if e.status == 404:
+            raise exceptions.configMapKeyNotFound
+        raise exceptions.configMapUnavailable from e
+    except HTTPError as e:
+        raise exceptions.configMapUnavailable from e
+
+    return config_map.metadata.resource_version, config_map.data or {}
+
+
+class ConfigMapCache:
+    """Data of referenced ConfigMaps by resource version.
+
+    Filled by the ConfigMap watch, a ConfigMap not seen yet is fetched once with `fetch` (default
+    `read_config_map`) however many dashboards reference it. Thread safe.
+    """
+
+    def __init__(self, fetch: Callable[[str, str], Tuple[str, Dict[str, str]]] = None):
+        """Empty cache."""
+        self.fetch = fetch or read_config_map
+        self.lock = threading.Lock()
+        self.fetching = {}
+        self.config_maps = {}
+
+    def put(
+        self, namespace: str, name: str, version: str, data: Dict[str, str]
+    ) -> bool:
+        """Store a ConfigMap seen by the watch, returns True if its version was not cached."""
+        with self.lock:
+            cached = self.config_maps.get((namespace, name))
+            if cached is not None and cached[0] == version:
+                return False
+            self.config_maps[(namespace, name)] = (version, data or {})
+            return True
+
+    def remove(self, namespace: str, name: str):
+        """Forget a deleted ConfigMap."""
+        with self.lock:
+            self.config_maps.pop((namespace, name), None)
+
+    def cached(self, namespace: str, name: str, key: str) -> str:
+        """Value of a ConfigMap key if cached, never fetches, None when not cached or missing."""
+        with self.lock:
+            cached = self.config_maps.get((namespace, name))
+        return None if cached is None else cached[1].get(key)
+
+    def get(self, namespace: str, name: str, key: str) -> str:
+        """Value of a ConfigMap key, raises configMapKeyNotFound or configMapUnavailable."""
+        with self.lock:
+            cached = self.config_maps.get((namespace, name))
+            lock = self.fetching.setdefault((namespace, name), threading.Lock())
+
+        if cached is None:
+            # one fetch per ConfigMap, concurrent readers wait for it
+            with lock:
+                with self.lock:
+                    cached = self.config_maps.get((namespace, name))
+                if cached is None:
+                    version, data = self.fetch(namespace, name)
+                    self.put(namespace, name, version, data)
+                    cached = (version, data or {})
+
+        if key not in cached[1]:
+            raise exceptions.configMapKeyNotFound
+        return cached[1][key]
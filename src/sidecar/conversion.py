@@ -0,0 +1,102 @@
+"""Conversion of dashboard resources between the v1 (`spec.json` string) and v2 (`spec.dashboard`) forms."""
+
+import copy
+import json
+import sys
+
+import click
+
+# Local Libraries
+import sidecar.exceptions as exceptions
+from sidecar.payload import decompress_json
+
+VERSIONS = ("v1", "v2")
+
+
+def with_version(api_version: str, version: str) -> str:
+    """apiVersion of the same group in another version"""
+
+    return f'{api_version.rsplit("/", 1)[0]}/{version}'
+
+
+def to_v2(body: dict, max_size: int) -> dict:
+    """
+    resource with the dashboard as an object in `spec.dashboard`
+
+    `spec.json` and `spec.jsonGzip` are decoded, `spec.jsonFrom` is left as is. raises invalidJson,
+    invalidJsonGzip or dashboardTooLarge.
+    """
+
+    body = copy.deepcopy(body)
+    spec = body.setdefault("spec", {})
+    if "jsonGzip" in spec:
+        spec["json"] = decompress_json(spec.pop("jsonGzip"), max_size)[0]
+    if "json" in spec:
+        try:
+            spec["dashboard"] = json.loads(spec.pop("json"))
+        except ValueError:
+            raise exceptions.invalidJson
+        if not isinstance(spec["dashboard"], dict):
+            raise exceptions.invalidJson
+
+    body["apiVersion"] = with_version(body["apiVersion"], "v2")
+    return body
+
+
+def to_v1(body: dict, max_size: int) -> dict:
+    """resource with the dashboard as a json string in `spec.json`"""
+
+    body = copy.deepcopy(body)
+    spec = body.setdefault("spec", {})
+    if "dashboard" in spec:
+        spec["json"] = json.dumps(spec.pop("dashboard"), indent=2, ensure_ascii=False)
+
+    body["apiVersion"] = with_version(body["apiVersion"], "v1")
+    return body
+
+
+def convert(document: dict, version: str, max_size: int) -> dict:
+    """convert a resource, or every item of a list (`kubectl get -o json`)"""
+
+    converter = to_v2 if version == "v2" else to_v1
+    if document.get("kind") == "List":
+        return {
+            **document,
+            "items": [converter(item, max_size) for item in document["items"]],
+        }
+
+    return converter(document, max_size)
+
+
+@click.command()
+@click.option(
+    "--to",
+    "version",
+    type=click.Choice(VERSIONS),
+    default="v2",
+    help="version to convert dashboard resources to",
+)
+@click.option(
+    "--max-dashboard-size",
+    default=10 * 1024 * 1024,
+    help="max size in bytes of a jsonGzip dashboard once decompressed",
+)
+def cli(version: str, max_dashboard_size: int):
+    """Convert dashboard resources (json, e.g. `kubectl get grafanadashboards -o json`) read from stdin."""
+    try:
+        document = json.load(sys.stdin)
+    except ValueError as e:
+        click.echo(f"invalid json input: {e}", err=True)
+        raise SystemExit(1)
+
+    try:
+        converted = convert(document, version, max_dashboard_size)
+    except (
+        exceptions.invalidJson,
+        exceptions.invalidJsonGzip,
+        exceptions.dashboardTooLarge,
+    ) as e:
+        click.echo(f"conversion failed: {e.message}", err=True)
+        raise SystemExit(1)
+
+    click.echo(json.dumps(converted, indent=2, ensure_ascii=False))
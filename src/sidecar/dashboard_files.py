@@ -1,11 +1,128 @@
+import collections
+import errno
+import functools
+import hashlib
 import json
+import os
+import re
+import threading
+from json.decoder import scanstring
 from pathlib import Path
 
 # Local Libraries
 import sidecar.exceptions as exceptions
 
+# Content addressed blobs live inside the working dir. Blob names carry no `.json` extension so
+# Grafana's file provider does not load them as dashboards.
+BLOB_DIR = ".blobs"
+# Top level dashboard fields ignored when comparing json, Grafana rewrites these itself.
+VOLATILE_FIELDS = ("id", "version")
+
+# Results of full json parses (validation, content hash) keyed by a digest of the raw json, the same
+# json is handled by the indexes and handlers on every event.
+JSON_CACHE_SIZE = 1024
+_json_cache = collections.OrderedDict()
+_json_cache_lock = threading.Lock()
+# Json and content hashes of dashboards sent as objects (spec.dashboard) by the identity of the object,
+# the indexes, diff-base storage and handlers of an event are given the same decoded object and it is
+# never modified. Entries hold the object so its id is not reused while cached, they only need to
+# outlive the handling of an event.
+OBJECT_CACHE_SIZE = 32
+_object_cache = collections.OrderedDict()
+
+# File system errors expected to clear by themselves (full disk, flaky network storage), raised as
+# exceptions.transientError so they are retried instead of failing the resource.
+TRANSIENT_ERRNOS = {
+    errno.ENOSPC: exceptions.noSpaceLeft,
+    errno.EDQUOT: exceptions.noSpaceLeft,
+    errno.EIO: exceptions.ioError,
+    errno.EAGAIN: exceptions.fileSystemUnavailable,
+    errno.EBUSY: exceptions.fileSystemUnavailable,
+    errno.EINTR: exceptions.fileSystemUnavailable,
+    errno.ESTALE: exceptions.fileSystemUnavailable,
+    errno.ETIMEDOUT: exceptions.fileSystemUnavailable,
+}
+
+# Bytes and files of dashboards per directory (relative to the working dir), kept up to date by the
+# file operations below instead of walking the tree. The size of each path is recorded so a file
+# removed outside the sidecar and written again is not counted twice. Writes taking the total over the
+# high water mark (or the volume over the high water percent in use) are refused, 0 disables the check.
+_usage = {}
+_usage_files = {}
+_usage_changed = set()
+_usage_lock = threading.Lock()
+# blobs are stored, linked and released by concurrent handler threads, a blob found stored must not
+# lose its last link before it is linked again
+_blob_lock = threading.Lock()
+# blob last linked by each dashboard path (absolute), to restore a file removed outside the sidecar
+_path_blobs = {}
+_high_water = 0
+_high_water_percent = 0.0
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+
+
+def _cache_key(kind: str, dashboard_json: str) -> tuple:
+    return kind, hashlib.blake2b(dashboard_json.encode(), digest_size=16).digest()
+
+
+def in_json_cache(kind: str, dashboard_json: str) -> bool:
+    """return True if a value of kind is cached for the json, without computing it"""
+
+    with _json_cache_lock:
+        return _cache_key(kind, dashboard_json) in _json_cache
+
+
+def cached(kind: str, dashboard_json: str, compute):
+    """return compute(dashboard_json), cached by kind and a digest of the json"""
+
+    key = _cache_key(kind, dashboard_json)
+    with _json_cache_lock:
+        if key in _json_cache:
+            _json_cache.move_to_end(key)
+            return _json_cache[key]
+
+    value = compute(dashboard_json)
+
+    with _json_cache_lock:
+        _json_cache[key] = value
+        if len(_json_cache) > JSON_CACHE_SIZE:
+            _json_cache.popitem(last=False)
+
+    return value
+
+
+def cached_object(kind: str, dashboard: object, compute):
+    """return compute(dashboard), cached by kind and the identity of the dashboard object"""
+
+    key = (kind, id(dashboard))
+    with _json_cache_lock:
+        entry = _object_cache.get(key)
+        if entry is not None and entry[0] is dashboard:
+            _object_cache.move_to_end(key)
+            return entry[1]
+
+    value = compute(dashboard)
+
+    with _json_cache_lock:
+        _object_cache[key] = (dashboard, value)
+        _object_cache.move_to_end(key)
+        if len(_object_cache) > OBJECT_CACHE_SIZE:
+            _object_cache.popitem(last=False)
+
+    return value
+
+
+def prime_json_cache(dashboard_json: str, dashboard_hash: str = None):
+    """record json validated (and its content hash) elsewhere, e.g. by the validation process pool"""
 
-def validate_json(jsonData: str) -> bool:
+    cached("valid", dashboard_json, lambda _: True)
+    if dashboard_hash is not None:
+        cached(f"hash{VOLATILE_FIELDS}", dashboard_json, lambda _: dashboard_hash)
+
+
+def _validate_json(jsonData: str) -> bool:
     try:
         json.loads(jsonData)
     except ValueError:
@@ -13,29 +130,240 @@ def validate_json(jsonData: str) -> bool:
     return True
 
 
+def validate_json(jsonData: str) -> bool:
+    return cached("valid", jsonData, _validate_json)
+
+
+def _members_to_end(dashboard_json: str, pos: int, fields: tuple) -> dict:
+    """
+    parse `"key": value, ...}` from pos to the end of the json returning values for fields
+
+    raises ValueError unless the members close the top level object.
+    """
+
+    found = {}
+    while True:
+        key, pos = scanstring(dashboard_json, pos + 1)
+        pos = _WHITESPACE.match(dashboard_json, pos).end()
+        if not dashboard_json.startswith(":", pos):
+            raise ValueError("expecting ':'")
+
+        pos = _WHITESPACE.match(dashboard_json, pos + 1).end()
+        value, pos = _decoder.raw_decode(dashboard_json, pos)
+        if key in fields:
+            found[key] = value
+
+        pos = _WHITESPACE.match(dashboard_json, pos).end()
+        if dashboard_json.startswith("}", pos):
+            if _WHITESPACE.match(dashboard_json, pos + 1).end() != len(dashboard_json):
+                raise ValueError("not the top level object")
+            return found
+        if not dashboard_json.startswith(",", pos):
+            raise ValueError("expecting ','")
+
+        pos = _WHITESPACE.match(dashboard_json, pos + 1).end()
+        if not dashboard_json.startswith('"', pos):
+            raise ValueError("expecting key")
+
+
+def extract_json_fields(dashboard_json: str, fields: tuple, attempts: int = 16) -> dict:
+    """
+    return top level fields of the json object without parsing the whole document
+
+    dashboards exported by Grafana (and sorted json) keep `title`/`uid` at the end, so each field is
+    searched for from the end. A `"field"` token in valid json is always a string, it is the top level
+    key when the members following it close the document. Falls back to a full parse when not found
+    within attempts, so missing fields cost a json.loads. Does not check the json is well formed, see
+    validate_json. Raises ValueError when a full parse is needed and fails.
+    """
+
+    found = {}
+    for field in fields:
+        token = json.dumps(field)
+        end = len(dashboard_json)
+        for _ in range(attempts):
+            if field in found:
+                break
+            pos = dashboard_json.rfind(token, 0, end)
+            if pos < 0:
+                break
+            end = pos
+            try:
+                found.update(_members_to_end(dashboard_json, pos, fields))
+            except (ValueError, IndexError):
+                continue
+
+    if all(field in found for field in fields):
+        return found
+
+    data = json.loads(dashboard_json)
+    if not isinstance(data, dict):
+        return {}
+
+    return {field: data[field] for field in fields if field in data}
+
+
 def check_file(working_dir: str, path: str, dashboard_json: str = "") -> bool:
     """
     Checks a dashboard exists and has correct content
+
+    content is compared semantically, key order, whitespace and volatile fields are ignored.
     """
 
     full_path = Path.cwd().joinpath(working_dir, path)
 
     if not full_path.is_file():
+        # removed outside the sidecar
+        track_usage(path)
         raise exceptions.noFileExists
 
     if dashboard_json:
         if not validate_json(dashboard_json):
             raise exceptions.invalidJson
 
-        if full_path.read_text() != dashboard_json:
+        if content_hash(full_path.read_text()) != content_hash(dashboard_json):
             raise exceptions.jsonMismatch
 
     return True
 
 
-def create_file(working_dir: str, path: str, dashboard_json: str):
+def init_usage(working_dir: str) -> int:
+    """walk the working dir once for the dashboard bytes and files per directory, returns total bytes"""
+
+    usage = {}
+    usage_files = {}
+    for path in dashboard_paths(working_dir):
+        size = os.stat(os.path.join(working_dir, path)).st_size
+        entry = usage.setdefault(str(Path(path).parent), [0, 0])
+        entry[0] += size
+        entry[1] += 1
+        usage_files[path] = size
+
+    with _usage_lock:
+        _usage_changed.update(_usage, usage)
+        _usage.clear()
+        _usage.update(usage)
+        _usage_files.clear()
+        _usage_files.update(usage_files)
+        return sum(entry[0] for entry in _usage.values())
+
+
+def dashboard_paths(working_dir: str) -> list:
+    """paths of all dashboard files in the working dir relative to it, sidecar state dirs excluded"""
+
+    paths = []
+    for root, dirs, files in os.walk(working_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        directory = os.path.relpath(root, working_dir)
+        for name in files:
+            if name.endswith(".json") and not name.startswith("."):
+                paths.append(os.path.normpath(os.path.join(directory, name)))
+
+    return paths
+
+
+def set_high_water(high_water: int, high_water_percent: float = 0):
+    """
+    set the working dir bytes above which writes are refused, or the percent of its volume in use, 0 to
+    disable
+    """
+
+    global _high_water, _high_water_percent
+    _high_water = high_water
+    _high_water_percent = high_water_percent
+
+
+def high_water_bytes(working_dir: str) -> int:
+    """the high water mark in bytes, a percent of the volume at the time of the call"""
+
+    if _high_water_percent:
+        volume = os.statvfs(working_dir)
+        return int(volume.f_blocks * volume.f_frsize * _high_water_percent / 100)
+
+    return _high_water
+
+
+def track_usage(path: str, size: int = None):
+    """record the size of the dashboard at path, None once it is removed"""
+
+    path = os.path.normpath(path)
+    directory = str(Path(path).parent)
+    with _usage_lock:
+        old_size = _usage_files.pop(path, None)
+        if size is not None:
+            _usage_files[path] = size
+        files = (size is not None) - (old_size is not None)
+        if files == 0 and size == old_size:
+            return
+
+        entry = _usage.setdefault(directory, [0, 0])
+        entry[0] += (size or 0) - (old_size or 0)
+        entry[1] += files
+        if entry[1] <= 0:
+            del _usage[directory]
+        _usage_changed.add(directory)
+
+
+def usage_total() -> int:
+    """dashboard bytes in the working dir"""
+
+    with _usage_lock:
+        return sum(entry[0] for entry in _usage.values())
+
+
+def usage_changes() -> dict:
+    """(bytes, files) of each directory changed since the last call, None for removed directories"""
+
+    with _usage_lock:
+        changes = {
+            directory: tuple(_usage[directory]) if directory in _usage else None
+            for directory in _usage_changed
+        }
+        _usage_changed.clear()
+    return changes
+
+
+def check_capacity(working_dir: str, size: int):
+    """raise workingDirFull if writing size more bytes takes the working dir over the high water mark"""
+
+    if size <= 0:
+        return
+
+    if _high_water and usage_total() + size > _high_water:
+        raise exceptions.workingDirFull
+
+    if _high_water_percent:
+        # the whole volume: blobs, history and anything else sharing it
+        volume = os.statvfs(working_dir)
+        capacity = volume.f_blocks * volume.f_frsize
+        used = capacity - volume.f_bavail * volume.f_frsize
+        if used + size > capacity * _high_water_percent / 100:
+            raise exceptions.workingDirFull
+
+
+def transient_errors(func):
+    """raise transient file system errors from func as exceptions.transientError"""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except OSError as e:
+            if e.errno in TRANSIENT_ERRNOS:
+                raise TRANSIENT_ERRNOS[e.errno] from e
+            raise
+
+    return wrapper
+
+
+@transient_errors
+def create_file(
+    working_dir: str, path: str, dashboard_json: str, content_store: bool = False
+):
     """
     Create a dashboard file, mkdir if does not exist
+
+    With content_store the file is a hardlink to a blob shared by all dashboards with the same json.
     """
 
     full_path = Path.cwd().joinpath(working_dir, path)
@@ -46,22 +374,38 @@ def create_file(working_dir: str, path: str, dashboard_json: str):
     if not validate_json(dashboard_json):
         raise exceptions.invalidJson
 
+    size = dashboard_size(dashboard_json)
+    check_capacity(working_dir, size)
+
     try:
         full_path.parents[0].mkdir(parents=False, exist_ok=True)
-        full_path.write_text(dashboard_json)
+        if content_store:
+            with _blob_lock:
+                link_stored_blob(working_dir, dashboard_json, full_path)
+        else:
+            full_path.write_text(dashboard_json)
     except FileNotFoundError:
         raise exceptions.parentDirDoesNotExist
     except PermissionError:
         raise exceptions.incorrect_permissions
 
+    track_usage(path, size)
+
     return True
 
 
+@transient_errors
 def update_file(
-    working_dir: str, old_path: str, new_path: str = "", new_json: str = ""
+    working_dir: str,
+    old_path: str,
+    new_path: str = "",
+    new_json: str = "",
+    content_store: bool = False,
 ):
     """
     update a dashboard file by name, dir, and json content
+
+    dir/name changes are a rename, with content_store a json change relinks the path to a new blob.
     """
 
     path_change = False
@@ -74,20 +418,46 @@ def update_file(
     full_old_path = Path(working_dir, old_path)
 
     if not Path(full_old_path).is_file():
+        track_usage(old_path)
         raise exceptions.oldPathDoesNotExist
 
     if new_json != "" and not validate_json(new_json):
         raise exceptions.invalidJson
 
+    # skip the write when the file already holds the content
+    if new_json != "" and content_hash(full_old_path.read_text()) == content_hash(
+        new_json
+    ):
+        new_json = ""
+        if not path_change:
+            raise exceptions.nothingToDo
+
+    old_size = full_old_path.stat().st_size
+    size = old_size
     if new_json != "":
-        full_old_path.write_text(new_json)
+        size = dashboard_size(new_json)
+        check_capacity(working_dir, size - old_size)
+        if content_store:
+            with _blob_lock:
+                release_blob(working_dir, full_old_path)
+                link_stored_blob(working_dir, new_json, full_old_path)
+        else:
+            # a new inode, the file may still be a hardlink to a blob from --content-store
+            write_file(full_old_path, new_json)
+        track_usage(old_path, size)
 
     if path_change:
         full_new_path = Path(working_dir, new_path)
 
         if full_new_path.is_file():
             # error: duplicate name, but still delete old file as this can disrupt other operations
-            full_old_path.unlink()
+            if content_store:
+                with _blob_lock:
+                    release_blob(working_dir, full_old_path)
+                    full_old_path.unlink()
+            else:
+                full_old_path.unlink()
+            track_usage(old_path)
             try:
                 remove_empty_dir(full_old_path.parents[0])
             except exceptions.pathNotDir:
@@ -101,6 +471,13 @@ def update_file(
 
         full_new_path.parents[0].mkdir(parents=False, exist_ok=True)
         full_old_path.rename(full_new_path)
+        if content_store:
+            with _blob_lock:
+                blob = _path_blobs.pop(os.path.abspath(full_old_path), None)
+                if blob is not None:
+                    _path_blobs[os.path.abspath(full_new_path)] = blob
+        track_usage(old_path)
+        track_usage(new_path, size)
 
         try:
             remove_empty_dir(full_old_path.parents[0])
@@ -115,17 +492,36 @@ def update_file(
     return True
 
 
-def delete_file(working_dir: str, path: str) -> bool:
+@transient_errors
+def unlink_file(working_dir: str, path: str, content_store: bool = False) -> Path:
     """
-    delete a dashboard and remove dir if then empty
+    delete a dashboard leaving its dir, returns the full path deleted
     """
 
     full_path = Path.cwd().joinpath(working_dir, path)
 
     if not Path(full_path).is_file():
+        track_usage(path)
         raise exceptions.noFileExists
 
-    full_path.unlink()
+    if content_store:
+        with _blob_lock:
+            release_blob(working_dir, full_path)
+            full_path.unlink()
+    else:
+        full_path.unlink()
+    track_usage(path)
+
+    return full_path
+
+
+@transient_errors
+def delete_file(working_dir: str, path: str, content_store: bool = False) -> bool:
+    """
+    delete a dashboard and remove dir if then empty
+    """
+
+    full_path = unlink_file(working_dir, path, content_store)
 
     try:
         remove_empty_dir(full_path.parents[0])
@@ -140,6 +536,35 @@ def delete_file(working_dir: str, path: str) -> bool:
     return True
 
 
+def delete_files(working_dir: str, paths: list, content_store: bool = False) -> list:
+    """
+    delete many dashboards in one pass, then remove each dir left empty once
+
+    returns the result per path in order: None when deleted, otherwise the exception raised for it.
+    """
+
+    results = []
+    dirs = set()
+    for path in paths:
+        try:
+            dirs.add(unlink_file(working_dir, path, content_store).parents[0])
+            results.append(None)
+        except Exception as e:
+            results.append(e)
+
+    root = Path.cwd().joinpath(working_dir)
+    # deepest first, a dir also emptied by removing its subdirs goes after them
+    for path in sorted(dirs, key=lambda d: len(d.parts), reverse=True):
+        if path == root:
+            continue
+        try:
+            remove_empty_dir(path)
+        except Exception:
+            pass
+
+    return results
+
+
 def remove_empty_dir(path: Path) -> bool:
     """remove path if no files (dashboards exist in it)"""
 
@@ -152,3 +577,229 @@ def remove_empty_dir(path: Path) -> bool:
     path.rmdir()
 
     return True
+
+
+def set_volatile_fields(fields: tuple):
+    """configure the top level fields ignored by content_hash"""
+
+    global VOLATILE_FIELDS
+    VOLATILE_FIELDS = tuple(fields)
+
+
+def canonicalize(dashboard_json: str, ignore_fields: tuple = ()) -> str:
+    """
+    stable minified form of the json with sorted keys, raises ValueError on invalid json
+
+    ignore_fields are dropped from the top level object.
+    """
+
+    return _canonical(json.loads(dashboard_json), ignore_fields)
+
+
+def _canonical(data: object, ignore_fields: tuple) -> str:
+    if isinstance(data, dict) and ignore_fields:
+        data = {key: value for key, value in data.items() if key not in ignore_fields}
+
+    return json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def serialize_dashboard(dashboard: object, canonical: bool = False) -> str:
+    """
+    json of a dashboard sent as an object (spec.dashboard), in the form written to disk
+
+    serialized once per object, its validity and content hash are recorded from the object so the json
+    is never parsed again.
+    """
+
+    return cached_object(
+        f"json{canonical}",
+        dashboard,
+        lambda data: _serialize_dashboard(data, canonical),
+    )
+
+
+def _serialize_dashboard(dashboard: object, canonical: bool) -> str:
+    if canonical:
+        dashboard_json = _canonical(dashboard, ())
+    else:
+        dashboard_json = json.dumps(dashboard, indent=2, ensure_ascii=False)
+
+    if not VOLATILE_FIELDS and canonical:
+        dashboard_hash = hashlib.sha256(dashboard_json.encode()).hexdigest()
+    else:
+        dashboard_hash = serialized_hash(dashboard)
+    prime_json_cache(dashboard_json, dashboard_hash)
+
+    return dashboard_json
+
+
+def serialized_hash(dashboard: object) -> str:
+    """content_hash of a dashboard sent as an object, computed once per object like serialize_dashboard"""
+
+    return cached_object(f"hash{VOLATILE_FIELDS}", dashboard, object_hash)
+
+
+def dashboard_size(dashboard_json: str) -> int:
+    """size in bytes of the json as written to disk (utf-8)"""
+
+    if dashboard_json.isascii():
+        return len(dashboard_json)
+
+    return len(dashboard_json.encode())
+
+
+def object_hash(dashboard: object) -> str:
+    """content_hash of an already decoded dashboard"""
+
+    return hashlib.sha256(_canonical(dashboard, VOLATILE_FIELDS).encode()).hexdigest()
+
+
+def content_hash(dashboard_json: str, ignore_fields: tuple = None) -> str:
+    """
+    sha256 of the canonical json ignoring VOLATILE_FIELDS, used to compare dashboards
+
+    invalid json is hashed as is.
+    """
+
+    if ignore_fields is None:
+        ignore_fields = VOLATILE_FIELDS
+
+    return cached(
+        f"hash{ignore_fields}",
+        dashboard_json,
+        lambda data: _content_hash(data, ignore_fields),
+    )
+
+
+def _content_hash(dashboard_json: str, ignore_fields: tuple) -> str:
+    try:
+        dashboard_json = canonicalize(dashboard_json, ignore_fields)
+    except ValueError:
+        pass
+
+    return hashlib.sha256(dashboard_json.encode()).hexdigest()
+
+
+def blob_name(dashboard_json: str) -> str:
+    """
+    sha256 of the json as written, the name of its blob
+
+    not content_hash: dashboards only differing in volatile fields (or whitespace) are different bytes.
+    """
+
+    return hashlib.sha256(dashboard_json.encode()).hexdigest()
+
+
+def store_blob(working_dir: str, dashboard_json: str) -> Path:
+    """write the json into the blob dir once, identical json is never written twice"""
+
+    blob_dir = Path.cwd().joinpath(working_dir, BLOB_DIR)
+    blob_dir.mkdir(parents=False, exist_ok=True)
+
+    blob = Path(blob_dir, blob_name(dashboard_json))
+    if not blob.is_file():
+        write_file(blob, dashboard_json)
+
+    return blob
+
+
+def write_file(full_path: Path, dashboard_json: str):
+    """atomically replace full_path with a new file, never writing into an existing inode"""
+
+    tmp = Path(
+        full_path.parents[0],
+        f".{full_path.name}.{os.getpid()}.{threading.get_ident()}.tmp",
+    )
+    tmp.write_text(dashboard_json)
+    os.replace(tmp, full_path)
+
+
+def link_stored_blob(working_dir: str, dashboard_json: str, full_path: Path) -> Path:
+    """
+    store the json as a blob and point full_path at it, returns the blob
+
+    the lock only covers this process, the store is retried when another worker process released the
+    blob between storing and linking it.
+    """
+
+    for attempt in range(3):
+        blob = store_blob(working_dir, dashboard_json)
+        try:
+            link_blob(blob, full_path)
+            _path_blobs[os.path.abspath(full_path)] = blob.name
+            return blob
+        except FileNotFoundError:
+            if blob.is_file() or attempt == 2:
+                raise
+
+
+def link_blob(blob: Path, full_path: Path) -> bool:
+    """atomically point full_path at blob, replacing any existing file"""
+
+    tmp = Path(full_path.parents[0], f".{full_path.name}.tmp")
+    tmp.unlink(missing_ok=True)
+    os.link(blob, tmp)
+    os.replace(tmp, full_path)
+
+    return True
+
+
+def restore_blob(working_dir: str, full_path: Path) -> bool:
+    """
+    point a missing dashboard file back at the blob it was last linked to, returns False when not known
+    (e.g. linked before a restart) or the blob is not stored
+    """
+
+    with _blob_lock:
+        name = _path_blobs.get(os.path.abspath(full_path))
+        blob = Path.cwd().joinpath(working_dir, BLOB_DIR, name or "")
+        if name is None or not blob.is_file():
+            return False
+        try:
+            link_blob(blob, full_path)
+        except FileNotFoundError:
+            # released by another worker process
+            return False
+
+    track_usage(os.path.relpath(full_path, working_dir), blob.stat().st_size)
+
+    return True
+
+
+def release_blob(working_dir: str, full_path: Path) -> bool:
+    """
+    remove the blob behind full_path if full_path is its last reference
+
+    hardlink counts are the reference count, the blob is only located (by hashing the content) when the
+    path about to be removed is the one remaining link.
+    """
+
+    _path_blobs.pop(os.path.abspath(full_path), None)
+    if full_path.stat().st_nlink != 2:
+        return False
+
+    blob = Path.cwd().joinpath(
+        working_dir, BLOB_DIR, hashlib.sha256(full_path.read_bytes()).hexdigest()
+    )
+    if not blob.is_file() or not blob.samefile(full_path):
+        return False
+
+    blob.unlink()
+
+    return True
+
+
+def gc_blobs(working_dir: str) -> int:
+    """remove blobs no longer referenced by any dashboard path, returns count removed"""
+
+    blob_dir = Path.cwd().joinpath(working_dir, BLOB_DIR)
+    if not blob_dir.is_dir():
+        return 0
+
+    removed = 0
+    for blob in blob_dir.iterdir():
+        if blob.name.endswith(".tmp") or blob.stat().st_nlink == 1:
+            blob.unlink()
+            removed += 1
+
+    return removed
@@ -136,3 +136,113 @@ class dirNotEmpty(Exception):
         """When attempting to delete a directory it is found not empty."""
         self.message = "when attempting to delete a directory it is found not empty"
         self.code = "dir_not_empty"
+
+
+class invalidJsonNoPanels(Exception):
+    def __init__(self):
+        """Dashboard json is missing the panels list."""
+        self.message = "dashboard json is missing the panels list"
+        self.code = "invalid_json_no_panels"
+
+
+class invalidJsonDuplicatePanelId(Exception):
+    def __init__(self):
+        """Dashboard json has panels sharing the same id."""
+        self.message = "dashboard json has panels sharing the same id"
+        self.code = "invalid_json_duplicate_panel_id"
+
+
+class invalidJsonSchemaVersion(Exception):
+    def __init__(self):
+        """Dashboard json schemaVersion field is not a positive integer."""
+        self.message = "dashboard json schemaVersion field is not a positive integer"
+        self.code = "invalid_json_schema_version"
+
+
+class invalidJsonTemplatingTooLarge(Exception):
+    def __init__(self):
+        """Dashboard json templating has too many variables or variable options."""
+        self.message = (
+            "dashboard json templating has too many variables or variable options"
+        )
+        self.code = "invalid_json_templating_too_large"
+
+
+class dashboardTooLarge(Exception):
+    def __init__(self):
+        """Dashboard json is larger than the configured maximum size."""
+        self.message = "dashboard json is larger than the configured maximum size"
+        self.code = "dashboard_too_large"
+
+
+class transientError(Exception):
+    """Base class for file system and api errors expected to clear without changes to the resource."""
+
+
+class noSpaceLeft(transientError):
+    def __init__(self):
+        """Working dir file system is out of space or quota."""
+        self.message = "working dir file system is out of space or quota"
+        self.code = "no_space_left"
+
+
+class ioError(transientError):
+    def __init__(self):
+        """Working dir file system returned an i/o error."""
+        self.message = "working dir file system returned an i/o error"
+        self.code = "io_error"
+
+
+class fileSystemUnavailable(transientError):
+    def __init__(self):
+        """Working dir file system is temporarily unavailable (busy, stale handle or timed out)."""
+        self.message = "working dir file system is temporarily unavailable (busy, stale handle or timed out)"
+        self.code = "file_system_unavailable"
+
+
+class workingDirFull(transientError):
+    def __init__(self):
+        """Writing the dashboard would take the working dir over its high water mark."""
+        self.message = (
+            "writing the dashboard would take the working dir over its high water mark"
+        )
+        self.code = "working_dir_full"
+
+
+class noVersionExists(Exception):
+    def __init__(self):
+        """Dashboard version is not in the sidecar's history."""
+        self.message = "dashboard version is not in the sidecar's history"
+        self.code = "no_version_exists"
+
+
+class invalidJsonGzip(Exception):
+    def __init__(self):
+        """Dashboard jsonGzip is not base64 encoded gzip of utf-8 json."""
+        self.message = "dashboard jsonGzip is not base64 encoded gzip of utf-8 json"
+        self.code = "invalid_json_gzip"
+
+
+class configMapKeyNotFound(Exception):
+    def __init__(self):
+        """ConfigMap or key referenced by jsonFrom does not exist."""
+        self.message = "configmap or key referenced by jsonFrom does not exist"
+        self.code = "config_map_key_not_found"
+
+
+class configMapUnavailable(transientError):
+    def __init__(self):
+        """ConfigMap referenced by jsonFrom could not be read from the api server."""
+        self.message = (
+            "configmap referenced by jsonFrom could not be read from the api server"
+        )
+        self.code = "config_map_unavailable"
+
+
+class configMapRefsDisabled(Exception):
+    def __init__(self):
+        """Dashboard json references a ConfigMap but ConfigMap references are not enabled."""
+        self.message = (
+            "dashboard json references a configmap but --config-map-refs is not enabled"
+        )
+        self.code = "config_map_refs_disabled"
@@ -0,0 +1,244 @@
+"""Bounded on disk version history of dashboards for local rollback."""
+
+import gzip
+import os
+import time
+from pathlib import Path
+
+import click
+
+# Local Libraries
+import sidecar.exceptions as exceptions
+from sidecar.dashboard_files import content_hash
+
+# History lives inside the working dir next to the blobs, version files carry no `.json` extension so
+# Grafana's file provider does not load them as dashboards.
+HISTORY_DIR = ".history"
+OBJECTS = "objects"
+VERSIONS = "versions"
+ROLLBACKS = "rollbacks"
+
+
+def history_dir(working_dir: str, *parts: str) -> Path:
+    """path inside the history dir of working_dir"""
+
+    return Path.cwd().joinpath(working_dir, HISTORY_DIR, *parts)
+
+
+def versions(working_dir: str, path: str) -> list:
+    """version files of a dashboard path, newest first"""
+
+    version_dir = history_dir(working_dir, VERSIONS, path)
+    if not version_dir.is_dir():
+        return []
+
+    return sorted(
+        (v for v in version_dir.iterdir() if v.name.endswith(".gz")), reverse=True
+    )
+
+
+def list_versions(working_dir: str, path: str) -> list:
+    """version id, content hash, time (ns) and compressed size of a dashboard path, newest first"""
+
+    result = []
+    for version in versions(working_dir, path):
+        version_id = version.name[: -len(".gz")]
+        recorded, dashboard_hash = version_id.split("-", 1)
+        result.append(
+            {
+                "version": version_id,
+                "hash": dashboard_hash,
+                "time": int(recorded),
+                "size": version.stat().st_size,
+            }
+        )
+    return result
+
+
+def link_version(obj: Path, version: Path):
+    """atomically add a version file as a hardlink to obj"""
+
+    tmp = Path(version.parent, f".{version.name}.tmp")
+    tmp.unlink(missing_ok=True)
+    os.link(obj, tmp)
+    os.replace(tmp, version)
+
+
+def record_version(working_dir: str, path: str, dashboard_json: str, keep: int) -> int:
+    """
+    add dashboard_json as the newest version of path, keeping the last `keep` versions
+
+    content is stored once gzip compressed by hash and hardlinked per version, nothing is recorded when
+    the newest version has the same content. returns the change in stored bytes.
+    """
+
+    dashboard_hash = content_hash(dashboard_json, ())
+    existing = versions(working_dir, path)
+    if existing and existing[0].name.endswith(f"-{dashboard_hash}.gz"):
+        return 0
+
+    added = 0
+    object_dir = history_dir(working_dir, OBJECTS)
+    object_dir.mkdir(parents=True, exist_ok=True)
+    obj = Path(object_dir, f"{dashboard_hash}.gz")
+    if not obj.is_file():
+        tmp = Path(object_dir, f".{obj.name}.tmp")
+        added = tmp.write_bytes(gzip.compress(dashboard_json.encode(), mtime=0))
+        os.replace(tmp, obj)
+
+    version_dir = history_dir(working_dir, VERSIONS, path)
+    version_dir.mkdir(parents=True, exist_ok=True)
+    version_id = f"{time.time_ns():020d}-{dashboard_hash}"
+    link_version(obj, Path(version_dir, f"{version_id}.gz"))
+
+    for old in versions(working_dir, path)[keep:]:
+        added -= release_version(working_dir, old)
+
+    return added
+
+
+def release_version(working_dir: str, version: Path) -> int:
+    """remove a version and its object when it was the last reference, returns bytes freed"""
+
+    obj = history_dir(working_dir, OBJECTS, version.name.split("-", 1)[1])
+    size = 0
+    if version.stat().st_nlink == 2 and obj.is_file() and obj.samefile(version):
+        size = obj.stat().st_size
+        obj.unlink()
+    version.unlink()
+
+    return size
+
+
+def history_size(working_dir: str) -> int:
+    """compressed bytes of all stored versions"""
+
+    object_dir = history_dir(working_dir, OBJECTS)
+    if not object_dir.is_dir():
+        return 0
+    return sum(obj.stat().st_size for obj in object_dir.iterdir())
+
+
+def enforce_size(working_dir: str, max_bytes: int, size: int) -> int:
+    """
+    remove the oldest versions of any dashboard (keeping each newest) until under max_bytes
+
+    size is the current history size (tracked by the caller), returns the size after removals.
+    """
+
+    if size <= max_bytes:
+        return size
+
+    version_root = history_dir(working_dir, VERSIONS)
+    candidates = []
+    for root, _, files in os.walk(version_root):
+        for name in sorted(files, reverse=True)[1:]:
+            if name.endswith(".gz"):
+                candidates.append((name, Path(root, name)))
+
+    for _, version in sorted(candidates):
+        if size <= max_bytes:
+            break
+        size -= release_version(working_dir, version)
+
+    return size
+
+
+def read_version(working_dir: str, path: str, version_id: str) -> str:
+    """dashboard json of a version, raises noVersionExists"""
+
+    version = history_dir(working_dir, VERSIONS, path, f"{version_id}.gz")
+    # paths outside of the working dir never have versions
+    if (
+        Path(path).is_absolute()
+        or ".." in Path(path).parts
+        or "/" in version_id
+        or not version.is_file()
+    ):
+        raise exceptions.noVersionExists
+
+    return gzip.decompress(version.read_bytes()).decode()
+
+
+def restore_version(working_dir: str, path: str, version_id: str) -> str:
+    """
+    write a version back to the dashboard path and mark it as rolled back, returns its content hash
+
+    the marker lets reconcile and the drift watcher tell an intentional rollback from drift until the
+    resource is next written.
+    """
+
+    dashboard_json = read_version(working_dir, path, version_id)
+    full_path = Path.cwd().joinpath(working_dir, path)
+    if not full_path.parents[0].is_dir():
+        raise exceptions.parentDirDoesNotExist
+
+    tmp = Path(full_path.parents[0], f".{full_path.name}.tmp")
+    tmp.write_text(dashboard_json)
+    os.replace(tmp, full_path)
+
+    dashboard_hash = content_hash(dashboard_json)
+    marker = history_dir(working_dir, ROLLBACKS, path)
+    marker.parent.mkdir(parents=True, exist_ok=True)
+    marker.write_text(dashboard_hash)
+
+    return dashboard_hash
+
+
+def rolled_back(working_dir: str, path: str, dashboard_hash: str) -> bool:
+    """return True if path holds a rollback with the content hash"""
+
+    marker = history_dir(working_dir, ROLLBACKS, path)
+    try:
+        return marker.read_text() == dashboard_hash
+    except FileNotFoundError:
+        return False
+
+
+def clear_rollback(working_dir: str, path: str) -> bool:
+    """forget a rollback of path, called when the resource is written again"""
+
+    marker = history_dir(working_dir, ROLLBACKS, path)
+    try:
+        marker.unlink()
+        return True
+    except FileNotFoundError:
+        return False
+
+
+@click.group()
+@click.option(
+    "--working-dir",
+    default="/app/grafana-dashboards",
+    help="working directory of the sidecar",
+)
+@click.pass_context
+def cli(ctx: click.Context, working_dir: str):
+    """List and restore dashboard versions kept by the sidecar (--history-versions)."""
+    ctx.obj = working_dir
+
+
+@cli.command("list")
+@click.argument("path")
+@click.pass_obj
+def list_command(working_dir: str, path: str):
+    """List versions of a dashboard path (dir/name.json), newest first."""
+    for version in list_versions(working_dir, path):
+        recorded = time.strftime(
+            "%Y-%m-%dT%H:%M:%SZ", time.gmtime(version["time"] / 1e9)
+        )
+        click.echo(f"{version['version']}  {recorded}  {version['size']}")
+
+
+@cli.command("restore")
+@click.argument("path")
+@click.argument("version")
+@click.pass_obj
+def restore_command(working_dir: str, path: str, version: str):
+    """Restore a version of a dashboard path (dir/name.json) to the working dir."""
+    try:
+        restore_version(working_dir, path, version)
+    except (exceptions.noVersionExists, exceptions.parentDirDoesNotExist) as e:
+        click.echo(f"restore failed: {e}")
+        raise SystemExit(1)
+    click.echo(f"restored {path} to version {version}")
@@ -0,0 +1,66 @@
+"""Garbage collection of dashboard files left behind by resources deleted unseen."""
+
+import logging
+import threading
+from typing import Callable, List, Set
+
+# Local Libraries
+from sidecar.dashboard_files import dashboard_paths
+
+
+class OrphanCollector(threading.Thread):
+    """Periodically remove dashboard files no resource writes any more.
+
+    Without finalizers the sidecar misses deletions made while it is down. Each pass compares the
+    dashboard files in the working dir with `owned` (the paths of all indexed resources), a file is
+    only passed to `remove` when it was already orphaned on the previous pass, so a file written
+    just before its resource reached the index is never removed. The first pass runs one interval
+    after `ready` is set, once the operator has listed the resources.
+    """
+
+    def __init__(
+        self,
+        working_dir: str,
+        owned: Callable[[], Set[str]],
+        remove: Callable[[List[str]], None],
+        ready: threading.Event,
+        interval: float = 600,
+    ):
+        """Collector parameters, collection starts with the thread."""
+        super().__init__(name="orphan-gc", daemon=True)
+        self.working_dir = working_dir
+        self.owned = owned
+        self.remove = remove
+        self.ready = ready
+        self.interval = interval
+        self.candidates = set()
+        self.stop_flag = threading.Event()
+
+    def collect(self) -> List[str]:
+        """Run one pass, returns the paths removed."""
+        owned = self.owned()
+        orphans = {
+            path for path in dashboard_paths(self.working_dir) if path not in owned
+        }
+
+        expired = sorted(orphans & self.candidates)
+        self.candidates = orphans - self.candidates
+        if expired:
+            self.remove(expired)
+        return expired
+
+    def run(self):
+        """Collect until stopped."""
+        while not self.ready.wait(self.interval):
+            if self.stop_flag.is_set():
+                return
+
+        while not self.stop_flag.wait(self.interval):
+            try:
+                self.collect()
+            except OSError as e:
+                logging.error(f"orphan file collection failed: {e}")
+
+    def stop(self):
+        """Stop the collector thread."""
+        self.stop_flag.set()
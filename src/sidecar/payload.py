@@ -0,0 +1,55 @@
+"""Dashboard json payloads sent compressed in the resource spec (`spec.jsonGzip`)."""
+
+import base64
+import binascii
+import collections
+import hashlib
+import threading
+import time
+import zlib
+from typing import Optional, Tuple
+
+# Local Libraries
+import sidecar.exceptions as exceptions
+
+# Decompressed json of the last payloads, an event runs the indexes and a handler on the same
+# payload so it is decompressed once per resource version.
+DECOMPRESS_CACHE_SIZE = 64
+_decompressed = collections.OrderedDict()
+_decompressed_lock = threading.Lock()
+
+
+def decompress_json(encoded: str, max_size: int) -> Tuple[str, Optional[float]]:
+    """
+    json of a base64 encoded gzip payload and the seconds taken to decompress it, None when cached
+
+    raises invalidJsonGzip, or dashboardTooLarge as soon as more than max_size bytes decompress.
+    """
+
+    key = hashlib.blake2b(encoded.encode(), digest_size=16).digest()
+    with _decompressed_lock:
+        if key in _decompressed:
+            _decompressed.move_to_end(key)
+            return _decompressed[key], None
+
+    start = time.monotonic()
+    try:
+        # line wrapped base64 (e.g. `base64` without -w0) is accepted
+        data = base64.b64decode("".join(encoded.split()), validate=True)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        raw = decompressor.decompress(data, max_size + 1)
+        if len(raw) > max_size:
+            raise exceptions.dashboardTooLarge
+        if not decompressor.eof:
+            raise exceptions.invalidJsonGzip
+        dashboard_json = raw.decode()
+    except (binascii.Error, zlib.error, UnicodeDecodeError):
+        raise exceptions.invalidJsonGzip
+    seconds = time.monotonic() - start
+
+    with _decompressed_lock:
+        _decompressed[key] = dashboard_json
+        if len(_decompressed) > DECOMPRESS_CACHE_SIZE:
+            _decompressed.popitem(last=False)
+
+    return dashboard_json, seconds
@@ -0,0 +1,85 @@
+"""Slim kopf diff-base storage keeping a digest of the dashboard json."""
+
+import hashlib
+from typing import Iterable, Optional
+
+import kopf
+
+# Local Libraries
+from sidecar.dashboard_files import content_hash, object_hash, serialize_dashboard
+
+JSON_DIGEST_PREFIX = "sha256:"
+
+
+def json_digest(dashboard_json: str) -> str:
+    """Stored form of the dashboard json, a sha256 of the raw json.
+
+    Computed for every event of every resource on the event loop, without parsing the json.
+    """
+    return f"{JSON_DIGEST_PREFIX}{hashlib.sha256(dashboard_json.encode()).hexdigest()}"
+
+
+def stored_hash(value: str) -> Optional[str]:
+    """Content hash of a json value from the diff-base, None when stored as a digest."""
+    if value.startswith(JSON_DIGEST_PREFIX):
+        return None
+    return content_hash(value)
+
+
+def stored_spec_hash(spec: object) -> Optional[str]:
+    """Content hash of the dashboard of a diff-base spec, None when only a digest or a payload is stored
+    (jsonGzip, jsonFrom)."""
+    if isinstance(spec.get("json"), str):
+        return stored_hash(spec["json"])
+    if "dashboard" in spec:
+        return object_hash(spec["dashboard"])
+    return None
+
+
+class SlimDiffBaseStorage(kopf.AnnotationsDiffBaseStorage):
+    """Last handled configuration with `spec.json` (`spec.dashboard`, `spec.jsonGzip`) replaced by a digest.
+
+    The full json would double the size of every resource in etcd and on the watch. `dir` and
+    `name` are kept so diffs and `old` still carry them, any json change shows as a change of its
+    digest, the update handler decides if it is semantic. Handlers must read the json from `spec`
+    when `old` and `new` only hold the digest.
+    """
+
+    def build(
+        self,
+        *,
+        body: kopf.Body,
+        extra_fields: Optional[Iterable[kopf.FieldSpec]] = None,
+    ) -> kopf.BodyEssence:
+        """Essence of the body with the hashed json."""
+        essence = super().build(body=body, extra_fields=extra_fields)
+        spec = essence.get("spec", {})
+        if "dashboard" in spec:
+            # serialized from the object of the event, its json is shared with the indexes and handlers
+            spec["dashboard"] = body["spec"]["dashboard"]
+        slim_spec(spec)
+        return essence
+
+    def fetch(self, *, body: kopf.Body) -> Optional[kopf.BodyEssence]:
+        """Last handled essence, with the hashed json when stored in full (before `--slim-diff-base`).
+
+        A full json compared with the hash from `build` would be a change of every resource on upgrade.
+        """
+        essence = super().fetch(body=body)
+        if essence is not None:
+            slim_spec(essence.get("spec", {}))
+        return essence
+
+
+def slim_spec(spec: dict):
+    """Replace the dashboard json of a diff-base spec with its digest, digests are kept as they are."""
+    if isinstance(spec.get("json"), str):
+        if not spec["json"].startswith(JSON_DIGEST_PREFIX):
+            spec["json"] = json_digest(spec["json"])
+    elif "dashboard" in spec:
+        # stored as the digest of the json written for it
+        spec["json"] = json_digest(serialize_dashboard(spec.pop("dashboard")))
+    if isinstance(spec.get("jsonGzip"), str):
+        if not spec["jsonGzip"].startswith(JSON_DIGEST_PREFIX):
+            # a change of the compressed payload is enough to trigger an update, which decompresses it
+            spec["jsonGzip"] = json_digest(spec["jsonGzip"])
@@ -0,0 +1,132 @@
+"""Local read-only HTTP API answering questions from the sidecar's in-memory indexes."""
+
+import itertools
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable
+from urllib.parse import parse_qs, unquote, urlsplit
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+class QueryError(Exception):
+    """Request which cannot be answered, with the http status to reply with."""
+
+    def __init__(self, status: int, message: str):
+        """Error status and message."""
+        self.status = status
+        self.message = message
+
+
+def page(items: Iterable, query: Dict[str, list]) -> dict:
+    """Slice items by the `limit` and `offset` query parameters."""
+    try:
+        limit = int(query.get("limit", [DEFAULT_LIMIT])[0])
+        offset = int(query.get("offset", [0])[0])
+    except ValueError:
+        raise QueryError(400, "limit and offset must be integers")
+    if not 0 < limit <= MAX_LIMIT or offset < 0:
+        raise QueryError(400, f"limit must be 1-{MAX_LIMIT} and offset positive")
+
+    # one extra item tells if there is a next page without counting all items
+    items = list(itertools.islice(items, offset, offset + limit + 1))
+    return {
+        "items": items[:limit],
+        "next": offset + limit if len(items) > limit else None,
+    }
+
+
+class QueryAPI(threading.Thread):
+    """Serve lookups of dashboard resources from the kopf indexes.
+
+    `indexes` returns the live indexes: `d_idx` (resource uid), `json_uids` (grafana uid), `paths_idx`
+    (dashboard path) and `error_uids` (error code), each mapping a key to resource values or uids.
+    Lookups are dict gets on the indexes, listings are paginated with `limit` and `offset`.
+
+    - `/v1/dashboards`: resource uids
+    - `/v1/dashboards/<uid>`: dashboard of a resource
+    - `/v1/grafana-uids/<uid>`: resources using a grafana uid
+    - `/v1/paths/<dir>/<name>.json`: resources writing a path
+    - `/v1/errors`: number of resources per error code
+    - `/v1/errors/<code>`: resources with an error code, paginated
+    """
+
+    def __init__(self, port: int, indexes: Callable[[], dict], host: str = "127.0.0.1"):
+        """Bind the http server, requests are served once the thread starts."""
+        super().__init__(name="query-api", daemon=True)
+        self.indexes = indexes
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                api.handle_request(self)
+
+            def log_message(self, format, *args):
+                logging.debug(f"query api: {format % args}")
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self.server.server_address[1]
+
+    def dashboards(self, uids: Iterable[str]) -> list:
+        """Resources with their dashboard for a list of resource uids."""
+        d_idx = self.indexes()["d_idx"]
+        return [{"uid": uid, "dashboards": list(d_idx.get(uid, []))} for uid in uids]
+
+    def route(self, path: str, query: Dict[str, list]) -> dict:
+        """Answer a request path."""
+        indexes = self.indexes()
+        parts = [unquote(part) for part in path.strip("/").split("/")]
+        if parts[0] != "v1" or len(parts) < 2:
+            raise QueryError(404, "not found")
+
+        resource, key = parts[1], "/".join(parts[2:])
+        if resource == "dashboards" and not key:
+            return page(iter(list(indexes["d_idx"])), query)
+        if resource == "errors" and not key:
+            return {
+                code: len(uids) for code, uids in list(indexes["error_uids"].items())
+            }
+
+        index = {
+            "dashboards": "d_idx",
+            "grafana-uids": "json_uids",
+            "paths": "paths_idx",
+            "errors": "error_uids",
+        }.get(resource)
+        if index is None or key not in indexes[index]:
+            raise QueryError(404, "not found")
+
+        if resource == "dashboards":
+            return self.dashboards([key])[0]
+        if resource == "errors":
+            result = page(iter(list(indexes[index][key])), query)
+            return {**result, "items": self.dashboards(result["items"])}
+        return {"items": self.dashboards(list(indexes[index][key]))}
+
+    def handle_request(self, request: BaseHTTPRequestHandler):
+        """Reply to a GET request with json."""
+        url = urlsplit(request.path)
+        try:
+            status, body = 200, self.route(url.path, parse_qs(url.query))
+        except QueryError as e:
+            status, body = e.status, {"error": e.message}
+
+        data = json.dumps(body).encode()
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def run(self):
+        """Serve requests until stopped."""
+        logging.info(f"query api started locally: http://localhost:{self.port}/v1")
+        self.server.serve_forever()
+
+    def stop(self):
+        """Stop serving requests."""
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,371 @@
+"""Scheduling of handler work: fair queuing, adaptive concurrency, retry backoff, warm start and batching."""
+
+import asyncio
+import collections
+import heapq
+import itertools
+import random
+import threading
+import time
+from typing import Dict
+
+# priority classes, lower first
+PRIORITY_FOREGROUND = 0  # new dashboards and deletes
+PRIORITY_UPDATE = 1  # spec updates
+PRIORITY_BACKGROUND = 2  # reconcile and drift repair
+PRIORITY_NAMES = ("foreground", "update", "background")
+
+
+class FairScheduler:
+    """Share a fixed number of slots between priority classes and namespaces.
+
+    At most `slots` items run at once. A freed slot goes to the highest priority class with waiting
+    items, background items at most take `background_slots` so foreground work never waits for a
+    whole round of them. Within a class the slot goes to the waiting namespace with the lowest virtual
+    time, which advances by 1/weight on each grant (start-time fair queuing), so namespaces with a
+    backlog share slots in proportion to their weight and cannot starve the others.
+    Must be used from a single event loop.
+    """
+
+    def __init__(
+        self,
+        slots: int,
+        weights: Dict[str, float] = None,
+        background_slots: int = None,
+    ):
+        """Scheduler parameters, namespaces without a weight get 1, background gets half the slots."""
+        self.slots = slots
+        self.weights = weights or {}
+        self.fixed_background_slots = background_slots
+        self.background_slots = background_slots or max(1, slots // 2)
+        self.active = 0
+        self.active_background = 0
+        self.queues = {priority: {} for priority in range(len(PRIORITY_NAMES))}
+        self.vtime = {}
+        self.clock = 0.0
+
+    def weight(self, namespace: str) -> float:
+        """Share of a namespace relative to the others."""
+        return self.weights.get(namespace, 1)
+
+    def start_time(self, namespace: str) -> float:
+        """Virtual time at which the namespace's next item would start."""
+        return max(self.vtime.get(namespace, 0.0), self.clock)
+
+    def depth(self, namespace: str, priority: int = None) -> int:
+        """Number of items of a namespace waiting for a slot, in all classes by default."""
+        priorities = self.queues if priority is None else (priority,)
+        return sum(len(self.queues[p].get(namespace, ())) for p in priorities)
+
+    def waiting(self, priority: int) -> bool:
+        """Return True if any item of the priority class or a higher one is waiting for a slot."""
+        return any(self.queues[p] for p in range(priority + 1))
+
+    def available(self, priority: int) -> bool:
+        """Return True if an item of the priority class can take a slot now."""
+        if self.active >= self.slots:
+            return False
+        return (
+            priority != PRIORITY_BACKGROUND
+            or self.active_background < self.background_slots
+        )
+
+    def grant(self, namespace: str, priority: int):
+        """Take a slot for the namespace."""
+        self.clock = self.start_time(namespace)
+        self.vtime[namespace] = self.clock + 1 / self.weight(namespace)
+        self.active += 1
+        if priority == PRIORITY_BACKGROUND:
+            self.active_background += 1
+
+    async def acquire(self, namespace: str, priority: int = PRIORITY_FOREGROUND):
+        """Wait for a slot, must be followed by `release` with the same priority."""
+        if self.available(priority) and not self.waiting(priority):
+            self.grant(namespace, priority)
+            return
+
+        queues = self.queues[priority]
+        waiter = asyncio.get_running_loop().create_future()
+        queues.setdefault(namespace, collections.deque()).append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # granted while being cancelled
+                self.release(priority)
+            else:
+                queues[namespace].remove(waiter)
+                if not queues[namespace]:
+                    del queues[namespace]
+            raise
+
+    def release(self, priority: int = PRIORITY_FOREGROUND):
+        """Give a slot back, handing it to the next items in line."""
+        self.active -= 1
+        if priority == PRIORITY_BACKGROUND:
+            self.active_background -= 1
+        self.dispatch()
+
+    def resize(self, slots: int):
+        """Change the number of slots, running items are never interrupted when shrinking."""
+        if slots == self.slots:
+            return
+        self.slots = slots
+        self.background_slots = self.fixed_background_slots or max(1, slots // 2)
+        self.dispatch()
+
+    def dispatch(self):
+        """Hand free slots to the next items in line."""
+        for waiting_priority, queues in self.queues.items():
+            while queues and self.available(waiting_priority):
+                namespace = min(queues, key=self.start_time)
+                waiter = queues[namespace].popleft()
+                if not queues[namespace]:
+                    del queues[namespace]
+                self.grant(namespace, waiting_priority)
+                waiter.set_result(None)
+            if queues:
+                # lower classes wait until this one is drained
+                return
+
+
+class AIMDController:
+    """Additive increase, multiplicative decrease of a concurrency limit.
+
+    Operation latencies and errors are recorded in windows of `window` operations. A window with an
+    error or a mean latency over `target` seconds multiplies the limit by `decrease`, any other window
+    adds `increase`, always within `minimum` and `maximum`. Thread safe.
+    """
+
+    def __init__(
+        self,
+        minimum: int,
+        maximum: int,
+        target: float,
+        increase: float = 1,
+        decrease: float = 0.5,
+        window: int = 10,
+    ):
+        """Controller parameters, starts at the maximum limit."""
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target = target
+        self.increase = increase
+        self.decrease = decrease
+        self.window = window
+        self.limit = float(maximum)
+        self.lock = threading.Lock()
+        self.samples = 0
+        self.latency = 0.0
+        self.errors = 0
+
+    @property
+    def slots(self) -> int:
+        """Current limit as a number of slots."""
+        return int(self.limit)
+
+    def record(self, seconds: float, error: bool = False) -> str:
+        """Record an operation, returns the decision taken when a window completes, otherwise None."""
+        with self.lock:
+            self.samples += 1
+            self.latency += seconds
+            self.errors += error
+            if self.samples < self.window:
+                return None
+
+            if self.errors or self.latency / self.samples > self.target:
+                limit = max(self.minimum, self.limit * self.decrease)
+                decision = "decrease"
+            else:
+                limit = min(self.maximum, self.limit + self.increase)
+                decision = "increase"
+            if limit == self.limit:
+                decision = "hold"
+            self.limit = limit
+            self.samples = 0
+            self.latency = 0.0
+            self.errors = 0
+            return decision
+
+
+class RetryBudget:
+    """Exponential backoff with full jitter and a budget of retries per path.
+
+    The n-th retry of a path is delayed by a random time up to `base * 2**n` seconds (at most
+    `cap`), spreading retries of many paths failing at once. Thread safe.
+    """
+
+    def __init__(self, budget: int = 5, base: float = 1, cap: float = 300):
+        """Retry parameters."""
+        self.budget = budget
+        self.base = base
+        self.cap = cap
+        self.lock = threading.Lock()
+        self.attempts = {}
+
+    def next_delay(self, path: str) -> float:
+        """Seconds to wait before retrying path, None (and the path forgotten) once out of budget."""
+        with self.lock:
+            attempt = self.attempts.get(path, 0)
+            if attempt >= self.budget:
+                self.attempts.pop(path, None)
+                return None
+            self.attempts[path] = attempt + 1
+
+        return random.uniform(0, min(self.cap, self.base * 2**attempt))
+
+    def reset(self, path: str):
+        """Forget the retries of a path, called when it succeeds."""
+        with self.lock:
+            self.attempts.pop(path, None)
+
+    def pending(self) -> int:
+        """Number of paths being retried."""
+        return len(self.attempts)
+
+
+class WarmStart:
+    """Spread the first checks of all resources after a start instead of running them at once.
+
+    Checks arriving within `window` seconds of the first are released by a token bucket at `rate`
+    per second. Missing files are released first and straight away, verifying an existing file is
+    delayed by a random time within the window. Checks arriving after the window pass through.
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, window: float, rate: float):
+        """Warm start parameters, the window starts with the first check."""
+        self.window = window
+        self.rate = rate
+        self.tokens = 1.0
+        self.started = None
+        self.refilled = None
+        self.heap = []
+        self.sequence = itertools.count()
+        self.dispatcher = None
+        self.wakeup = None
+
+    def active(self) -> bool:
+        """Return True while in the warm start phase."""
+        if self.started is None:
+            return True
+        if self.heap:
+            return True
+        return time.monotonic() - self.started < self.window
+
+    def pending(self, missing: bool) -> int:
+        """Number of checks waiting for release, of missing or of existing files."""
+        return sum(1 for priority, *_ in self.heap if (priority == 0) is missing)
+
+    async def wait(self, missing: bool):
+        """Wait for the check of a missing or existing file to be released."""
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        if self.started is None:
+            self.started = self.refilled = now
+        elif not self.active():
+            return
+
+        not_before = now if missing else now + random.uniform(0, self.window)
+        waiter = loop.create_future()
+        heapq.heappush(
+            self.heap, (0 if missing else 1, not_before, next(self.sequence), waiter)
+        )
+        if self.dispatcher is None or self.dispatcher.done():
+            self.wakeup = asyncio.Event()
+            self.dispatcher = loop.create_task(self.dispatch())
+        else:
+            # a missing file may have to go before the check being waited for
+            self.wakeup.set()
+        await waiter
+
+    async def sleep(self, seconds: float):
+        """Sleep until seconds passed or a new check arrived."""
+        self.wakeup.clear()
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def dispatch(self):
+        """Release waiting checks in priority order within the rate limit."""
+        while self.heap:
+            now = time.monotonic()
+            self.tokens = min(1.0, self.tokens + (now - self.refilled) * self.rate)
+            self.refilled = now
+
+            priority, not_before, _, waiter = self.heap[0]
+            if waiter.done():
+                # cancelled while waiting
+                heapq.heappop(self.heap)
+                continue
+            if not_before > now:
+                await self.sleep(not_before - now)
+                continue
+            if self.tokens < 1:
+                await self.sleep((1 - self.tokens) / self.rate)
+                continue
+
+            self.tokens -= 1
+            heapq.heappop(self.heap)
+            waiter.set_result(None)
+
+
+class Batcher:
+    """Gather items submitted within a short window into one call, per key.
+
+    The first item of a key opens a batch which is flushed `window` seconds later, or as soon as it
+    holds `max_size` items, by awaiting `flush(key, items)`. It returns one result per item: each
+    submitter gets its own result, or has it raised when it is an exception.
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, window: float, flush, max_size: int = 500):
+        """Batching parameters."""
+        self.window = window
+        self.flush = flush
+        self.max_size = max_size
+        self.batches = {}
+        self.tasks = set()
+
+    async def submit(self, key: str, item):
+        """Add an item to the open batch of key and wait for its result."""
+        loop = asyncio.get_running_loop()
+        if key not in self.batches:
+            batch = self.batches[key] = ([], asyncio.Event())
+            task = loop.create_task(self.run(key, batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+        items, full = self.batches[key]
+        future = loop.create_future()
+        items.append((item, future))
+        if len(items) >= self.max_size:
+            # later items open a new batch
+            del self.batches[key]
+            full.set()
+        return await future
+
+    async def run(self, key: str, batch: tuple):
+        """Flush a batch once its window passed or it is full."""
+        items, full = batch
+        try:
+            await asyncio.wait_for(full.wait(), self.window)
+        except asyncio.TimeoutError:
+            pass
+        if self.batches.get(key) is batch:
+            del self.batches[key]
+
+        try:
+            results = await self.flush(key, [item for item, _ in items])
+        except Exception as e:
+            results = [e] * len(items)
+
+        for (_, future), result in zip(items, results):
+            if future.done():
+                # submitter cancelled
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
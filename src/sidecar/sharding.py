@@ -0,0 +1,85 @@
+"""Consistent hash sharding of dashboards across sidecar replicas."""
+
+import bisect
+import hashlib
+import logging
+import socket
+import threading
+from typing import Callable, Iterable, List
+
+
+class HashRing:
+    """Consistent hash ring, each member is placed on the ring `vnodes` times.
+
+    Adding or removing a member only moves the keys of that member (about 1/N of keys).
+    """
+
+    def __init__(self, members: Iterable[str], vnodes: int = 64):
+        """Build the ring from a list of member names."""
+        self.members = sorted(set(members))
+        self.ring = sorted(
+            (self.hash(f"{member}#{vnode}"), member)
+            for member in self.members
+            for vnode in range(vnodes)
+        )
+        self.points = [point for point, _ in self.ring]
+
+    @staticmethod
+    def hash(key: str) -> int:
+        """Position on the ring for a key."""
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def owner(self, key: str) -> str:
+        """Return the member owning key, None if the ring is empty."""
+        if not self.ring:
+            return None
+
+        index = bisect.bisect(self.points, self.hash(key)) % len(self.ring)
+        return self.ring[index][1]
+
+
+def dns_members(service: str) -> List[str]:
+    """Addresses of a (headless) service, one per replica."""
+    return sorted(
+        {info[4][0] for info in socket.getaddrinfo(service, None, socket.AF_INET)}
+    )
+
+
+class MembershipRefresher(threading.Thread):
+    """Periodically rediscover members, calling on_change with the new member list."""
+
+    def __init__(
+        self,
+        discover: Callable[[], List[str]],
+        on_change: Callable[[List[str]], None],
+        interval: float = 30,
+    ):
+        """Refresher parameters, discovery starts with the thread."""
+        super().__init__(name="shard-membership", daemon=True)
+        self.discover = discover
+        self.on_change = on_change
+        self.interval = interval
+        self.members = None
+        self.stop_flag = threading.Event()
+
+    def refresh(self):
+        """Discover members once, on_change only called when the members differ."""
+        try:
+            members = self.discover()
+        except OSError as e:
+            logging.error(f"shard member discovery failed: {e}")
+            return
+
+        if members and members != self.members:
+            self.members = members
+            self.on_change(members)
+
+    def run(self):
+        """Refresh until stopped."""
+        while not self.stop_flag.is_set():
+            self.refresh()
+            self.stop_flag.wait(self.interval)
+
+    def stop(self):
+        """Stop the refresher thread."""
+        self.stop_flag.set()
@@ -3,23 +3,102 @@
 import asyncio
 import collections
 import contextlib
-import json
+import contextvars
+import functools
 import logging
+import os
 import re
+import shutil
 import signal
+import socket
 import sys
+import tempfile
 import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
 from pathlib import Path
-from typing import Tuple
+from types import SimpleNamespace
+from typing import List, Optional, Tuple
 
 import click
 import kopf
-from prometheus_client import Counter, Gauge, start_http_server
+import kubernetes
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    multiprocess,
+    start_http_server,
+)
 
+import sidecar.dashboard_files as dashboard_files
 import sidecar.exceptions as exceptions
 
 # Local Libraries
-from sidecar.dashboard_files import check_file, create_file, delete_file, update_file
+from sidecar.config_maps import ConfigMapCache
+from sidecar.dashboard_files import (
+    BLOB_DIR,
+    canonicalize,
+    check_file,
+    content_hash,
+    create_file,
+    dashboard_size,
+    delete_file,
+    delete_files,
+    extract_json_fields,
+    gc_blobs,
+    high_water_bytes,
+    init_usage,
+    prime_json_cache,
+    restore_blob,
+    serialize_dashboard,
+    set_high_water,
+    set_volatile_fields,
+    track_usage,
+    update_file,
+    usage_changes,
+)
+from sidecar.history import (
+    HISTORY_DIR,
+    clear_rollback,
+    enforce_size,
+    history_size,
+    record_version,
+    rolled_back,
+)
+from sidecar.orphans import OrphanCollector
+from sidecar.payload import decompress_json
+from sidecar.persistence import (
+    JSON_DIGEST_PREFIX,
+    SlimDiffBaseStorage,
+    stored_spec_hash,
+)
+from sidecar.query_api import QueryAPI
+from sidecar.scheduling import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_FOREGROUND,
+    PRIORITY_NAMES,
+    PRIORITY_UPDATE,
+    AIMDController,
+    Batcher,
+    FairScheduler,
+    RetryBudget,
+    WarmStart,
+)
+from sidecar.sharding import HashRing, MembershipRefresher, dns_members
+from sidecar.validation import (
+    check_meta,
+    dashboard_hash,
+    get_dashboard_json_meta,
+    get_dashboard_meta,
+    is_parsed,
+    prime_parse,
+    validate_dashboard_process,
+)
+from sidecar.watcher import WorkingDirWatcher
 
 # Globals
 metrics_prefix = "k8s_grafana_sidecar"
@@ -39,17 +118,388 @@ delete_counter = Counter(
 update_counter = Counter(
     f"{metrics_prefix}_updated_resources", "updated resources counter", ["value"]
 )
+drift_counter = Counter(
+    f"{metrics_prefix}_drift_events",
+    "working dir changes detected by the watcher",
+    ["result"],
+)
+skipped_counter = Counter(
+    f"{metrics_prefix}_skipped_writes",
+    "file writes and status patches skipped as nothing changed",
+    ["type"],
+)
+watch_pending_gauge = Gauge(
+    f"{metrics_prefix}_watch_pending",
+    "working dir changes waiting to be checked",
+    multiprocess_mode="livesum",
+)
+validation_queue_gauge = Gauge(
+    f"{metrics_prefix}_validation_queue",
+    "dashboards waiting for or in validation in the process pool",
+)
+validation_histogram = Histogram(
+    f"{metrics_prefix}_validation_seconds",
+    "time taken to validate a dashboard in the process pool including queue time",
+)
+dashboard_size_histogram = Histogram(
+    f"{metrics_prefix}_dashboard_size_bytes",
+    "size of dashboard json handled",
+    buckets=[2**i * 1024 for i in range(0, 16, 2)],
+)
+managed_bytes_gauge = Gauge(
+    f"{metrics_prefix}_managed_bytes",
+    "total size of dashboard json managed",
+    multiprocess_mode="livesum",
+)
+shard_members_gauge = Gauge(
+    f"{metrics_prefix}_shard_members",
+    "number of sidecar replicas sharing the dashboards",
+)
+shard_owned_gauge = Gauge(
+    f"{metrics_prefix}_shard_owned_resources",
+    "number of resources in this sidecar's shard",
+    multiprocess_mode="livesum",
+)
+fair_queue_gauge = Gauge(
+    f"{metrics_prefix}_fair_queue_depth",
+    "handler calls waiting for a worker slot",
+    ["namespace"],
+)
+fair_wait_histogram = Histogram(
+    f"{metrics_prefix}_fair_queue_wait_seconds",
+    "time handler calls waited for a worker slot",
+    ["namespace"],
+)
+priority_queue_gauge = Gauge(
+    f"{metrics_prefix}_priority_queue_depth",
+    "handler calls waiting for a worker slot by priority class",
+    ["priority"],
+)
+priority_wait_histogram = Histogram(
+    f"{metrics_prefix}_priority_queue_wait_seconds",
+    "time handler calls waited for a worker slot by priority class",
+    ["priority"],
+)
+fs_latency_histogram = Histogram(
+    f"{metrics_prefix}_fs_operation_seconds",
+    "time taken by dashboard file create, update and delete operations",
+)
+concurrency_limit_gauge = Gauge(
+    f"{metrics_prefix}_concurrency_limit",
+    "number of handler worker slots in use by the scheduler",
+    multiprocess_mode="livesum",
+)
+concurrency_decisions_counter = Counter(
+    f"{metrics_prefix}_concurrency_decisions",
+    "adaptive concurrency limit decisions",
+    ["decision"],
+)
+retry_counter = Counter(
+    f"{metrics_prefix}_transient_error_retries",
+    "handler retries after transient file system errors",
+    ["error", "result"],
+)
+retry_pending_gauge = Gauge(
+    f"{metrics_prefix}_transient_error_retry_paths",
+    "dashboard paths being retried after transient file system errors",
+    multiprocess_mode="livesum",
+)
+working_dir_bytes_gauge = Gauge(
+    f"{metrics_prefix}_working_dir_bytes",
+    "bytes of dashboards in a working dir directory",
+    ["dir"],
+)
+working_dir_files_gauge = Gauge(
+    f"{metrics_prefix}_working_dir_files",
+    "number of dashboards in a working dir directory",
+    ["dir"],
+)
+working_dir_high_water_gauge = Gauge(
+    f"{metrics_prefix}_working_dir_high_water_bytes",
+    "working dir bytes (volume bytes in use with a percent) above which dashboard writes are refused (0 disabled)",
+)
+warm_start_pending_gauge = Gauge(
+    f"{metrics_prefix}_warm_start_pending",
+    "reconciles waiting in the warm start after a restart",
+    ["kind"],
+    multiprocess_mode="livesum",
+)
+warm_start_released_counter = Counter(
+    f"{metrics_prefix}_warm_start_released",
+    "reconciles released by the warm start after a restart",
+    ["kind"],
+)
+history_bytes_gauge = Gauge(
+    f"{metrics_prefix}_history_bytes",
+    "compressed bytes of the dashboard version history",
+    # the history of the shared working dir, as last measured by any worker
+    multiprocess_mode="livemax",
+)
+orphan_removed_counter = Counter(
+    f"{metrics_prefix}_orphan_files_removed",
+    "dashboard files removed as no resource writes them (finalizer-less mode)",
+)
+orphan_pending_gauge = Gauge(
+    f"{metrics_prefix}_orphan_files_pending",
+    "orphaned dashboard files removed on the next collection if still orphaned",
+    multiprocess_mode="livesum",
+)
+gzip_seconds_histogram = Histogram(
+    f"{metrics_prefix}_json_gzip_decompress_seconds",
+    "time taken to decompress dashboards sent as spec.jsonGzip",
+)
+gzip_ratio_histogram = Histogram(
+    f"{metrics_prefix}_json_gzip_ratio",
+    "compression ratio (json bytes / jsonGzip bytes) of dashboards sent as spec.jsonGzip",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+delete_batch_histogram = Histogram(
+    f"{metrics_prefix}_delete_batch_size",
+    "number of dashboards deleted together in a batch",
+    buckets=(1, 5, 10, 50, 100, 250, 500, 1000),
+)
+config_map_updates_counter = Counter(
+    f"{metrics_prefix}_config_map_updates",
+    "dashboard files refreshed after a change of the ConfigMap their json is read from",
+    ["result"],
+)
+config_map_cache_gauge = Gauge(
+    f"{metrics_prefix}_config_map_cache",
+    "number of referenced ConfigMaps cached",
+    multiprocess_mode="livesum",
+)
+# gauges computed when collected, see gauge_function
+GAUGE_EXPORT_INTERVAL = 5.0
+_gauge_functions = []
 _working_dir = "/app/grafana-dashboards"
 _max_workers = 20
+# fair share of the handler workers between namespaces, weights by namespace (default 1)
+_namespace_weights = {}
+_scheduler = FairScheduler(_max_workers)
+_executor = None
+# backoff and retry budget per path for transient file system errors
+_retry_budget = RetryBudget()
+# spreads the first reconciles after a start, None when disabled
+_warm_start = None
+# without finalizers deletions are handled when seen and files orphaned while down are collected
+_finalizers = True
+# periodic reconcile of every dashboard, by a kopf timer or without finalizers by reconcile_loop
+RECONCILE_INTERVAL = 86400
+RECONCILE_INITIAL_DELAY = 5
+_reconcile_task = None
+# last handled configuration stored with a hash of the json instead of the json
+_slim_diff_base = True
+# gathers deletes arriving together (namespace teardown), None deletes one by one
+_delete_batcher = None
+# bounded version history per dashboard path, 0 versions disables
+_history_versions = 0
+_history_max_bytes = 64 * 1024 * 1024
+_history_bytes = 0
+_history_lock = threading.Lock()
+# adaptive limit of the scheduler slots, None for a fixed `--max-workers`
+_concurrency = None
+# json of dashboards read from ConfigMaps (`--config-map-refs`), None when disabled
+_config_maps = None
+# live view of the config_map_refs index, dependent dashboards by ConfigMap
+_config_map_refs = {}
+# operator event loop, background work from other threads is scheduled on
+_loop = None
+_content_store = False
+_canonical_json = False
+_validation_pool = None
+_validation_offload_size = 1024 * 1024
+_max_dashboard_size = 10 * 1024 * 1024
+_namespaces = []
+_label_selector = ""
+_field_selector = ""
+# consistent hash ring of sidecar replicas, None when not sharded
+_shard_ring = None
+_shard_self = ""
+# hash ring of supervised worker processes by namespace, None when not a worker or namespaces are
+# split between the workers' watches
+_worker_ring = None
+_worker_self = ""
+# name of this replica's (and worker's) finalizer and annotations, empty for kopf's default keys
+_persistence_name = ""
+
+
+def gauge_function(gauge: Gauge, function):
+    """Compute the gauge when collected.
+
+    Metrics of worker processes (`--processes`) are collected from the files of prometheus multiprocess
+    mode, which never calls gauge functions, workers set them every GAUGE_EXPORT_INTERVAL seconds with
+    export_gauges instead.
+    """
+    gauge.set_function(function)
+    _gauge_functions.append((gauge, function))
+
+
+def export_gauges():
+    """Set the computed gauges to their current value."""
+    for gauge, function in _gauge_functions:
+        try:
+            gauge.set(function())
+        except Exception as e:
+            logging.error(f"unexpected error computing gauge: {e}")
+
+
+def export_gauges_loop(stop_flag: threading.Event):
+    """Export the computed gauges of a worker process until stopped."""
+    while not stop_flag.wait(GAUGE_EXPORT_INTERVAL):
+        export_gauges()
+
+
+def in_worker(namespace: str) -> bool:
+    """Return True if the namespace belongs to this worker process (always when not a worker)."""
+    return _worker_ring is None or _worker_ring.owner(namespace) == _worker_self
+
+
+def persistence_prefix() -> str:
+    """Prefix of the finalizer kopf keeps on dashboard resources.
+
+    kopf is blind to resources whose handlers are all filtered out by `in_shard`: only the owning
+    replica and worker handles a change and writes its progress and diff-base annotations, which are
+    shared. But kopf removes a finalizer no matching handler requires, replicas and workers sharing
+    the resources keep their own finalizer so they do not remove the owner's.
+    """
+    if not _persistence_name:
+        return "kopf.zalando.org"
+    return f"{_persistence_name}.kopf.zalando.org"
+
+
+def persistence_name(*names: str) -> str:
+    """Name usable in an annotation prefix (dns subdomain) for shard and worker names."""
+    parts = [re.sub(r"[^a-z0-9-]+", "-", name.lower()).strip("-") for name in names]
+    return ".".join(part for part in parts if part)
+
+
+def in_shard(namespace: str, uid: str, **kwargs) -> bool:
+    """Return True if the resource belongs to this sidecar's shard (always when not sharded).
+
+    Used as the `when` filter of the handlers, resources of other shards are still indexed.
+    """
+    if not in_worker(namespace):
+        return False
+
+    if _shard_ring is None:
+        return True
+
+    return _shard_ring.owner(f"{namespace}/{uid}") == _shard_self
+
+
+# live view of the d_idx index for use outside of kopf handlers (working dir watcher)
+_d_idx = {}
+# live views of the indexes served by the query api
+_indexes = {"d_idx": {}, "json_uids": {}, "paths_idx": {}, "error_uids": {}}
+
+
+# errors resolving the json of a spec, reported by the handlers
+SPEC_ERRORS = (
+    exceptions.invalidJsonGzip,
+    exceptions.dashboardTooLarge,
+    exceptions.configMapKeyNotFound,
+    exceptions.configMapUnavailable,
+    exceptions.configMapRefsDisabled,
+)
+
+
+def config_map_ref(spec: object) -> dict:
+    """The `jsonFrom.configMapKeyRef` of a spec, None when the dashboard is in the spec."""
+    if "json" in spec or "jsonGzip" in spec or "dashboard" in spec:
+        return None
+    return (spec.get("jsonFrom") or {}).get("configMapKeyRef")
+
+
+def resolve_spec(spec: object, namespace: str = "") -> object:
+    """Spec with the dashboard `json`, serialized from `dashboard`, decompressed from `jsonGzip` or read
+    from a ConfigMap.
+
+    Raises invalidJsonGzip or dashboardTooLarge (checked while decompressing), configMapKeyNotFound,
+    configMapUnavailable or configMapRefsDisabled.
+    """
+    if "json" in spec:
+        return spec
+    if "dashboard" in spec:
+        # serialized once in the form written to disk
+        return {
+            **spec,
+            "json": serialize_dashboard(spec["dashboard"], _canonical_json),
+        }
+
+    ref = config_map_ref(spec)
+    if ref:
+        if _config_maps is None:
+            raise exceptions.configMapRefsDisabled
+        return {**spec, "json": _config_maps.get(namespace, ref["name"], ref["key"])}
+    if "jsonGzip" not in spec:
+        return spec
+
+    dashboard_json, seconds = decompress_json(spec["jsonGzip"], _max_dashboard_size)
+    if seconds is not None:
+        gzip_seconds_histogram.observe(seconds)
+        gzip_ratio_histogram.observe(
+            dashboard_size(dashboard_json) / max(1, len(spec["jsonGzip"]))
+        )
+    return {**spec, "json": dashboard_json}
+
+
+def spec_json(spec: object, namespace: str = "") -> str:
+    """Dashboard json of a spec for the indexes, empty if it cannot be resolved (reported by handlers).
+
+    Indexes run in the event loop, json from a ConfigMap is only read from the cache.
+    """
+    ref = config_map_ref(spec)
+    if ref:
+        if _config_maps is None:
+            return ""
+        return _config_maps.cached(namespace, ref["name"], ref["key"]) or ""
+    try:
+        return resolve_spec(spec, namespace)["json"]
+    except SPEC_ERRORS:
+        return ""
 
 
 @kopf.index("example.co.uk", "v1", "grafanadashboards")
-def d_idx(uid: str, spec: object, **kwargs):
-    """Return dashboard based on UID as index."""
+def d_idx(
+    uid: str,
+    spec: object,
+    namespace: str = "",
+    status: object = None,
+    meta: object = None,
+    **kwargs,
+):
+    """Return dashboard based on UID as index.
+
+    Json left to the validation pool is not parsed here, its hash is the one recorded in the status
+    when the handler wrote this generation.
+    """
+    dashboard_json = spec_json(spec, namespace)
+    size = dashboard_size(dashboard_json)
+    # oversize dashboards are rejected by the handlers and other shards' are never written, do not
+    # parse them here. Json from a ConfigMap changes without an event of the resource, its files are
+    # kept up to date by the ConfigMap watch instead of the drift checks.
+    hashed = (
+        size <= _max_dashboard_size
+        and in_shard(namespace, uid)
+        and not config_map_ref(spec)
+    )
+    status, meta = status or {}, meta or {}
+    if not hashed:
+        hashed = ""
+    elif validated_in_process(dashboard_json):
+        hashed = dashboard_hash(dashboard_json)
+    elif status.get("observedGeneration") == meta.get("generation"):
+        hashed = status.get("hash", "")
+    else:
+        hashed = ""
     return {
         uid: {
             "dir": spec["dir"],
             "name": spec["name"],
+            "namespace": namespace,
+            "resource": kwargs.get("name", ""),
+            "hash": hashed,
+            "size": size,
         }
     }
 
@@ -61,16 +511,98 @@ def errors_idx(status: object, **kwargs):
         return status["reason"]
 
 
+def top_level_fields(dashboard: object) -> dict:
+    """Return the uid and title of a dashboard object."""
+    if not isinstance(dashboard, dict):
+        return {}
+    return {key: dashboard[key] for key in ("uid", "title") if key in dashboard}
+
+
 @kopf.index("example.co.uk", "v1", "grafanadashboards")
-def json_uids(uid: str, spec: object, logger: logging, **kwargs) -> object:
-    """Return dashboard and uid."""
+def json_uids(
+    uid: str, spec: object, logger: logging, status: object = None, **kwargs
+) -> object:
+    """Return dashboard and uid.
+
+    Only valid dashboards are indexed, invalid ones are never written so their uid is not taken. The
+    json of this shard's dashboards is parsed once (cached) for the index, d_idx and the handlers.
+    Other shards' dashboards are validated by their owner, only their uid and title are read and
+    those in error are left out. So is json left to the validation pool until it has been parsed. Dashboards sent as an object are already decoded and checked
+    without serializing.
+    """
+    namespace = kwargs.get("namespace", "")
+    owned = in_shard(namespace, uid)
+    if not owned and (status or {}).get("state") == "error":
+        return
+
     try:
-        dashboard_uid, _ = get_dashboard_json_meta(spec["json"])
+        if "dashboard" in spec:
+            if owned:
+                dashboard_uid, _ = get_dashboard_meta(spec["dashboard"])
+            else:
+                dashboard_uid, _ = check_meta(top_level_fields(spec["dashboard"]), None)
+            return {dashboard_uid: uid}
+
+        dashboard_json = spec_json(spec, namespace)
+        if not dashboard_json or dashboard_size(dashboard_json) > _max_dashboard_size:
+            return
+
+        if owned and validated_in_process(dashboard_json):
+            dashboard_uid, _ = get_dashboard_json_meta(dashboard_json)
+        else:
+            fields = extract_json_fields(dashboard_json, ("uid", "title"))
+            dashboard_uid, _ = check_meta(fields, None)
         return {dashboard_uid: uid}
     except Exception as e:
         logger.error(f"unexpected error getting dashboard json meta: {e}")
 
 
+@kopf.index("example.co.uk", "v1", "grafanadashboards")
+def error_uids(uid: str, status: object, **kwargs):
+    """Return uid by error code."""
+    if "reason" in status and status["reason"] not in ("", "ok"):
+        return {status["reason"]: uid}
+
+
+@kopf.index("example.co.uk", "v1", "grafanadashboards")
+def paths_idx(uid: str, spec: object, **kwargs):
+    """Return uid by dashboard path."""
+    return {"{}.json".format(Path(spec["dir"], spec["name"])): uid}
+
+
+@kopf.index("example.co.uk", "v1", "grafanadashboards")
+def config_map_refs(uid: str, spec: object, namespace: str = "", **kwargs):
+    """Return dashboard by the ConfigMap its json is read from."""
+    ref = config_map_ref(spec)
+    if ref:
+        return {
+            (namespace, ref["name"]): {
+                "uid": uid,
+                "dir": spec["dir"],
+                "name": spec["name"],
+                "configMap": ref["name"],
+                "key": ref["key"],
+            }
+        }
+
+
+@kopf.on.event("example.co.uk", "v1", "grafanadashboards")
+def share_indexes(
+    d_idx: kopf.Index,
+    json_uids: kopf.Index,
+    paths_idx: kopf.Index,
+    error_uids: kopf.Index,
+    config_map_refs: kopf.Index,
+    **kwargs,
+):
+    """Keep live views of the indexes for use outside of kopf handlers (query api, ConfigMap watch)."""
+    global _config_map_refs
+    _config_map_refs = config_map_refs
+    _indexes.update(
+        d_idx=d_idx, json_uids=json_uids, paths_idx=paths_idx, error_uids=error_uids
+    )
+
+
 @kopf.on.event("example.co.uk", "v1", "grafanadashboards")
 def error_count(errors_idx: kopf.Index, logger: logging, **kwargs):
     """Return error count stored in prometheus metrics."""
@@ -85,12 +617,14 @@ def error_count(errors_idx: kopf.Index, logger: logging, **kwargs):
 @kopf.on.event("example.co.uk", "v1", "grafanadashboards")
 def resource_count(d_idx: kopf.Index, logger: logging, **kwargs):
     """Update metrics with number of managed resources."""
+    global _d_idx
+    _d_idx = d_idx
+
     dashboard_count = len(d_idx)
     resources_gauge.set(dashboard_count)
     logger.info(f"dashboard resources: {dashboard_count}")
 
 
-@kopf.timer("example.co.uk", "v1", "grafanadashboards", interval=86400, initial_delay=5)
 def reconcile(
     json_uids: kopf.Index,
     patch: object,
@@ -98,6 +632,7 @@ def reconcile(
     spec: object,
     status: object,
     logger: logging,
+    meta: object = None,
     **kwargs,
 ):
     """Ensure all changes filesystem side reconciled with kubernetes state.
@@ -112,66 +647,447 @@ def reconcile(
     filename = "{}.json".format(Path(spec["dir"], spec["name"]))
 
     try:
+        spec = resolve_spec(spec, kwargs.get("namespace", ""))
         check_file(_working_dir, filename, spec["json"])
     except exceptions.noFileExists as e:
         logger.warning(
             f"recreating missing file: {_working_dir}/{filename} ({uid}) - {e.code}"
         )
-        create(json_uids, patch, uid, spec, logger)
+        create(json_uids, patch, uid, spec, logger, status, meta)
     except exceptions.jsonMismatch as e:
+        file_hash = content_hash(Path(_working_dir, filename).read_text())
+        if rolled_back(_working_dir, filename, file_hash):
+            # restored from the history on purpose, left until the resource changes
+            logger.info(f"rolled back dashboard: {filename} ({uid})")
+            set_status(patch, status, state="warning", reason="rolled_back")
+            return
         # have diasabled `update_file` as it would overwrite changes made to the dashboard
         # in the UI which assumed is intentional?
         # update_file(_working_dir, filename, None, spec['json'])
         logger.warning(
             f"json drift for: {filename} ({uid}) - currently configured not to reconcile drift"
         )
-        patch.status["reason"] = e.code
-        patch.status["state"] = "warning"
+        set_status(patch, status, state="warning", reason=e.code)
     except Exception as e:
         logger.info(f"unexpected error when checking file: {e}")
 
     logger.info("reconciled state: complete")
 
 
-def get_dashboard_json_meta(dashboard_json: str) -> Tuple[str, str]:
-    """Return the grafana title and grafana uid from json if valid, otherwise None.
+def set_status(patch: object, status: object, **fields):
+    """Patch status fields, only fields which change are added to the patch.
 
-    [json model](https://grafana.com/docs/grafana/latest/dashboards/json-model/)
-
-    :param dashboard_json: json taken from k8s object (spec.json)
-    :type dashboard_json: string
-    :return: grafana uid, grafana title
-    :rtype: string, string
+    An empty patch means no api write, and no watch event running the event handlers again.
     """
+    status = status or {}
+    skipped = True
+    for field, value in fields.items():
+        if value is not None and status.get(field) != value:
+            patch.status[field] = value
+            skipped = False
+
+    if skipped:
+        skipped_counter.labels("status").inc()
+
+
+def set_status_ok(patch: object, status: object, meta: object, dashboard_json: str):
+    """Patch status to ok recording the generation and content hash handled."""
+    set_status(
+        patch,
+        status,
+        state="ok",
+        reason="",
+        observedGeneration=(meta or {}).get("generation"),
+        hash=content_hash(dashboard_json),
+    )
+
+
+def spec_output(spec: object) -> str:
+    """Return the json of a resolved spec as written to the working dir."""
+    if "dashboard" in spec:
+        # serialized in this form by resolve_spec
+        return spec["json"]
+    return dashboard_output(spec["json"])
+
+
+def dashboard_output(dashboard_json: str) -> str:
+    """Return the json as written to the working dir, minified with sorted keys if configured."""
+    if not _canonical_json:
+        return dashboard_json
+
     try:
-        dashboard_json = json.loads(dashboard_json)
+        return canonicalize(dashboard_json)
     except ValueError:
-        raise exceptions.invalidJson
-
-    if "uid" not in dashboard_json:
-        raise exceptions.invalidJsonNoUid
-    elif len(dashboard_json["uid"]) > 40:
-        raise exceptions.invalidJsonUidTooLong
-    elif not re.match(r"^([\w\_\-])*$", dashboard_json["uid"]):
-        raise exceptions.invalidJsonUidUnexpectedCharacters
-
-    if "title" not in dashboard_json:
-        raise exceptions.invalidJsonNoTitle
-    elif not re.match(
-        r"^[\w\_\-\s!£$%^&*+=#@:;,.\'\"~?(){}\[\]<>/]*$", dashboard_json["title"]
-    ):
-        raise exceptions.invalidJsonTitleUnexpectedCharacters
+        # left for create_file/update_file to reject
+        return dashboard_json
+
+
+def owned_paths():
+    """Return the dashboard path of every indexed resource."""
+    for dashboards in list(_d_idx.values()):
+        for dashboard in dashboards:
+            yield "{}.json".format(Path(dashboard["dir"], dashboard["name"]))
 
-    return dashboard_json["uid"], dashboard_json["title"]
+
+def check_drift(path: str):
+    """Check a path changed on the working dir against the resource owning it.
+
+    Called by the working dir watcher, in the background priority class. Missing files are restored
+    from the content store when enabled, otherwise the owning resource is reconciled: the file is
+    recreated from its spec and json drift reported on its status in keeping with `reconcile`.
+    """
+    uid = next(iter(_indexes["paths_idx"].get(path, [])), None)
+    dashboard = next(
+        (
+            dashboard
+            for dashboard in _d_idx.get(uid, [])
+            if "{}.json".format(Path(dashboard["dir"], dashboard["name"])) == path
+        ),
+        None,
+    )
+    if dashboard is None or not dashboard["hash"]:
+        # not owned, or not handled by this sidecar
+        return
+
+    full_path = Path(_working_dir, path)
+    if not full_path.is_file():
+        # removed outside the sidecar, counted again once restored or recreated
+        track_usage(path)
+        if _content_store and restore_blob(_working_dir, full_path):
+            drift_counter.labels("restored").inc()
+            logging.warning(f"restored missing file: {_working_dir}/{path} ({uid})")
+            return
+        drift_counter.labels("no_file_exists").inc()
+        logging.warning(f"missing file: {_working_dir}/{path} ({uid}) - recreating")
+    elif (file_hash := content_hash(full_path.read_text())) != dashboard["hash"]:
+        if rolled_back(_working_dir, path, file_hash):
+            drift_counter.labels("rolled_back").inc()
+            logging.info(f"rolled back dashboard: {path} ({uid})")
+        else:
+            drift_counter.labels("json_mismatch").inc()
+            logging.warning(f"json drift for: {path} ({uid})")
+    else:
+        drift_counter.labels("ok").inc()
+        return
+
+    reconcile_resource(uid, dashboard)
+
+
+def reconcile_resource(uid: str, dashboard: dict):
+    """Reconcile a dashboard outside of its kopf handlers, patching the status of its resource.
+
+    The index only keeps the path and hash of a dashboard, its spec and status are read from the api
+    server. Errors are logged, the next reconcile of the resource runs on its handlers.
+    """
+    namespace = dashboard.get("namespace", "")
+    patch = SimpleNamespace(status={})
+    try:
+        resource = read_resource(namespace, dashboard["resource"])
+        if resource is None:
+            return
+        try:
+            reconcile(
+                _indexes["json_uids"],
+                patch,
+                uid,
+                resource["spec"],
+                resource.get("status", {}),
+                logging,
+                resource.get("metadata", {}),
+                namespace=namespace,
+            )
+        except kopf.PermanentError:
+            # the error is recorded in the status patch
+            pass
+        if patch.status:
+            # the dashboard CRD has no status subresource, status is patched on the resource
+            kubernetes.client.CustomObjectsApi().patch_namespaced_custom_object(
+                "example.co.uk",
+                "v1",
+                namespace,
+                "grafanadashboards",
+                dashboard["resource"],
+                {"status": patch.status},
+            )
+    except Exception as e:
+        logging.error(
+            f"reconciling dashboard failed: {dashboard['resource']} ({uid}) - {getattr(e, 'code', e)}"
+        )
+
+
+def set_shard_members(members: List[str]):
+    """Rebuild the shard ring, releasing dashboards which moved to another shard and adopting the
+    dashboards which moved into this one.
+
+    kopf only evaluates the handler filters on events of a resource, a dashboard changing shard gets
+    no create (or reconcile timer) on its new owner, nor stops the reconcile timer of the old one.
+    """
+    global _shard_ring
+    dashboards = [
+        (uid, dashboard)
+        for uid, indexed in list(_d_idx.items())
+        for dashboard in indexed
+        # other workers' dashboards are released and adopted by those workers
+        if in_worker(dashboard.get("namespace", ""))
+    ]
+    owned = {
+        (uid, dashboard["dir"], dashboard["name"])
+        for uid, dashboard in dashboards
+        if in_shard(dashboard.get("namespace", ""), uid)
+    }
+    members = sorted(set(members) | {_shard_self})
+    _shard_ring = HashRing(members)
+    shard_members_gauge.set(len(members))
+    logging.info(f"shard members: {members} (self: {_shard_self})")
+
+    for uid, dashboard in dashboards:
+        was_owned = (uid, dashboard["dir"], dashboard["name"]) in owned
+        if in_shard(dashboard.get("namespace", ""), uid):
+            if not was_owned:
+                adopt_dashboard(uid, dashboard)
+        elif was_owned:
+            release_dashboard(uid, dashboard)
+
+
+def release_dashboard(uid: str, dashboard: dict):
+    """Remove the file of a dashboard which moved to another shard."""
+    filename = "{}.json".format(Path(dashboard["dir"], dashboard["name"]))
+    try:
+        delete_file(_working_dir, filename, _content_store)
+        logging.info(f"released dashboard to another shard: {filename} ({uid})")
+    except exceptions.noFileExists:
+        pass
+    except Exception as e:
+        logging.error(f"unexpected error releasing dashboard: {e} ({uid})")
+
+
+def read_resource(namespace: str, name: str) -> object:
+    """Dashboard resource from the api server, None if it no longer exists."""
+    try:
+        return kubernetes.client.CustomObjectsApi().get_namespaced_custom_object(
+            "example.co.uk", "v1", namespace, "grafanadashboards", name
+        )
+    except kubernetes.client.ApiException as e:
+        if e.status == 404:
+            return None
+        raise
+
+
+def read_dashboard(namespace: str, name: str) -> object:
+    """Spec of a dashboard resource from the api server, None if it no longer exists."""
+    resource = read_resource(namespace, name)
+    return None if resource is None else resource["spec"]
+
+
+def adopt_dashboard(uid: str, dashboard: dict):
+    """Write the file of a dashboard which moved into this shard, read from the api server.
+
+    The index only keeps the path and hash of a dashboard, not its json. Errors are logged, the
+    resource's next change runs the handlers on this shard.
+    """
+    namespace = dashboard.get("namespace", "")
+    filename = "{}.json".format(Path(dashboard["dir"], dashboard["name"]))
+    try:
+        spec = read_dashboard(namespace, dashboard["resource"])
+        if spec is None:
+            return
+        spec = resolve_spec(spec, namespace)
+        check_dashboard_size(spec["json"])
+        validate_spec(spec)
+        with fs_operation():
+            create_file(_working_dir, filename, spec_output(spec), _content_store)
+        record_history(filename, spec_output(spec), logging)
+        logging.info(f"adopted dashboard from another shard: {filename} ({uid})")
+    except exceptions.duplicateName:
+        # already written, e.g. before a restart
+        pass
+    except Exception as e:
+        logging.error(
+            f"adopting dashboard from another shard failed: {filename} ({uid}) - {getattr(e, 'code', e)}"
+        )
+
+
+def shard_owned() -> int:
+    """Number of indexed resources in this sidecar's shard."""
+    return sum(
+        1
+        for uid, dashboards in list(_d_idx.items())
+        for dashboard in dashboards
+        if in_shard(dashboard.get("namespace", ""), uid)
+    )
+
+
+gauge_function(shard_owned_gauge, shard_owned)
+
+
+def written_hash(filename: str) -> Optional[str]:
+    """content_hash of a dashboard file in the working dir, None when it cannot be read."""
+    try:
+        return content_hash(Path(_working_dir, filename).read_text())
+    except OSError:
+        return None
+
+
+def check_dashboard_size(dashboard_json: str):
+    """Record the dashboard size, raising dashboardTooLarge before any parsing if over the maximum."""
+    size = dashboard_size(dashboard_json)
+    dashboard_size_histogram.observe(size)
+    if size > _max_dashboard_size:
+        raise exceptions.dashboardTooLarge
+
+
+def managed_bytes() -> int:
+    """Total size of all indexed dashboards, calculated when metrics are collected."""
+    return sum(
+        dashboard.get("size", 0)
+        for dashboards in list(_d_idx.values())
+        for dashboard in dashboards
+    )
+
+
+gauge_function(managed_bytes_gauge, managed_bytes)
+
+
+def record_history(path: str, dashboard_json: str, logger: logging):
+    """Keep the written json in the version history, a resource write also ends a rollback."""
+    global _history_bytes
+
+    clear_rollback(_working_dir, path)
+    if not _history_versions:
+        return
+
+    try:
+        with _history_lock:
+            _history_bytes += record_version(
+                _working_dir, path, dashboard_json, _history_versions
+            )
+            _history_bytes = enforce_size(
+                _working_dir, _history_max_bytes, _history_bytes
+            )
+    except Exception as e:
+        # history is best effort, never fail the write
+        logger.error(f"unexpected error recording dashboard history: {path} - {e}")
+
+
+def export_usage():
+    """Update the working dir usage gauges of directories changed since the last export."""
+    for directory, usage in usage_changes().items():
+        if usage is None:
+            with contextlib.suppress(KeyError):
+                working_dir_bytes_gauge.remove(directory)
+                working_dir_files_gauge.remove(directory)
+            continue
+        working_dir_bytes_gauge.labels(directory).set(usage[0])
+        working_dir_files_gauge.labels(directory).set(usage[1])
+
+
+def parse_high_water(high_water: str) -> Tuple[int, float]:
+    """High water mark in bytes, or as a percentage of the working dir volume in use (bytes 0)."""
+    if high_water.endswith("%"):
+        return 0, float(high_water[:-1])
+
+    return int(high_water), 0.0
+
+
+@contextlib.contextmanager
+def fs_operation():
+    """Time a dashboard file operation, feeding the adaptive concurrency controller when enabled."""
+    start = time.monotonic()
+    error = False
+    try:
+        yield
+    except (OSError, exceptions.transientError):
+        error = True
+        raise
+    finally:
+        seconds = time.monotonic() - start
+        fs_latency_histogram.observe(seconds)
+        export_usage()
+        if _concurrency is not None:
+            decision = _concurrency.record(seconds, error)
+            if decision is not None:
+                concurrency_decisions_counter.labels(decision).inc()
+
+
+def retry_transient(
+    patch: object, path: str, error: exceptions.transientError, logger: logging
+):
+    """Retry a handler after a transient file system error.
+
+    Raises kopf.TemporaryError with a jittered exponential backoff delay while the path has retries
+    left, returns once the budget is exhausted so the caller handles the error as before.
+    """
+    delay = _retry_budget.next_delay(path)
+    if delay is None:
+        retry_counter.labels(error.code, "exhausted").inc()
+        logger.error(f"retries exhausted for: {path} - {error.code}")
+        return
+
+    retry_counter.labels(error.code, "retry").inc()
+    if patch is not None:
+        patch.status["reason"] = error.code
+        patch.status["state"] = "retrying"
+    logger.warning(f"{error.message}: {path} - retrying in {delay:.1f}s")
+    raise kopf.TemporaryError(f"{error.code}, retrying", delay=delay)
+
+
+def validate_spec(spec: object) -> Tuple[str, str]:
+    """Return the grafana uid and title of a resolved spec if valid, objects are checked as decoded."""
+    if "dashboard" in spec:
+        return get_dashboard_meta(spec["dashboard"])
+    return validate_dashboard(spec["json"])
+
+
+def validated_in_process(dashboard_json: str) -> bool:
+    """Return True unless the json is left to the validation process pool, json already parsed is
+    validated from the cache."""
+    return (
+        _validation_pool is None
+        or len(dashboard_json) < _validation_offload_size
+        or is_parsed(dashboard_json)
+    )
+
+
+def validate_dashboard(dashboard_json: str) -> Tuple[str, str]:
+    """Return the grafana uid and title from json if valid, see get_dashboard_json_meta.
+
+    Dashboards of at least `_validation_offload_size` bytes are validated in the process pool when
+    configured, keeping the parsing off the handler threads (and the GIL). Errors are raised as the
+    same `sidecar.exceptions` as in process validation.
+    """
+    if validated_in_process(dashboard_json):
+        return get_dashboard_json_meta(dashboard_json)
+
+    queued = time.monotonic()
+    validation_queue_gauge.inc()
+    try:
+        future = _validation_pool.submit(
+            validate_dashboard_process, dashboard_json, dashboard_files.VOLATILE_FIELDS
+        )
+        dashboard_uid, dashboard_title, dashboard_hash = future.result()
+    except BrokenProcessPool as e:
+        logging.error(
+            f"validation process pool unavailable, validating in process: {e}"
+        )
+        return get_dashboard_json_meta(dashboard_json)
+    finally:
+        validation_queue_gauge.dec()
+        validation_histogram.observe(time.monotonic() - queued)
+
+    prime_json_cache(dashboard_json, dashboard_hash)
+    prime_parse(dashboard_json, dashboard_uid, dashboard_title)
+
+    return dashboard_uid, dashboard_title
 
 
-@kopf.on.create("example.co.uk", "v1", "grafanadashboards")
 def create(
     json_uids: kopf.Index,
     patch: object,
     uid: str,
     spec: object,
     logger: logging,
+    status: object = None,
+    meta: object = None,
     **kwargs,
 ):
     """Create new dashboards."""
@@ -182,22 +1098,37 @@ def create(
     filename = "{}.json".format(Path(spec["dir"], spec["name"]))
 
     try:
-        dashboard_uid, dashboard_title = get_dashboard_json_meta(spec["json"])
+        spec = resolve_spec(spec, kwargs.get("namespace", ""))
+        check_dashboard_size(spec["json"])
+        dashboard_uid, dashboard_title = validate_spec(spec)
 
         if dashboard_uid in json_uids and len(json_uids[dashboard_uid]) > 1:
             raise exceptions.duplicateDashboardUid
         if dashboard_title == spec["dir"]:
             raise exceptions.jsonTitleMatchesDirName
+    except exceptions.transientError as e:
+        retry_transient(patch, filename, e, logger)
+        error = e.code
     except Exception as e:
         error = e.code
         logger.debug(f"{e.message}")
 
     if error is None:
         try:
-            create_file(_working_dir, filename, spec["json"])
-            patch.status["state"] = "ok"
-            patch.status["reason"] = ""
+            with fs_operation():
+                create_file(
+                    _working_dir,
+                    filename,
+                    spec_output(spec),
+                    _content_store,
+                )
+            _retry_budget.reset(filename)
+            record_history(filename, spec_output(spec), logger)
+            set_status_ok(patch, status, meta, spec["json"])
             logger.info(f"created dashboard: {filename} ({uid})")
+        except exceptions.transientError as e:
+            retry_transient(patch, filename, e, logger)
+            error = e.code
         except Exception as e:
             error = e.code
             logger.debug(f"{e.message}")
@@ -210,7 +1141,6 @@ def create(
         raise kopf.PermanentError(f"create dashboard failed: {error}")
 
 
-@kopf.on.update("example.co.uk", "v1", "grafanadashboards")
 def update(
     json_uids: kopf.Index,
     patch: object,
@@ -221,6 +1151,7 @@ def update(
     new: object,
     diff: object,
     logger: logging,
+    meta: object = None,
     **kwargs,
 ):
     """Update dashboard which is currently in the state = ok.
@@ -245,10 +1176,28 @@ def update(
     logger.debug(f"updated old filename: {old_filename} to {new_filename} ({uid})")
     # DO I LOG IN DEBUG MORE INFO - Operator might do this for me - check
 
-    if "json" in updates:
-        new_json = new["spec"]["json"]
+    try:
+        spec = resolve_spec(spec, kwargs.get("namespace", ""))
+    except exceptions.transientError as e:
+        retry_transient(patch, new_filename, e, logger)
+        error = e.code
+    except Exception as e:
+        error = e.code
+        logger.debug(f"{e.message}")
+
+    if error is None and any(
+        f in updates for f in ("json", "jsonGzip", "jsonFrom", "dashboard")
+    ):
+        new_json = new["spec"].get("json", "")
+        if not new_json or new_json.startswith(JSON_DIGEST_PREFIX):
+            # only the spec holds the json: slim diff-base or sent as jsonGzip
+            new_json = spec["json"]
         try:
-            dashboard_uid, dashboard_title = get_dashboard_json_meta(new_json)
+            check_dashboard_size(new_json)
+            if "dashboard" in spec:
+                dashboard_uid, dashboard_title = validate_spec(spec)
+            else:
+                dashboard_uid, dashboard_title = validate_dashboard(new_json)
 
             if dashboard_uid in json_uids and len(json_uids[dashboard_uid]) > 1:
                 raise exceptions.duplicateDashboardUid
@@ -258,6 +1207,18 @@ def update(
             error = e.code
             logger.debug(f"{e.message}")
 
+        # rejected json (e.g. oversize) is not written, nor parsed to compare
+        if error is None:
+            old_hash = stored_spec_hash(old["spec"])
+            if old_hash is None:
+                # the diff-base only holds a digest, compare with the file written for it
+                old_hash = written_hash(old_filename)
+            if old_hash is not None and old_hash == content_hash(new_json):
+                logger.debug(f"json change for {uid} is not semantic, skipping write")
+                new_json = ""
+            elif "dashboard" not in spec:
+                new_json = dashboard_output(new_json)
+
     # Error Handling - [ ] move error handling into own function calling creates/updates
     if error is None and "state" in status and status["state"] == "error":
         logger.info(
@@ -272,7 +1233,7 @@ def update(
             logger.info(f"fixing error for: {uid} with update")
         except exceptions.noFileExists:
             logger.info(f"fixing error for: {uid} with create")
-            create(json_uids, patch, uid, spec, logger)
+            create(json_uids, patch, uid, spec, logger, status, meta)
             return
         except Exception as e:
             logger.debug(f"{e.message}")
@@ -283,15 +1244,24 @@ def update(
     # Updates
     if error is None:
         try:
-            update_file(_working_dir, old_filename, new_filename, new_json)
-            patch.status["state"] = "ok"
-            patch.status["reason"] = ""
+            with fs_operation():
+                update_file(
+                    _working_dir, old_filename, new_filename, new_json, _content_store
+                )
+            _retry_budget.reset(new_filename)
+            record_history(new_filename, spec_output(spec), logger)
+            set_status_ok(patch, status, meta, spec["json"])
             logger.info(f"updated dashboard: {new_filename} ({uid}): {updates}")
         except exceptions.nothingToDo:
             logger.debug(
                 f"updated dashboard: {new_filename} ({uid}): update found nothing to do, aborting operation."
             )
+            skipped_counter.labels("file").inc()
+            set_status_ok(patch, status, meta, spec["json"])
             return
+        except exceptions.transientError as e:
+            retry_transient(patch, new_filename, e, logger)
+            error = e.code
         except Exception as e:
             error = e.code
             logger.debug(f"{e.message}")
@@ -309,7 +1279,6 @@ def update(
         raise kopf.PermanentError(f"create failed: {error}")
 
 
-@kopf.on.delete("example.co.uk", "v1", "grafanadashboards")
 def delete(uid: str, spec: object, status: object, logger: logging, **kwargs):
     """Delete a dashboard."""
     delete_counter.inc()
@@ -320,16 +1289,345 @@ def delete(uid: str, spec: object, status: object, logger: logging, **kwargs):
         logger.info(f"fixing error for: {uid} with delete")
 
     try:
-        delete_file(_working_dir, filename)
+        with fs_operation():
+            delete_file(_working_dir, filename, _content_store)
+        _retry_budget.reset(filename)
         logger.info(
             f'deleted dashboard: {_working_dir}/{spec["dir"]}/{spec["name"]} ({uid})'
         )
+    except exceptions.transientError as e:
+        retry_transient(kwargs.get("patch"), filename, e, logger)
+        logger.error(f"giving up delete after retries: {e.code} ({uid})")
     except Exception as e:
         # As kubernetes resource is deleted do not add active error
         # ToDo: Add exception to handle
         logger.error(f"unexpected error occurred during delete: {e} ({uid})")
 
 
+def delete_batch(namespace: str, paths: list) -> list:
+    """Delete the files of a batch of deleted dashboards, returns the result per path."""
+    with fs_operation():
+        results = delete_files(_working_dir, paths, _content_store)
+    delete_batch_histogram.observe(len(paths))
+    logging.info(
+        f"deleted {results.count(None)}/{len(paths)} dashboards in namespace: {namespace}"
+    )
+    return results
+
+
+async def flush_deletes(namespace: str, paths: list) -> list:
+    """Delete a batch within the namespace's fair share of the workers."""
+    return await run_fair(delete_batch, namespace=namespace, paths=paths)
+
+
+async def delete_batched(
+    uid: str, spec: object, status: object, logger: logging, **kwargs
+):
+    """Delete a dashboard together with the others deleted in the same batch window."""
+    delete_counter.inc()
+
+    filename = "{}.json".format(Path(spec["dir"], spec["name"]))
+
+    if "state" in status and status["state"] == "error":
+        logger.info(f"fixing error for: {uid} with delete")
+
+    try:
+        await _delete_batcher.submit(kwargs.get("namespace", ""), filename)
+        _retry_budget.reset(filename)
+        # the batch logs a summary, one info line per dashboard floods the log on teardown
+        logger.debug(f"deleted dashboard: {_working_dir}/{filename} ({uid})")
+    except exceptions.transientError as e:
+        retry_transient(kwargs.get("patch"), filename, e, logger)
+        logger.error(f"giving up delete after retries: {e.code} ({uid})")
+    except Exception as e:
+        logger.error(f"unexpected error occurred during delete: {e} ({uid})")
+
+
+async def run_fair(
+    handler, namespace: str = "", priority: int = PRIORITY_FOREGROUND, **kwargs
+):
+    """Run a synchronous handler within its priority and namespace's fair share of the workers."""
+    queued = time.monotonic()
+    fair_queue_gauge.labels(namespace).inc()
+    priority_queue_gauge.labels(PRIORITY_NAMES[priority]).inc()
+    try:
+        await _scheduler.acquire(namespace, priority)
+    finally:
+        fair_queue_gauge.labels(namespace).dec()
+        priority_queue_gauge.labels(PRIORITY_NAMES[priority]).dec()
+    waited = time.monotonic() - queued
+    fair_wait_histogram.labels(namespace).observe(waited)
+    priority_wait_histogram.labels(PRIORITY_NAMES[priority]).observe(waited)
+
+    try:
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            _executor,
+            functools.partial(context.run, handler, namespace=namespace, **kwargs),
+        )
+    finally:
+        _scheduler.release(priority)
+        if _concurrency is not None:
+            _scheduler.resize(_concurrency.slots)
+
+
+@kopf.on.create("example.co.uk", "v1", "grafanadashboards", id="create", when=in_shard)
+async def fair_create(**kwargs):
+    """Create new dashboards."""
+    return await run_fair(create, **kwargs)
+
+
+@kopf.on.update("example.co.uk", "v1", "grafanadashboards", id="update", when=in_shard)
+async def fair_update(**kwargs):
+    """Update dashboards."""
+    return await run_fair(update, priority=PRIORITY_UPDATE, **kwargs)
+
+
+async def fair_delete(**kwargs):
+    """Delete a dashboard, batched with other deletes when enabled.
+
+    Handlers of a batch return together, so kopf releases their finalizers at once. Registered by
+    `register_delete` once `--finalizers` is known.
+    """
+    if _delete_batcher is not None:
+        return await delete_batched(**kwargs)
+    return await run_fair(delete, **kwargs)
+
+
+@kopf.on.event(
+    "example.co.uk", "v1", "grafanadashboards", id="delete-event", when=in_shard
+)
+async def delete_event(type: str, spec: object, **kwargs):
+    """Delete a dashboard when its deletion is seen, the delete handler is not called without finalizers."""
+    if _finalizers or type != "DELETED":
+        return
+    if not Path(_working_dir, f'{spec["dir"]}/{spec["name"]}.json').is_file():
+        # already deleted by the delete handler (another finalizer held the resource)
+        return
+    await fair_delete(spec=spec, **kwargs)
+
+
+def remove_orphans(paths: List[str]):
+    """Remove dashboard files no indexed resource writes, found by the orphan collector."""
+    with fs_operation():
+        results = delete_files(_working_dir, paths, _content_store)
+    for path, error in zip(paths, results):
+        if error is None:
+            orphan_removed_counter.inc()
+            logging.info(f"removed orphaned dashboard: {_working_dir}/{path}")
+        elif not isinstance(error, exceptions.noFileExists):
+            logging.error(
+                f"unexpected error removing orphaned dashboard: {path} - {error}"
+            )
+
+
+def referenced_config_map(namespace: str, name: str, **kwargs) -> bool:
+    """Return True if a dashboard reads its json from the ConfigMap."""
+    return (namespace, name) in _config_map_refs
+
+
+async def config_map_event(
+    type: str, body: object, namespace: str, name: str, logger: logging, **kwargs
+):
+    """Cache a referenced ConfigMap and refresh the dashboards reading from it when it changed."""
+    if type == "DELETED":
+        # dependent files are kept, a create or reconcile reports the missing ConfigMap
+        _config_maps.remove(namespace, name)
+        return
+    if not _config_maps.put(
+        namespace, name, body["metadata"]["resourceVersion"], body.get("data")
+    ):
+        return
+
+    refs = [
+        ref
+        for ref in _config_map_refs.get((namespace, name), [])
+        if in_shard(namespace, ref["uid"])
+    ]
+    await asyncio.gather(
+        *[
+            run_fair(
+                refresh_dependent,
+                namespace=namespace,
+                priority=PRIORITY_UPDATE,
+                ref=ref,
+                logger=logger,
+            )
+            for ref in refs
+        ]
+    )
+
+
+def refresh_dependent(namespace: str, ref: dict, logger: logging):
+    """Write the current ConfigMap value to the file of a dashboard reading its json from it."""
+    filename = "{}.json".format(Path(ref["dir"], ref["name"]))
+    try:
+        dashboard_json = _config_maps.get(namespace, ref["configMap"], ref["key"])
+        check_dashboard_size(dashboard_json)
+        _, dashboard_title = validate_dashboard(dashboard_json)
+        if dashboard_title == ref["dir"]:
+            raise exceptions.jsonTitleMatchesDirName
+    except Exception as e:
+        # the file keeps the last valid json, the resource reports the error on its next update
+        config_map_updates_counter.labels("invalid").inc()
+        logger.error(
+            f"refresh from configmap failed: {filename} ({ref['uid']}) - {getattr(e, 'code', e)}"
+        )
+        return
+
+    try:
+        with fs_operation():
+            update_file(
+                _working_dir,
+                filename,
+                filename,
+                dashboard_output(dashboard_json),
+                _content_store,
+            )
+        record_history(filename, dashboard_output(dashboard_json), logger)
+        config_map_updates_counter.labels("updated").inc()
+        logger.info(f"refreshed dashboard from configmap: {filename} ({ref['uid']})")
+    except exceptions.nothingToDo:
+        config_map_updates_counter.labels("unchanged").inc()
+    except exceptions.oldPathDoesNotExist:
+        # not created yet or failed, left to the create and reconcile handlers
+        config_map_updates_counter.labels("missing").inc()
+    except Exception as e:
+        config_map_updates_counter.labels("failed").inc()
+        logger.error(
+            f"refresh from configmap failed: {filename} ({ref['uid']}) - {getattr(e, 'code', e)}"
+        )
+
+
+def register_delete(registry: kopf.OperatorRegistry):
+    """Register the delete handler, optional (no finalizer) without `--finalizers`.
+
+    Without finalizers it only runs while another finalizer holds a deleted resource, `delete_event`
+    handles the rest.
+    """
+    kopf.on.delete(
+        "example.co.uk",
+        "v1",
+        "grafanadashboards",
+        id="delete",
+        when=in_shard,
+        optional=not _finalizers,
+        registry=registry,
+    )(fair_delete)
+
+
+def register_reconcile(registry: kopf.OperatorRegistry):
+    """Register the periodic reconcile, a kopf timer with `--finalizers` otherwise reconcile_loop.
+
+    kopf always puts a finalizer on resources with timers, with no option to turn it off.
+    """
+    if _finalizers:
+        kopf.timer(
+            "example.co.uk",
+            "v1",
+            "grafanadashboards",
+            id="reconcile",
+            interval=RECONCILE_INTERVAL,
+            initial_delay=RECONCILE_INITIAL_DELAY,
+            when=in_shard,
+            registry=registry,
+        )(fair_reconcile)
+        return
+
+    kopf.on.startup(id="reconcile-loop", registry=registry)(start_reconcile_loop)
+    kopf.on.cleanup(id="reconcile-loop", registry=registry)(stop_reconcile_loop)
+
+
+async def warm_start_wait(dir: str, name: str):
+    """During the warm start after a restart reconciles are spread out, missing files first."""
+    if _warm_start is not None and _warm_start.active():
+        missing = not Path(_working_dir, f"{dir}/{name}.json").is_file()
+        await _warm_start.wait(missing)
+        warm_start_released_counter.labels("missing" if missing else "verify").inc()
+
+
+async def fair_reconcile(spec: object, **kwargs):
+    """Reconcile in the background, yielding to create, update and delete handlers."""
+    await warm_start_wait(spec["dir"], spec["name"])
+
+    # kopf keeps running the timer of a dashboard which moved to another shard until its next event
+    if not in_shard(kwargs.get("namespace", ""), kwargs.get("uid", "")):
+        return
+
+    return await run_fair(reconcile, priority=PRIORITY_BACKGROUND, spec=spec, **kwargs)
+
+
+async def reconcile_indexed(uid: str, dashboard: dict):
+    """Reconcile an indexed dashboard in the background, see reconcile_resource."""
+    await warm_start_wait(dashboard["dir"], dashboard["name"])
+
+    namespace = dashboard.get("namespace", "")
+    if not in_shard(namespace, uid):
+        return
+
+    await run_fair(
+        lambda namespace: reconcile_resource(uid, dashboard),
+        namespace=namespace,
+        priority=PRIORITY_BACKGROUND,
+    )
+
+
+async def reconcile_loop():
+    """Reconcile every dashboard of this shard each RECONCILE_INTERVAL without kopf timers."""
+    await asyncio.sleep(RECONCILE_INITIAL_DELAY)
+    while True:
+        await asyncio.gather(
+            *(
+                reconcile_indexed(uid, dashboard)
+                for uid, dashboards in list(_d_idx.items())
+                for dashboard in dashboards
+                if dashboard.get("resource")
+            )
+        )
+        await asyncio.sleep(RECONCILE_INTERVAL)
+
+
+async def start_reconcile_loop(**kwargs):
+    """Start reconcile_loop in the operator's event loop."""
+    global _reconcile_task
+    _reconcile_task = asyncio.create_task(reconcile_loop())
+
+
+async def stop_reconcile_loop(**kwargs):
+    """Stop reconcile_loop when the operator stops."""
+    if _reconcile_task is not None:
+        _reconcile_task.cancel()
+
+
+def background_check_drift(path: str):
+    """Check drift in the background priority class, called from the watcher thread."""
+    if _loop is None:
+        check_drift(path)
+        return
+
+    asyncio.run_coroutine_threadsafe(
+        run_fair(lambda namespace: check_drift(path), priority=PRIORITY_BACKGROUND),
+        _loop,
+    ).result()
+
+
+gauge_function(concurrency_limit_gauge, lambda: _scheduler.slots)
+gauge_function(retry_pending_gauge, lambda: _retry_budget.pending())
+gauge_function(history_bytes_gauge, lambda: _history_bytes)
+gauge_function(
+    config_map_cache_gauge,
+    lambda: len(_config_maps.config_maps) if _config_maps else 0,
+)
+gauge_function(
+    warm_start_pending_gauge.labels("missing"),
+    lambda: _warm_start.pending(True) if _warm_start else 0,
+)
+gauge_function(
+    warm_start_pending_gauge.labels("verify"),
+    lambda: _warm_start.pending(False) if _warm_start else 0,
+)
+
+
 @kopf.on.startup()
 def configure(settings: kopf.OperatorSettings, **kwargs):
     """Perform all necessary startup tasks here.
@@ -341,23 +1639,144 @@ def configure(settings: kopf.OperatorSettings, **kwargs):
     settings.persistence.finalizer = (
         "kopf.nolar.org/GrafanaDashboardSidecarFinalizerMarker"
     )
+    if _persistence_name:
+        # see persistence_prefix, the finalizer keeps its name for unsharded sidecars
+        settings.persistence.finalizer = (
+            f"{persistence_prefix()}/GrafanaDashboardSidecarFinalizerMarker"
+        )
+    diffbase_storage = (
+        SlimDiffBaseStorage if _slim_diff_base else kopf.AnnotationsDiffBaseStorage
+    )
+    settings.persistence.diffbase_storage = diffbase_storage(
+        key="last-handled-configuration"
+    )
     settings.peering.standalone = True
     settings.execution.max_workers = _max_workers
+
+    # handlers are queued per namespace before taking one of the operator's workers
+    global _scheduler, _executor
+    _scheduler = FairScheduler(_max_workers, _namespace_weights)
+    _executor = settings.execution.executor
     settings.batching.error_delays = [10, 20, 30]
 
+    # server side filtering, non matching resources never reach handlers or indexes
+    if _label_selector:
+        settings.watching.label_selectors["example.co.uk", "grafanadashboards"] = (
+            _label_selector
+        )
+    if _field_selector:
+        settings.watching.field_selectors["example.co.uk", "grafanadashboards"] = (
+            _field_selector
+        )
+
     settings.watching.connect_timeout = 1 * 60
     settings.watching.server_timeout = 30 * 60
     settings.watching.client_timeout = 35 * 60
 
 
+def load_kube_config(purpose: str):
+    """Load the kubernetes api client config (in cluster or kubeconfig), exit if not found."""
+    try:
+        kubernetes.config.load_config()
+    except kubernetes.config.ConfigException as e:
+        click.echo(f"kubernetes api config not found for {purpose}: {e}")
+        sys.exit(2)
+
+
+def split_namespaces(namespaces: List[str], worker: int, processes: int) -> List[str]:
+    """Namespaces watched by a worker, None when they can't be split into disjoint watches.
+
+    Only a list of explicit namespaces with at least one per worker is split, clusterwide and glob
+    patterns are shared between workers with a hash ring instead.
+    """
+    if len(namespaces) < processes or any(set(n) & set("*?[!") for n in namespaces):
+        return None
+
+    return sorted(namespaces)[worker::processes]
+
+
+def kopf_namespaces(namespaces: List[str]) -> List[str]:
+    """Namespace patterns for kopf, which watches the namespaces matching any one of them.
+
+    An exclusion only applies within its own pattern, repeated values with exclusions are joined into
+    a single pattern, inclusions first (`team-*,!team-x`).
+    """
+    if not any(n.startswith("!") for n in namespaces):
+        return namespaces
+
+    included = [n for n in namespaces if not n.startswith("!")]
+    excluded = [n for n in namespaces if n.startswith("!")]
+    return [",".join(included + excluded)]
+
+
+def run_worker(args: List[str], worker: int):
+    """Worker process entrypoint, runs the cli with the supervisor's arguments."""
+    scan.main(args=[*args, "--worker", str(worker)])
+
+
+def supervise(processes: int, prom_http_port: int):
+    """Run and restart `processes` worker processes, each running its own operator.
+
+    Metrics from all workers are aggregated (prometheus multiprocess mode) and served here.
+    """
+    metrics_dir = tempfile.mkdtemp(prefix="grafana-k8-sidecar-metrics-")
+    # inherited by the workers, must be set before they import prometheus_client
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    logging.info(
+        "prometheus http started locally: http://localhost:{}".format(prom_http_port)
+    )
+    start_http_server(prom_http_port, registry=registry)
+
+    context = get_context("spawn")
+    workers = {}
+    stop_flag = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_flag.set())
+
+    try:
+        while not stop_flag.is_set():
+            for worker in range(processes):
+                process = workers.get(worker)
+                if process is not None and process.is_alive():
+                    continue
+                if process is not None:
+                    logging.error(
+                        f"worker {worker} exited ({process.exitcode}), restarting"
+                    )
+                    multiprocess.mark_process_dead(process.pid)
+                process = context.Process(
+                    target=run_worker, args=(sys.argv[1:], worker), daemon=False
+                )
+                process.start()
+                workers[worker] = process
+                logging.info(f"started worker {worker} (pid: {process.pid})")
+            stop_flag.wait(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("\n! Stopping worker processes.\n")
+        for process in workers.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGINT)
+        for process in workers.values():
+            process.join()
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
 def kopf_thread(ready_flag: threading.Event, stop_flag: threading.Event):
     """K8s Operator thread."""
+    global _loop
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
+    _loop = loop
 
     with contextlib.closing(loop):
-        # Default to clusterwide - can make this configurable for different use cases
-        scope = {"clusterwide": True, "namespaces": []}
+        # Default to clusterwide, scoped to namespaces (globs) when configured
+        scope = {
+            "clusterwide": not _namespaces,
+            "namespaces": kopf_namespaces(_namespaces),
+        }
 
         loop.run_until_complete(
             kopf.operator(
@@ -381,6 +1800,191 @@ def kopf_thread(ready_flag: threading.Event, stop_flag: threading.Event):
     default=20,
     help="number of synchronous workers used by the operator for synchronous handlers",
 )
+@click.option(
+    "--adaptive-workers/--no-adaptive-workers",
+    default=False,
+    help="adapt the number of workers between --min-workers and --max-workers to file write latency",
+)
+@click.option(
+    "--min-workers",
+    default=2,
+    help="minimum number of workers when adapting to file write latency",
+)
+@click.option(
+    "--target-write-latency",
+    default=0.05,
+    help="mean file operation seconds above which the number of workers is reduced",
+)
+@click.option(
+    "--retry-budget",
+    default=5,
+    help="retries of a dashboard path after transient file system errors (full disk, i/o errors)",
+)
+@click.option(
+    "--retry-backoff",
+    default=1.0,
+    help="base seconds of the jittered exponential backoff between transient error retries",
+)
+@click.option(
+    "--retry-max-delay",
+    default=300.0,
+    help="maximum seconds between transient error retries",
+)
+@click.option(
+    "--warm-start-window",
+    default=300.0,
+    help="seconds over which the first reconciles after a start are spread, 0 disables",
+)
+@click.option(
+    "--warm-start-rate",
+    default=20.0,
+    help="max number of reconciles per second during the warm start",
+)
+@click.option(
+    "--finalizers/--no-finalizers",
+    default=True,
+    help="block resource deletion until the dashboard is deleted, without finalizers deletions are handled when seen",
+)
+@click.option(
+    "--slim-diff-base/--full-diff-base",
+    default=True,
+    help="keep only a hash of the dashboard json in the last-handled-configuration annotation",
+)
+@click.option(
+    "--orphan-gc-interval",
+    default=600.0,
+    help="seconds between collections of orphaned dashboard files without finalizers, 0 disables",
+)
+@click.option(
+    "--delete-batch-window",
+    default=0.5,
+    help="seconds deletes are gathered to delete their files in one pass (namespace teardown), 0 disables",
+)
+@click.option(
+    "--delete-batch-size",
+    default=500,
+    help="max number of deletes in a batch",
+)
+@click.option(
+    "--namespace-weight",
+    "namespace_weights",
+    multiple=True,
+    help="share of the workers for a namespace relative to others (default 1): <namespace>=<weight>, repeat for more",
+)
+@click.option(
+    "--namespace",
+    "namespaces",
+    multiple=True,
+    help="namespace to watch, globs (team-*) and exclusions (!kube-*) allowed, repeat for more (default: all)",
+)
+@click.option(
+    "--label-selector",
+    default="",
+    help="kubernetes label selector for the grafana dashboards watched (server side filtering)",
+)
+@click.option(
+    "--field-selector",
+    default="",
+    help="kubernetes field selector for the grafana dashboards watched (server side filtering)",
+)
+@click.option(
+    "--shard-members",
+    default="",
+    help="comma separated names of all sidecar replicas sharing dashboards by consistent hash (static)",
+)
+@click.option(
+    "--shard-discovery-dns",
+    default="",
+    help="headless service resolving to the addresses of all sidecar replicas sharing dashboards",
+)
+@click.option(
+    "--shard-self",
+    envvar="POD_IP",
+    default=socket.gethostname(),
+    help="name (static members) or address (dns discovery) of this replica",
+)
+@click.option(
+    "--shard-name",
+    envvar="POD_NAME",
+    default=socket.gethostname(),
+    help="stable name of this replica for its finalizer and kopf annotations (e.g. StatefulSet pod name)",
+)
+@click.option(
+    "--content-store/--no-content-store",
+    default=False,
+    help="store dashboard json once by content hash and hardlink dashboard files to it",
+)
+@click.option(
+    "--canonical-json/--no-canonical-json",
+    default=False,
+    help="write dashboard json minified with sorted keys",
+)
+@click.option(
+    "--volatile-fields",
+    default="id,version",
+    help="comma separated top level dashboard json fields ignored when comparing dashboards",
+)
+@click.option(
+    "--max-dashboard-size",
+    default=10 * 1024 * 1024,
+    help="max dashboard json size in bytes, larger dashboards are rejected before parsing",
+)
+@click.option(
+    "--validation-processes",
+    default=0,
+    help="number of processes validating large dashboards off the handler threads (0 to disable)",
+)
+@click.option(
+    "--validation-offload-size",
+    default=1024 * 1024,
+    help="dashboard json size in bytes from which validation uses the process pool",
+)
+@click.option(
+    "--working-dir-high-water",
+    default="0",
+    help="refuse dashboard writes taking the working dir over this many bytes, or its volume over this percent in use (90%), 0 disables",
+)
+@click.option(
+    "--history-versions",
+    default=0,
+    help="versions of each dashboard kept in <working-dir>/.history for rollback, 0 disables",
+)
+@click.option(
+    "--history-max-bytes",
+    default=64 * 1024 * 1024,
+    help="max compressed bytes of the version history, oldest versions are removed first",
+)
+@click.option(
+    "--watch-working-dir/--no-watch-working-dir",
+    default=False,
+    help="watch the working dir with inotify (linux) to detect drift as it happens",
+)
+@click.option(
+    "--watch-rate",
+    default=10.0,
+    help="max number of working dir changes checked per second by the watcher",
+)
+@click.option(
+    "--config-map-refs",
+    is_flag=True,
+    help="allow dashboards to read their json from a ConfigMap key (spec.jsonFrom.configMapKeyRef)",
+)
+@click.option(
+    "--processes",
+    default=1,
+    help="number of worker processes, each running an operator for a share of the namespaces",
+)
+@click.option("--worker", default=-1, hidden=True, help="worker process index")
+@click.option(
+    "--query-api-port",
+    default=0,
+    help="port of the read-only http api over the sidecar's indexes, 0 disables",
+)
+@click.option(
+    "--query-api-host",
+    default="127.0.0.1",
+    help="address the query api listens on",
+)
 @click.option(
     "--log-level",
     type=click.Choice(
@@ -393,7 +1997,49 @@ def kopf_thread(ready_flag: threading.Event, stop_flag: threading.Event):
 @click.option(
     "--prom-http-port", default=8000, help="port to publish prometheus metrics"
 )
-def scan(working_dir: str, max_workers: int, log_level: str, prom_http_port: int):
+def scan(
+    working_dir: str,
+    max_workers: int,
+    adaptive_workers: bool,
+    min_workers: int,
+    target_write_latency: float,
+    retry_budget: int,
+    retry_backoff: float,
+    retry_max_delay: float,
+    warm_start_window: float,
+    warm_start_rate: float,
+    finalizers: bool,
+    slim_diff_base: bool,
+    orphan_gc_interval: float,
+    delete_batch_window: float,
+    delete_batch_size: int,
+    namespace_weights: Tuple[str],
+    namespaces: Tuple[str],
+    label_selector: str,
+    field_selector: str,
+    shard_members: str,
+    shard_discovery_dns: str,
+    shard_self: str,
+    shard_name: str,
+    content_store: bool,
+    canonical_json: bool,
+    volatile_fields: str,
+    max_dashboard_size: int,
+    validation_processes: int,
+    validation_offload_size: int,
+    working_dir_high_water: str,
+    history_versions: int,
+    history_max_bytes: int,
+    watch_working_dir: bool,
+    watch_rate: float,
+    config_map_refs: bool,
+    processes: int,
+    worker: int,
+    query_api_port: int,
+    query_api_host: str,
+    log_level: str,
+    prom_http_port: int,
+):
     """Scan for new Grafana Dashboard resources."""
     logging.basicConfig(
         level=log_level, format="%(asctime)s - %(levelname)s - %(message)s"
@@ -401,7 +2047,12 @@ def scan(working_dir: str, max_workers: int, log_level: str, prom_http_port: int
     click.echo("log level: {}".format(log_level))
 
     # using globals until best practice for passing through
-    global _max_workers, _working_dir
+    global _max_workers, _namespace_weights, _working_dir, _content_store, _concurrency
+    global _canonical_json, _retry_budget, _warm_start, _delete_batcher, _finalizers
+    global _history_versions, _history_max_bytes, _history_bytes, _slim_diff_base
+    global _namespaces, _label_selector, _field_selector, _shard_self
+    global _worker_ring, _worker_self, _config_maps, _persistence_name
+    global _validation_pool, _validation_offload_size, _max_dashboard_size
 
     if not Path(working_dir).is_dir():
         click.echo(f"working dir: {working_dir} does not exist!")
@@ -410,18 +2061,231 @@ def scan(working_dir: str, max_workers: int, log_level: str, prom_http_port: int
     click.echo("Max Workers: {}".format(max_workers))
     _max_workers = max_workers
 
+    click.echo("Adaptive Workers: {}".format(adaptive_workers))
+    if adaptive_workers:
+        click.echo(
+            "Min Workers: {}, Target Write Latency: {}".format(
+                min_workers, target_write_latency
+            )
+        )
+        _concurrency = AIMDController(
+            min(min_workers, max_workers), max_workers, target_write_latency
+        )
+
+    click.echo(
+        "Retry Budget: {}, Backoff: {}, Max Delay: {}".format(
+            retry_budget, retry_backoff, retry_max_delay
+        )
+    )
+    _retry_budget = RetryBudget(retry_budget, retry_backoff, retry_max_delay)
+
+    click.echo(
+        "Warm Start Window: {}, Rate: {}".format(warm_start_window, warm_start_rate)
+    )
+    if warm_start_window > 0:
+        _warm_start = WarmStart(warm_start_window, warm_start_rate)
+
+    click.echo("Finalizers: {}".format(finalizers))
+    _finalizers = finalizers
+    register_delete(kopf.get_default_registry())
+    register_reconcile(kopf.get_default_registry())
+    if not finalizers:
+        # dashboards are read from the api server and their status patched by reconcile_loop
+        load_kube_config("reconcile")
+    click.echo("Slim Diff Base: {}".format(slim_diff_base))
+    _slim_diff_base = slim_diff_base
+
+    click.echo(
+        "Delete Batch Window: {}, Size: {}".format(
+            delete_batch_window, delete_batch_size
+        )
+    )
+    if delete_batch_window > 0:
+        _delete_batcher = Batcher(delete_batch_window, flush_deletes, delete_batch_size)
+
+    try:
+        _namespace_weights = {
+            name: float(weight)
+            for name, weight in (w.split("=", 1) for w in namespace_weights)
+        }
+    except ValueError:
+        click.echo(f"invalid namespace weights: {namespace_weights}")
+        sys.exit(2)
+    if any(weight <= 0 for weight in _namespace_weights.values()):
+        click.echo(f"namespace weights must be positive: {namespace_weights}")
+        sys.exit(2)
+    click.echo("Namespace Weights: {}".format(_namespace_weights or "equal"))
+
     click.echo("Working Dir: {}".format(working_dir))
     _working_dir = working_dir
 
+    _namespaces = list(namespaces)
+    if worker >= 0:
+        _worker_self = f"worker-{worker}"
+        worker_namespaces = split_namespaces(_namespaces, worker, processes)
+        if worker_namespaces is None:
+            # workers watch all namespaces and only handle their share, with their own kopf keys
+            # (see persistence_prefix)
+            _worker_ring = HashRing([f"worker-{i}" for i in range(processes)])
+            _persistence_name = persistence_name(_worker_self)
+        else:
+            _namespaces = worker_namespaces
+        click.echo("Worker: {} of {}".format(worker, processes))
+    click.echo("Namespaces: {}".format(_namespaces or "all"))
+
+    if (label_selector or field_selector) and not hasattr(
+        kopf.OperatorSettings().watching, "label_selectors"
+    ):
+        click.echo("label/field selectors not supported by installed kopf version!")
+        sys.exit(2)
+    click.echo("Label Selector: {}".format(label_selector))
+    _label_selector = label_selector
+    click.echo("Field Selector: {}".format(field_selector))
+    _field_selector = field_selector
+
+    click.echo("Content Store: {}".format(content_store))
+    _content_store = content_store
+    # the supervisor collects garbage once, workers are creating blobs concurrently
+    if content_store and worker < 0:
+        logging.info(f"removed unreferenced blobs: {gc_blobs(working_dir)}")
+
+    try:
+        high_water, high_water_percent = parse_high_water(working_dir_high_water)
+    except ValueError:
+        click.echo(f"invalid working dir high water mark: {working_dir_high_water}")
+        sys.exit(2)
+    click.echo(
+        "Working Dir High Water: {}".format(
+            working_dir_high_water if high_water or high_water_percent else "disabled"
+        )
+    )
+    set_high_water(high_water, high_water_percent)
+    working_dir_high_water_gauge.set(high_water_bytes(working_dir))
+    logging.info(f"working dir dashboard bytes: {init_usage(working_dir)}")
+    export_usage()
+
+    click.echo(
+        "History Versions: {}, Max Bytes: {}".format(
+            history_versions, history_max_bytes
+        )
+    )
+    _history_versions = history_versions
+    _history_max_bytes = history_max_bytes
+    _history_bytes = history_size(working_dir)
+
+    # workers are started with the same arguments, the remaining setup happens in each worker
+    if processes > 1 and worker < 0:
+        supervise(processes, prom_http_port)
+        sys.exit()
+
+    _shard_self = shard_self
+    if shard_members or shard_discovery_dns:
+        # the address of a replica changes on restart, its finalizer would be left behind
+        _persistence_name = persistence_name(shard_name, _persistence_name)
+        click.echo("Shard Self: {} ({})".format(shard_self, _persistence_name))
+        # dashboards moving into this shard are read from the api server
+        load_kube_config("sharding")
+    if shard_members:
+        set_shard_members([m for m in shard_members.split(",") if m])
+    elif shard_discovery_dns:
+        refresher = MembershipRefresher(
+            lambda: dns_members(shard_discovery_dns), set_shard_members
+        )
+        # members known before handling any resources
+        refresher.refresh()
+        refresher.start()
+
+    click.echo("Canonical JSON: {}".format(canonical_json))
+    _canonical_json = canonical_json
+
+    click.echo("Volatile Fields: {}".format(volatile_fields))
+    set_volatile_fields(f for f in volatile_fields.split(",") if f)
+
+    click.echo("Max Dashboard Size: {}".format(max_dashboard_size))
+    _max_dashboard_size = max_dashboard_size
+
+    click.echo("Validation Processes: {}".format(validation_processes))
+    if validation_processes > 0:
+        # spawn: forking a process running the kopf thread is not safe
+        _validation_pool = ProcessPoolExecutor(
+            max_workers=validation_processes, mp_context=get_context("spawn")
+        )
+        _validation_offload_size = validation_offload_size
+
     # Start Prometheus Metrics Server - might do this though Flask
     # Must be stated before starting the kopf thread below
-    logging.info(
-        "prometheus http started locally: http://localhost:{}".format(prom_http_port)
-    )
-    start_http_server(prom_http_port)
+    # workers metrics are served by the supervisor
+    if worker < 0:
+        logging.info(
+            "prometheus http started locally: http://localhost:{}".format(
+                prom_http_port
+            )
+        )
+        start_http_server(prom_http_port)
+
+    if watch_working_dir:
+        # drifted dashboards are read from the api server and their status patched
+        load_kube_config("working dir watch")
+        try:
+            watcher = WorkingDirWatcher(
+                working_dir,
+                background_check_drift,
+                rate=watch_rate,
+                ignore=(BLOB_DIR, HISTORY_DIR),
+                owned_paths=owned_paths,
+            )
+        except OSError as e:
+            click.echo(f"working dir watch not available: {e}")
+            sys.exit(2)
+        gauge_function(watch_pending_gauge, lambda: len(watcher.pending))
+        watcher.start()
+
+    click.echo("ConfigMap Refs: {}".format(config_map_refs))
+    if config_map_refs:
+        load_kube_config("configmap refs")
+        _config_maps = ConfigMapCache()
+        # kopf cannot watch a list of named objects, all ConfigMaps are watched and filtered here
+        kopf.on.event(
+            "",
+            "v1",
+            "configmaps",
+            id="config-map-refs",
+            when=referenced_config_map,
+        )(config_map_event)
+
+    if query_api_port:
+        # each worker process serves its own share of the indexes on the next port
+        QueryAPI(
+            query_api_port + max(worker, 0), lambda: _indexes, host=query_api_host
+        ).start()
 
     ready_flag = threading.Event()
     stop_flag = threading.Event()
+
+    # workers with split namespaces only index their own, any other worker's files would look orphaned
+    if not finalizers and orphan_gc_interval > 0:
+        if worker < 0 or (worker == 0 and _worker_ring is not None):
+            collector = OrphanCollector(
+                working_dir,
+                lambda: set(owned_paths()),
+                remove_orphans,
+                ready_flag,
+                interval=orphan_gc_interval,
+            )
+            gauge_function(orphan_pending_gauge, lambda: len(collector.candidates))
+            collector.start()
+        elif worker == 0:
+            logging.warning(
+                "orphan file collection disabled: namespaces split between workers"
+            )
+
+    if worker >= 0:
+        # collected by the supervisor from the multiprocess files
+        export_gauges()
+        threading.Thread(
+            target=export_gauges_loop, args=(stop_flag,), daemon=True
+        ).start()
+
     try:
         thread = threading.Thread(
             target=kopf_thread,
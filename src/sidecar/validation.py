@@ -0,0 +1,240 @@
+"""Dashboard json validation.
+
+Kept free of the operator (kopf) so it can be imported by validation worker processes.
+"""
+
+import json
+import re
+from typing import Tuple
+
+import sidecar.exceptions as exceptions
+
+# Local Libraries
+from sidecar.dashboard_files import (
+    cached,
+    content_hash,
+    in_json_cache,
+    object_hash,
+    prime_json_cache,
+)
+
+MAX_TEMPLATE_VARIABLES = 100
+MAX_TEMPLATE_OPTIONS = 10000
+
+# validation rules by the part of the dashboard they check, see `rule`
+_rules = {"dashboard": [], "panel": []}
+
+
+def get_dashboard_json_meta(dashboard_json: str) -> Tuple[str, str]:
+    """Return the grafana title and grafana uid from json if valid, otherwise None.
+
+    [json model](https://grafana.com/docs/grafana/latest/dashboards/json-model/)
+
+    :param dashboard_json: json taken from k8s object (spec.json)
+    :type dashboard_json: string
+    :return: grafana uid, grafana title
+    :rtype: string, string
+    """
+    rules_error, fields = parse_dashboard(dashboard_json)
+    if rules_error is exceptions.invalidJson:
+        raise exceptions.invalidJson
+
+    return check_meta(fields, rules_error)
+
+
+def get_dashboard_meta(dashboard: object) -> Tuple[str, str]:
+    """Return the grafana uid and title of a dashboard sent as an object (spec.dashboard) if valid.
+
+    Same checks as get_dashboard_json_meta, the object is already decoded so nothing is parsed.
+    """
+    if not isinstance(dashboard, dict):
+        raise exceptions.invalidJson
+
+    try:
+        apply_rules(dashboard)
+        rules_error = None
+    except exceptions.Exception as e:
+        rules_error = type(e)
+
+    return check_meta(dashboard, rules_error)
+
+
+def check_meta(fields: dict, rules_error) -> Tuple[str, str]:
+    """Check the grafana uid and title, then raise the first rule failure if any."""
+    if "uid" not in fields:
+        raise exceptions.invalidJsonNoUid
+    elif len(fields["uid"]) > 40:
+        raise exceptions.invalidJsonUidTooLong
+    elif not re.match(r"^([\w\_\-])*$", fields["uid"]):
+        raise exceptions.invalidJsonUidUnexpectedCharacters
+
+    if "title" not in fields:
+        raise exceptions.invalidJsonNoTitle
+    elif not re.match(
+        r"^[\w\_\-\s!£$%^&*+=#@:;,.\'\"~?(){}\[\]<>/]*$", fields["title"]
+    ):
+        raise exceptions.invalidJsonTitleUnexpectedCharacters
+
+    if rules_error is not None:
+        raise rules_error
+
+    return fields["uid"], fields["title"]
+
+
+def rule(selector: str):
+    """Register a validation rule, called with each `selector` (dashboard/panel) and the pass state.
+
+    Rules raise a `sidecar.exceptions` exception on failure. State is shared by all rules for a single
+    pass over a dashboard, e.g. to find duplicates.
+    """
+
+    def register(check):
+        _rules[selector].append(check)
+        return check
+
+    return register
+
+
+@rule("dashboard")
+def panels_required(dashboard: dict, state: dict):
+    """Panels list (or rows for legacy dashboards) must exist."""
+    if not isinstance(dashboard.get("panels", dashboard.get("rows")), list):
+        raise exceptions.invalidJsonNoPanels
+
+
+@rule("dashboard")
+def schema_version(dashboard: dict, state: dict):
+    """schemaVersion, when set, must be a positive integer."""
+    version = dashboard.get("schemaVersion", 1)
+    if isinstance(version, bool) or not isinstance(version, int) or version < 1:
+        raise exceptions.invalidJsonSchemaVersion
+
+
+@rule("dashboard")
+def templating_size(dashboard: dict, state: dict):
+    """Limit template variables and their options, both are loaded with the dashboard."""
+    templating = dashboard.get("templating")
+    variables = templating.get("list") if isinstance(templating, dict) else None
+    if not isinstance(variables, list):
+        return
+
+    if len(variables) > MAX_TEMPLATE_VARIABLES:
+        raise exceptions.invalidJsonTemplatingTooLarge
+
+    options = 0
+    for variable in variables:
+        if isinstance(variable, dict) and isinstance(variable.get("options"), list):
+            options += len(variable["options"])
+    if options > MAX_TEMPLATE_OPTIONS:
+        raise exceptions.invalidJsonTemplatingTooLarge
+
+
+@rule("panel")
+def unique_panel_id(panel: dict, state: dict):
+    """Panel ids must be unique across the dashboard including panels in rows."""
+    panel_id = panel.get("id")
+    if not isinstance(panel_id, (int, str)):
+        return
+
+    panel_ids = state.setdefault("panel_ids", set())
+    if panel_id in panel_ids:
+        raise exceptions.invalidJsonDuplicatePanelId
+    panel_ids.add(panel_id)
+
+
+def compile_rules() -> Tuple[tuple, tuple]:
+    """Return the registered dashboard and panel rules, compiled once when loaded."""
+    return tuple(_rules["dashboard"]), tuple(_rules["panel"])
+
+
+_dashboard_rules, _panel_rules = compile_rules()
+
+
+def apply_rules(dashboard: object):
+    """Run all rules in a single pass over a parsed dashboard, raising the first failure."""
+    if not isinstance(dashboard, dict):
+        # left for the uid/title checks
+        return
+
+    state = {}
+    for check in _dashboard_rules:
+        check(dashboard, state)
+
+    panels = []
+    for container in [dashboard, *(dashboard.get("rows") or [])]:
+        if isinstance(container, dict) and isinstance(container.get("panels"), list):
+            panels.extend(container["panels"])
+
+    while panels:
+        panel = panels.pop()
+        if not isinstance(panel, dict):
+            continue
+        for check in _panel_rules:
+            check(panel, state)
+        # collapsed rows hold their panels
+        if isinstance(panel.get("panels"), list):
+            panels.extend(panel["panels"])
+
+
+def _parse_dashboard(dashboard_json: str):
+    try:
+        dashboard = json.loads(dashboard_json)
+    except ValueError:
+        return exceptions.invalidJson, {}
+
+    # the json has been parsed here, validate_json and content_hash need not parse it again
+    prime_json_cache(dashboard_json, object_hash(dashboard))
+
+    fields = {}
+    if isinstance(dashboard, dict):
+        fields = {key: dashboard[key] for key in ("uid", "title") if key in dashboard}
+
+    try:
+        apply_rules(dashboard)
+    except exceptions.Exception as e:
+        return type(e), fields
+
+    return None, fields
+
+
+def parse_dashboard(dashboard_json: str):
+    """Return the exception class of the first rule failure (invalidJson if not json) or None, and the
+    top level uid and title.
+
+    Cached by a digest of the json, the same json is indexed and validated by several handlers from a
+    single parse.
+    """
+    return cached("rules", dashboard_json, _parse_dashboard)
+
+
+def prime_parse(dashboard_json: str, dashboard_uid: str, dashboard_title: str):
+    """Record json validated elsewhere (e.g. by the validation process pool) as passing all rules."""
+    cached(
+        "rules",
+        dashboard_json,
+        lambda _: (None, {"uid": dashboard_uid, "title": dashboard_title}),
+    )
+
+
+def is_parsed(dashboard_json: str) -> bool:
+    """Return True if the json has already been parsed and validated, see parse_dashboard."""
+    return in_json_cache("rules", dashboard_json)
+
+
+def dashboard_hash(dashboard_json: str) -> str:
+    """Return the content hash of the json, from the same parse as its validation."""
+    parse_dashboard(dashboard_json)
+
+    return content_hash(dashboard_json)
+
+
+def validate_dashboard_process(
+    dashboard_json: str, volatile_fields: tuple
+) -> Tuple[str, str, str]:
+    """Validation run in a worker process, returns grafana uid, grafana title and content hash.
+
+    The content hash is returned so the handler process does not need to parse the json again.
+    """
+    dashboard_uid, dashboard_title = get_dashboard_json_meta(dashboard_json)
+
+    return dashboard_uid, dashboard_title, content_hash(dashboard_json, volatile_fields)
@@ -0,0 +1,197 @@
+"""Linux inotify watch of the working directory."""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterable
+
+# inotify(7) event masks
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """Minimal ctypes wrapper around the libc inotify calls."""
+
+    def __init__(self):
+        """Open an inotify file descriptor, raises OSError when not supported."""
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("libc not found")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify not supported on this platform")
+
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path: Path, mask: int = WATCH_MASK) -> int:
+        """Watch a single directory, returns the watch descriptor."""
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed: {path}")
+        return wd
+
+    def read(self, timeout: float):
+        """Yield (wd, mask, name) for each event available within timeout seconds."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            end = offset + length
+            name = data[offset:end].rstrip(b"\0")
+            offset = end
+            yield wd, mask, os.fsdecode(name)
+
+    def close(self):
+        """Close the inotify file descriptor."""
+        os.close(self.fd)
+
+
+class WorkingDirWatcher(threading.Thread):
+    """Watch the working dir and pass changed dashboard paths to a handler.
+
+    Paths are relative to the working dir (`dir/name.json`). Repeated events for a path are collapsed
+    and only handed over once the path has been quiet for `settle` seconds, which also lets the
+    sidecar's own writes and index updates land first. Handler calls are limited to `rate` per second
+    with a token bucket. On a kernel queue overflow every path returned by `owned_paths` is queued.
+    """
+
+    def __init__(
+        self,
+        working_dir: str,
+        handler: Callable[[str], None],
+        rate: float = 10,
+        settle: float = 2,
+        ignore: tuple = (),
+        owned_paths: Callable[[], Iterable[str]] = None,
+    ):
+        """Watcher parameters, watches are only added when the thread starts."""
+        super().__init__(name="working-dir-watcher", daemon=True)
+        self.working_dir = Path(working_dir)
+        self.handler = handler
+        self.rate = rate
+        self.settle = settle
+        self.ignore = ignore
+        self.owned_paths = owned_paths
+        self.pending = {}
+        self.stop_flag = threading.Event()
+        self.inotify = Inotify()
+        self.watches = {}
+        self.tokens = rate
+        self.last_refill = time.monotonic()
+
+    def add_tree(self, path: Path):
+        """Watch path and every directory below it."""
+        for root, dirs, _ in os.walk(path):
+            dirs[:] = [d for d in dirs if d not in self.ignore]
+            self.watches[self.inotify.add_watch(Path(root))] = Path(root)
+
+    def queue_event(self, wd: int, mask: int, name: str):
+        """Translate a single inotify event into a pending dashboard path."""
+        if mask & IN_Q_OVERFLOW:
+            # events lost, fall back to checking every path the sidecar owns
+            logging.warning("working dir watch queue overflow, checking all dashboards")
+            if self.owned_paths is not None:
+                now = time.monotonic()
+                for path in self.owned_paths():
+                    self.pending[path] = now
+            return
+
+        if mask & (IN_IGNORED | IN_DELETE_SELF):
+            self.watches.pop(wd, None)
+            return
+
+        parent = self.watches.get(wd)
+        if parent is None or not name or name in self.ignore:
+            return
+
+        path = Path(parent, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_tree(path)
+                for child in path.rglob("*.json"):
+                    self.pending[str(child.relative_to(self.working_dir))] = (
+                        time.monotonic()
+                    )
+            return
+
+        if path.suffix == ".json":
+            self.pending[str(path.relative_to(self.working_dir))] = time.monotonic()
+
+    def take_token(self) -> bool:
+        """Token bucket used to rate limit handler calls."""
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def handle_pending(self):
+        """Hand over settled paths within the rate limit."""
+        now = time.monotonic()
+        for path, last_event in list(self.pending.items()):
+            if now - last_event < self.settle:
+                continue
+            if not self.take_token():
+                return
+            del self.pending[path]
+            try:
+                self.handler(path)
+            except Exception as e:
+                logging.error(
+                    f"unexpected error handling working dir change {path}: {e}"
+                )
+
+    def run(self):
+        """Read events until stopped."""
+        self.add_tree(self.working_dir)
+        logging.info(f"watching working dir: {self.working_dir}")
+
+        try:
+            while not self.stop_flag.is_set():
+                timeout = self.settle / 2 if self.pending else 1
+                for wd, mask, name in self.inotify.read(timeout):
+                    self.queue_event(wd, mask, name)
+                self.handle_pending()
+        finally:
+            self.inotify.close()
+
+    def stop(self):
+        """Stop the watcher thread."""
+        self.stop_flag.set()
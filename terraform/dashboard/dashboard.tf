@@ -10,10 +10,12 @@ resource "kubernetes_manifest" "grafana_dashboard" {
       annotations = var.annotations
     }
 
-    spec = {
-      name = var.dashboard_name
-      dir  = var.dashboard_dir
-      json = var.dashboard_json
-    }
+    spec = merge(
+      {
+        name = var.dashboard_name
+        dir  = var.dashboard_dir
+      },
+      var.compress_json ? tomap({ jsonGzip = base64gzip(var.dashboard_json) }) : tomap({ json = var.dashboard_json }),
+    )
   }
 }
@@ -18,6 +18,12 @@ variable "dashboard_json" {
   type        = string
 }
 
+variable "compress_json" {
+  description = "send the dashboard json gzip compressed (spec.jsonGzip), for dashboards close to the object size limit."
+  type        = bool
+  default     = false
+}
+
 variable "labels" {
   description = "Map of labels to be added to resource metadata."
   type        = map(string)
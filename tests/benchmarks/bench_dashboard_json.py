@@ -0,0 +1,97 @@
+"""Benchmark the per event cost of indexing a dashboard: reading uid/title with a full json parse against
+extract_json_fields (other shards), and the full index (uid and content hash) uncached against cached.
+
+Run: `python tests/benchmarks/bench_dashboard_json.py`
+"""
+
+import json
+import timeit
+
+# local library
+from sidecar.dashboard_files import _json_cache, extract_json_fields
+from sidecar.validation import dashboard_hash, get_dashboard_json_meta
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+
+
+def make_dashboard(size: int, sort_keys: bool = True) -> str:
+    """Build a dashboard json of roughly size bytes, panels referencing a datasource uid."""
+    panels = []
+    dashboard = {
+        "annotations": {"list": []},
+        "panels": panels,
+        "schemaVersion": 27,
+        "title": "benchmark",
+        "uid": "benchmark",
+        "version": 1,
+    }
+
+    panel_size = len(json.dumps(make_panel(0), indent=2))
+    for panel_id in range(max(1, size // panel_size)):
+        panels.append(make_panel(panel_id))
+
+    return json.dumps(dashboard, indent=2, sort_keys=sort_keys)
+
+
+def make_panel(panel_id: int) -> dict:
+    return {
+        "datasource": {"type": "prometheus", "uid": "prometheus"},
+        "gridPos": {"h": 8, "w": 12, "x": 0, "y": panel_id},
+        "id": panel_id,
+        "targets": [{"expr": 'rate(http_requests_total{job="x"}[5m])', "refId": "A"}],
+        "title": f"panel {panel_id}",
+        "type": "timeseries",
+    }
+
+
+def full_parse(dashboard_json: str):
+    dashboard = json.loads(dashboard_json)
+    return dashboard["uid"], dashboard["title"]
+
+
+def extract(dashboard_json: str):
+    fields = extract_json_fields(dashboard_json, ("uid", "title"))
+    return fields["uid"], fields["title"]
+
+
+def index(dashboard_json: str):
+    return get_dashboard_json_meta(dashboard_json)[0], dashboard_hash(dashboard_json)
+
+
+def uncached_index(dashboard_json: str):
+    _json_cache.clear()
+    return index(dashboard_json)
+
+
+def bench(func, dashboard_json: str) -> float:
+    """Return the best time per call in milliseconds."""
+    number = max(1, 2_000_000 // len(dashboard_json))
+    return (
+        min(timeit.repeat(lambda: func(dashboard_json), number=number, repeat=3))
+        / number
+        * 1000
+    )
+
+
+def main():
+    print(
+        f"{'size':>12} {'json.loads (ms)':>16} {'extract (ms)':>14} {'speedup':>9}"
+        f" {'uncached (ms)':>14} {'cached (ms)':>12}"
+    )
+    for size in SIZES:
+        dashboard_json = make_dashboard(size)
+        assert extract(dashboard_json) == ("benchmark", "benchmark")
+        assert index(dashboard_json)[0] == "benchmark"
+
+        parse = bench(full_parse, dashboard_json)
+        extracted = bench(extract, dashboard_json)
+        uncached = bench(uncached_index, dashboard_json)
+        cached = bench(index, dashboard_json)
+        print(
+            f"{len(dashboard_json):>12} {parse:>16.3f} {extracted:>14.3f} {parse / extracted:>8.1f}x"
+            f" {uncached:>14.3f} {cached:>12.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
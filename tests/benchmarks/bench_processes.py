@@ -0,0 +1,84 @@
+"""Benchmark create handler throughput with dashboards split between K worker processes.
+
+Run: `python tests/benchmarks/bench_processes.py`
+"""
+
+import json
+import logging
+import tempfile
+import time
+from multiprocessing import get_context
+from types import SimpleNamespace
+
+from bench_dashboard_json import make_dashboard
+
+# local library
+import sidecar.sidecar as sidecar
+
+PROCESSES = [1, 2, 4]
+DASHBOARDS = 400
+SIZE = 100_000
+
+
+def make_dashboards(count: int, size: int) -> list:
+    """Specs of distinct dashboards of about size bytes each."""
+    dashboard = json.loads(make_dashboard(size))
+    specs = []
+    for i in range(count):
+        dashboard["uid"] = f"uid-{i}"
+        dashboard["title"] = f"title-{i}"
+        specs.append(
+            {
+                "dir": f"dir{i % 10}",
+                "name": f"dashboard-{i}",
+                "json": json.dumps(dashboard),
+            }
+        )
+    return specs
+
+
+def worker(working_dir: str, specs: list, ready):
+    """Run the create handler for each spec, as a worker's operator would."""
+    sidecar._working_dir = working_dir
+    logger = logging.getLogger("bench")
+    # start together once all workers are imported
+    ready.wait()
+    for spec in specs:
+        sidecar.create({}, SimpleNamespace(status={}), spec["name"], spec, logger)
+
+
+def bench(processes: int, specs: list) -> float:
+    """Return the seconds taken to create all specs split between processes."""
+    context = get_context("spawn")
+    ready = context.Barrier(processes + 1)
+    with tempfile.TemporaryDirectory() as working_dir:
+        workers = [
+            context.Process(
+                target=worker, args=(working_dir, specs[i::processes], ready)
+            )
+            for i in range(processes)
+        ]
+        for process in workers:
+            process.start()
+        ready.wait()
+        start = time.perf_counter()
+        for process in workers:
+            process.join()
+        return time.perf_counter() - start
+
+
+def main():
+    specs = make_dashboards(DASHBOARDS, SIZE)
+    print(f"{'processes':>10} {'seconds':>8} {'dashboards/s':>13} {'speedup':>8}")
+    baseline = None
+    for processes in PROCESSES:
+        seconds = bench(processes, specs)
+        baseline = baseline or seconds
+        print(
+            f"{processes:>10} {seconds:>8.2f} {len(specs) / seconds:>13.0f}"
+            f" {baseline / seconds:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Benchmark the dashboard validation rules against the rest of the work done by a create handler.
+
+Run: `python tests/benchmarks/bench_validation.py`
+"""
+
+import json
+import tempfile
+import timeit
+from pathlib import Path
+
+from bench_dashboard_json import make_dashboard
+
+# local library
+from sidecar.validation import apply_rules
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+
+
+def bench(func) -> float:
+    """Return the best time per call in milliseconds."""
+    number = 5
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1000
+
+
+def main():
+    print(
+        f"{'size':>12} {'rules (ms)':>11} {'parse (ms)':>11} {'write (ms)':>11}"
+        f" {'rules share':>12} {'rules MB/s':>11}"
+    )
+    with tempfile.TemporaryDirectory() as working_dir:
+        for size in SIZES:
+            dashboard_json = make_dashboard(size)
+            dashboard = json.loads(dashboard_json)
+            path = Path(working_dir, "bench.json")
+
+            rules = bench(lambda: apply_rules(dashboard))
+            parse = bench(lambda: json.loads(dashboard_json))
+            write = bench(lambda: path.write_text(dashboard_json))
+
+            share = rules / (rules + parse + write) * 100
+            throughput = len(dashboard_json) / 1024 / 1024 / (rules / 1000)
+            print(
+                f"{len(dashboard_json):>12} {rules:>11.3f} {parse:>11.3f} {write:>11.3f}"
+                f" {share:>11.1f}% {throughput:>11.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+import sidecar.exceptions as exceptions
+
+# local library
+from sidecar.config_maps import ConfigMapCache
+
+
+def test_fetch_once():
+    """Test a ConfigMap read by many dashboards at once is fetched once."""
+    fetched = []
+    release = threading.Event()
+
+    def fetch(namespace, name):
+        fetched.append((namespace, name))
+        release.wait(1)
+        return "1", {"a.json": "{}", "b.json": "[]"}
+
+    cache = ConfigMapCache(fetch)
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda key: results.append(cache.get("ns", "cm", key)),
+            args=(key,),
+        )
+        for key in ["a.json", "b.json"] * 4
+    ]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert fetched == [("ns", "cm")]
+    assert sorted(results) == ["[]"] * 4 + ["{}"] * 4
+
+
+def test_put():
+    """Test watched ConfigMaps replace the cached data only for a new resource version."""
+    cache = ConfigMapCache(lambda namespace, name: pytest.fail("fetched"))
+
+    assert cache.put("ns", "cm", "1", {"a.json": "{}"})
+    assert not cache.put("ns", "cm", "1", {"a.json": "{}"})
+    assert cache.put("ns", "cm", "2", {"a.json": "[]"})
+    assert cache.get("ns", "cm", "a.json") == "[]"
+    assert cache.cached("ns", "cm", "a.json") == "[]"
+
+    cache.remove("ns", "cm")
+    assert cache.cached("ns", "cm", "a.json") is None
+
+
+def test_missing_key():
+    """Test a missing key is reported, a missing ConfigMap by the fetch."""
+
+    def fetch(namespace, name):
+        if name == "missing":
+            raise exceptions.configMapKeyNotFound
+        return "1", None
+
+    cache = ConfigMapCache(fetch)
+    with pytest.raises(exceptions.configMapKeyNotFound):
+        cache.get("ns", "cm", "a.json")
+    with pytest.raises(exceptions.configMapKeyNotFound):
+        cache.get("ns", "missing", "a.json")
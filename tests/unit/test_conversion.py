@@ -0,0 +1,85 @@
+import base64
+import gzip
+import json
+
+import pytest
+from click.testing import CliRunner
+
+import sidecar.exceptions as exceptions
+
+# local library
+from sidecar.conversion import cli, convert, to_v1, to_v2
+
+DASHBOARD = {"uid": "test", "title": "tést", "panels": [{"id": 1}]}
+
+
+def resource(**spec) -> dict:
+    """Dashboard resource in the v1 form."""
+    return {
+        "apiVersion": "example.co.uk/v1",
+        "kind": "GrafanaDashboard",
+        "metadata": {"name": "test"},
+        "spec": {"dir": "dir1", "name": "test", **spec},
+    }
+
+
+@pytest.mark.parametrize(
+    "spec",
+    [
+        {"json": json.dumps(DASHBOARD)},
+        {"jsonGzip": base64.b64encode(gzip.compress(json.dumps(DASHBOARD).encode()))},
+    ],
+)
+def test_to_v2(spec):
+    """Test string and compressed json are decoded into spec.dashboard."""
+    if "jsonGzip" in spec:
+        spec["jsonGzip"] = spec["jsonGzip"].decode()
+    body = resource(**spec)
+    converted = to_v2(body, 10_000)
+
+    assert converted["apiVersion"] == "example.co.uk/v2"
+    assert converted["spec"] == {"dir": "dir1", "name": "test", "dashboard": DASHBOARD}
+    # the input is left unchanged
+    assert body == resource(**spec)
+
+
+def test_round_trip():
+    """Test v2 resources convert back to the v1 string form."""
+    converted = to_v1(to_v2(resource(json=json.dumps(DASHBOARD)), 10_000), 10_000)
+
+    assert converted["apiVersion"] == "example.co.uk/v1"
+    assert json.loads(converted["spec"]["json"]) == DASHBOARD
+
+
+def test_config_map_ref_unchanged():
+    """Test json read from a ConfigMap is left as a reference."""
+    ref = {"configMapKeyRef": {"name": "dashboards", "key": "test.json"}}
+    converted = to_v2(resource(jsonFrom=ref), 10_000)
+
+    assert converted["spec"]["jsonFrom"] == ref
+    assert "dashboard" not in converted["spec"]
+
+
+@pytest.mark.parametrize("dashboard_json", ["{", "[]"])
+def test_to_v2_invalid(dashboard_json):
+    with pytest.raises(exceptions.invalidJson):
+        to_v2(resource(json=dashboard_json), 10_000)
+
+
+def test_cli():
+    """Test a resource list from kubectl is converted item by item."""
+    document = {"kind": "List", "items": [resource(json=json.dumps(DASHBOARD))] * 2}
+    result = CliRunner().invoke(cli, ["--to", "v2"], input=json.dumps(document))
+
+    assert result.exit_code == 0
+    assert json.loads(result.output) == convert(document, "v2", 10_000)
+    assert [i["spec"]["dashboard"] for i in json.loads(result.output)["items"]] == [
+        DASHBOARD
+    ] * 2
+
+
+def test_cli_invalid():
+    result = CliRunner().invoke(cli, input=json.dumps(resource(json="{")))
+
+    assert result.exit_code == 1
+    assert "conversion failed: json passed has invalid syntax" in result.output
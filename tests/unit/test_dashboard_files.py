@@ -1,16 +1,36 @@
+import errno
+import json
 from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock
 
 import pytest
 
+import sidecar.dashboard_files as dashboard_files
 import sidecar.exceptions as exceptions
 
 # local library
 from sidecar.dashboard_files import (
+    BLOB_DIR,
+    blob_name,
+    canonicalize,
     check_file,
+    content_hash,
     create_file,
     delete_file,
+    delete_files,
+    extract_json_fields,
+    gc_blobs,
+    high_water_bytes,
+    init_usage,
     remove_empty_dir,
+    restore_blob,
+    serialize_dashboard,
+    serialized_hash,
+    set_high_water,
     update_file,
+    usage_changes,
+    usage_total,
 )
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
@@ -51,6 +71,10 @@ def fixture_dir(tmp_path):
 TEST_1_JSON = open_json_fixture("test-1.json")
 TEST_2_JSON = open_json_fixture("dir1/test-2.json")
 INVALID_JSON = "invalid json"
+# semantically the same as TEST_1_JSON: key order, whitespace and volatile fields differ
+TEST_1_JSON_REWRITTEN = json.dumps(
+    dict(reversed(list({**json.loads(TEST_1_JSON), "id": 99, "version": 7}.items())))
+)
 
 
 @pytest.mark.parametrize(
@@ -73,6 +97,11 @@ def test_check_file_pass(fixture_dir, path, new_json):
         assert p.read_text() == new_json
 
 
+def test_check_file_semantic_pass(fixture_dir):
+    """key order, whitespace and volatile fields are not drift"""
+    assert check_file(fixture_dir, "test-1.json", TEST_1_JSON_REWRITTEN) is True
+
+
 @pytest.mark.parametrize(
     "path, new_json, expected_exception",
     [
@@ -122,6 +151,39 @@ def test_create_file_fail(fixture_dir, path, new_file_content, expected_exceptio
         create_file(fixture_dir, path, new_file_content)
 
 
+@pytest.mark.parametrize(
+    "error, expected_exception",
+    [
+        (errno.ENOSPC, exceptions.noSpaceLeft),
+        (errno.EIO, exceptions.ioError),
+        (errno.ESTALE, exceptions.fileSystemUnavailable),
+    ],
+)
+def test_create_file_transient_fail(
+    monkeypatch, fixture_dir, error, expected_exception
+):
+    """Test transient file system errors are raised as transientError."""
+
+    def write_text(*args):
+        raise OSError(error, "failed")
+
+    monkeypatch.setattr(Path, "write_text", write_text)
+    with pytest.raises(expected_exception) as e:
+        create_file(fixture_dir, "transient.json", TEST_1_JSON)
+    assert isinstance(e.value, exceptions.transientError)
+
+
+def test_create_file_os_error_fail(monkeypatch, fixture_dir):
+    """Test other os errors are not retried as transient."""
+
+    def write_text(*args):
+        raise OSError(errno.EROFS, "read only")
+
+    monkeypatch.setattr(Path, "write_text", write_text)
+    with pytest.raises(OSError):
+        create_file(fixture_dir, "transient.json", TEST_1_JSON)
+
+
 @pytest.mark.parametrize(
     "old_path, new_path, new_json",
     [
@@ -161,6 +223,8 @@ def test_update_file_pass(fixture_dir, old_path, new_path, new_json):
     [
         ("", "", "", exceptions.nothingToDo),
         ("test-1.json", "test-1.json", "", exceptions.nothingToDo),
+        ("test-1.json", "", TEST_1_JSON, exceptions.nothingToDo),
+        ("test-1.json", "", TEST_1_JSON_REWRITTEN, exceptions.nothingToDo),
         ("nofile.json", "not-exist.json", "", exceptions.oldPathDoesNotExist),
         ("test-1.json", "", "invalid-json.json", exceptions.invalidJson),
         ("test-1.json", "dir1/test-2.json", "", exceptions.duplicateName),
@@ -199,6 +263,24 @@ def test_delete_file_fail(fixture_dir, path, expected_exception):
         delete_file(fixture_dir, path)
 
 
+def test_delete_files(fixture_dir):
+    """Test a batch deletes its files, reports missing ones and removes dirs left empty once."""
+    Path(fixture_dir, "teardown").mkdir()
+    paths = [f"teardown/dashboard-{i}.json" for i in range(5)]
+    for path in paths:
+        create_file(fixture_dir, path, "{}")
+
+    results = delete_files(
+        fixture_dir, paths + ["dir1/test-2.json", "dir1/nofile.json"]
+    )
+
+    assert results[:6] == [None] * 6
+    assert isinstance(results[6], exceptions.noFileExists)
+    assert Path(fixture_dir, "teardown").exists() is False
+    # dirs with dashboards left are kept
+    assert Path(fixture_dir, "dir1").is_dir()
+
+
 @pytest.mark.parametrize(
     "path",
     [
@@ -226,3 +308,298 @@ def test_remove_empty_dir_fail(fixture_dir, path, expected_exception):
 
     with pytest.raises(expected_exception):
         remove_empty_dir(path)
+
+
+@pytest.mark.parametrize(
+    "paths, new_file_content",
+    [
+        (["store-1.json", "dir1/store-2.json"], TEST_1_JSON),
+    ],
+)
+def test_create_file_content_store_pass(fixture_dir, paths, new_file_content):
+    for path in paths:
+        assert create_file(fixture_dir, path, new_file_content, True) is True
+
+    blob = Path(fixture_dir, BLOB_DIR, blob_name(new_file_content))
+    assert blob.is_file() is True
+    assert len(list(Path(fixture_dir, BLOB_DIR).iterdir())) == 1
+
+    for path in paths:
+        p = Path(fixture_dir, path)
+        assert p.read_text() == new_file_content
+        assert p.samefile(blob) is True
+
+
+def test_update_file_content_store_pass(fixture_dir):
+    create_file(fixture_dir, "store-1.json", TEST_1_JSON, True)
+    create_file(fixture_dir, "dir1/store-2.json", TEST_1_JSON, True)
+    old_blob = Path(fixture_dir, BLOB_DIR, blob_name(TEST_1_JSON))
+
+    # path change is a rename of the link
+    update_file(fixture_dir, "store-1.json", "dir1/store-3.json", "", True)
+    assert Path(fixture_dir, "dir1/store-3.json").samefile(old_blob) is True
+
+    # json change relinks to a new blob, old blob kept while still referenced
+    update_file(fixture_dir, "dir1/store-3.json", "", TEST_2_JSON, True)
+    assert Path(fixture_dir, "dir1/store-3.json").read_text() == TEST_2_JSON
+    assert Path(fixture_dir, "dir1/store-2.json").read_text() == TEST_1_JSON
+    assert old_blob.is_file() is True
+
+    # last reference to old blob removed
+    update_file(fixture_dir, "dir1/store-2.json", "", TEST_2_JSON, True)
+    assert old_blob.is_file() is False
+
+
+def test_delete_file_content_store_pass(fixture_dir):
+    create_file(fixture_dir, "store-1.json", TEST_1_JSON, True)
+    create_file(fixture_dir, "dir1/store-2.json", TEST_1_JSON, True)
+    blob = Path(fixture_dir, BLOB_DIR, blob_name(TEST_1_JSON))
+
+    delete_file(fixture_dir, "store-1.json", True)
+    assert blob.is_file() is True
+
+    delete_file(fixture_dir, "dir1/store-2.json", True)
+    assert blob.is_file() is False
+
+
+def test_content_store_volatile_fields(fixture_dir):
+    """dashboards only differing in volatile fields are stored as separate blobs, each with its own bytes"""
+    create_file(fixture_dir, "store-1.json", TEST_1_JSON, True)
+    create_file(fixture_dir, "store-2.json", TEST_1_JSON_REWRITTEN, True)
+
+    assert Path(fixture_dir, "store-1.json").read_text() == TEST_1_JSON
+    assert Path(fixture_dir, "store-2.json").read_text() == TEST_1_JSON_REWRITTEN
+
+    delete_file(fixture_dir, "store-1.json", True)
+    assert Path(fixture_dir, BLOB_DIR, blob_name(TEST_1_JSON)).is_file() is False
+    assert Path(fixture_dir, "store-2.json").read_text() == TEST_1_JSON_REWRITTEN
+
+
+def test_restore_blob(fixture_dir):
+    """a file removed outside the sidecar is restored from the blob it was last linked to"""
+    create_file(fixture_dir, "dir1/store-1.json", TEST_1_JSON, True)
+    create_file(fixture_dir, "dir1/store-2.json", TEST_1_JSON_REWRITTEN, True)
+    update_file(fixture_dir, "dir1/store-1.json", "dir1/store-3.json", "", True)
+    full_path = Path(fixture_dir, "dir1/store-3.json")
+    full_path.unlink()
+
+    assert restore_blob(fixture_dir, full_path) is True
+    assert full_path.read_text() == TEST_1_JSON
+    # never linked by this process
+    assert restore_blob(fixture_dir, Path(fixture_dir, "dir1/unknown.json")) is False
+
+
+def test_update_file_content_store_disabled(fixture_dir):
+    """files left hardlinked by --content-store are not changed through each other"""
+    create_file(fixture_dir, "x/one.json", TEST_1_JSON, True)
+    create_file(fixture_dir, "y/two.json", TEST_1_JSON, True)
+
+    update_file(fixture_dir, "x/one.json", "", TEST_2_JSON, False)
+
+    assert Path(fixture_dir, "x/one.json").read_text() == TEST_2_JSON
+    assert Path(fixture_dir, "y/two.json").read_text() == TEST_1_JSON
+    blob = Path(fixture_dir, BLOB_DIR, blob_name(TEST_1_JSON))
+    assert blob.read_text() == TEST_1_JSON
+
+
+def test_create_file_content_store_released(fixture_dir, monkeypatch):
+    """a blob released by another process between store and link is stored again"""
+    create_file(fixture_dir, "store-1.json", TEST_1_JSON, True)
+    blob = Path(fixture_dir, BLOB_DIR, blob_name(TEST_1_JSON))
+    link_blob = dashboard_files.link_blob
+    released = []
+
+    def release_then_link(blob, full_path):
+        if not released:
+            Path(fixture_dir, "store-1.json").unlink()
+            blob.unlink()
+            released.append(blob)
+        link_blob(blob, full_path)
+
+    monkeypatch.setattr("sidecar.dashboard_files.link_blob", release_then_link)
+
+    assert create_file(fixture_dir, "store-2.json", TEST_1_JSON, True) is True
+    assert Path(fixture_dir, "store-2.json").samefile(blob) is True
+
+
+def test_gc_blobs(fixture_dir):
+    create_file(fixture_dir, "store-1.json", TEST_1_JSON, True)
+    create_file(fixture_dir, "store-2.json", TEST_2_JSON, True)
+
+    # removed outside the sidecar, leaving an orphaned blob
+    Path(fixture_dir, "store-2.json").unlink()
+
+    assert gc_blobs(fixture_dir) == 1
+    assert Path(fixture_dir, BLOB_DIR, blob_name(TEST_1_JSON)).is_file() is True
+    assert Path(fixture_dir, BLOB_DIR, blob_name(TEST_2_JSON)).is_file() is False
+
+
+@pytest.mark.parametrize(
+    "dashboard_json, ignore_fields, expected",
+    [
+        ('{ "b": 1, "a": [1, 2] }', (), '{"a":[1,2],"b":1}'),
+        ('{"uid": "1", "id": 3, "version": 2}', ("id", "version"), '{"uid":"1"}'),
+        ('{"title": "£"}', (), '{"title":"£"}'),
+        ("[1, 2]", ("id",), "[1,2]"),
+    ],
+)
+def test_canonicalize(dashboard_json, ignore_fields, expected):
+    assert canonicalize(dashboard_json, ignore_fields) == expected
+
+
+@pytest.mark.parametrize(
+    "json_a, json_b, expected_equal",
+    [
+        (TEST_1_JSON, TEST_1_JSON_REWRITTEN, True),
+        (TEST_1_JSON, TEST_2_JSON, False),
+        (INVALID_JSON, INVALID_JSON, True),
+        (INVALID_JSON, TEST_1_JSON, False),
+    ],
+)
+def test_content_hash(json_a, json_b, expected_equal):
+    assert (content_hash(json_a) == content_hash(json_b)) is expected_equal
+
+
+@pytest.mark.parametrize("canonical", [False, True])
+def test_serialize_dashboard(canonical):
+    dashboard = json.loads(TEST_1_JSON)
+    dashboard_json = serialize_dashboard(dashboard, canonical)
+
+    assert json.loads(dashboard_json) == dashboard
+    assert (dashboard_json == canonicalize(TEST_1_JSON)) is canonical
+    # hash recorded from the object matches the hash of the same json as a string
+    assert content_hash(dashboard_json) == content_hash(TEST_1_JSON)
+
+
+def test_serialize_dashboard_once(monkeypatch):
+    """Test the same object is serialized and hashed once, an equal object again."""
+    dashboard = json.loads(TEST_1_JSON)
+    dumps = MagicMock(side_effect=json.dumps)
+    monkeypatch.setattr("sidecar.dashboard_files.json.dumps", dumps)
+
+    dashboard_json = serialize_dashboard(dashboard)
+    assert serialized_hash(dashboard) == content_hash(TEST_1_JSON)
+    calls = dumps.call_count
+    assert serialize_dashboard(dashboard) is dashboard_json
+    assert serialized_hash(dashboard) == content_hash(TEST_1_JSON)
+    assert dumps.call_count == calls
+
+    serialize_dashboard(json.loads(TEST_1_JSON))
+    assert dumps.call_count > calls
+
+
+def test_content_hash_ignore_fields():
+    assert content_hash(TEST_1_JSON, ()) != content_hash(TEST_1_JSON_REWRITTEN, ())
+
+
+@pytest.mark.parametrize(
+    "dashboard_json, fields, expected",
+    [
+        (TEST_1_JSON, ("uid", "title"), {"uid": "1111111", "title": "test-1"}),
+        # nested uid/title keys after the top level fields
+        (
+            '{"title": "t", "uid": "u", "panels": [{"title": "p", "datasource": {"uid": "ds"}}]}',
+            ("uid", "title"),
+            {"uid": "u", "title": "t"},
+        ),
+        # nested keys only, top level fields missing
+        ('{"panels": [{"title": "p", "uid": "ds"}]}', ("uid", "title"), {}),
+        # token inside a string value
+        ('{"description": "\\"uid\\": 1", "uid": "u"}', ("uid",), {"uid": "u"}),
+        ('{"uid": "u1", "uid": "u2"}', ("uid",), {"uid": "u2"}),
+        ('["uid"]', ("uid",), {}),
+    ],
+)
+def test_extract_json_fields(dashboard_json, fields, expected):
+    assert extract_json_fields(dashboard_json, fields) == expected
+
+
+def test_extract_json_fields_invalid():
+    with pytest.raises(ValueError):
+        extract_json_fields(INVALID_JSON, ("uid",))
+
+
+def test_usage_tracking(monkeypatch, fixture_dir):
+    """Test usage per directory follows creates, updates, renames and deletes without a walk."""
+    monkeypatch.setattr("sidecar.dashboard_files._usage", {})
+    monkeypatch.setattr("sidecar.dashboard_files._usage_files", {})
+    monkeypatch.setattr("sidecar.dashboard_files._usage_changed", set())
+
+    def walked():
+        usage = {}
+        for path in fixture_dir.rglob("*.json"):
+            entry = usage.setdefault(str(path.parent.relative_to(fixture_dir)), [0, 0])
+            entry[0] += path.stat().st_size
+            entry[1] += 1
+        return {d: tuple(entry) for d, entry in usage.items()}
+
+    total = init_usage(fixture_dir)
+    assert total == sum(size for size, _ in walked().values())
+    usage_changes()
+
+    create_file(fixture_dir, "usage/new.json", TEST_1_JSON)
+    update_file(fixture_dir, "dir1/test-2.json", "usage/test-2.json", TEST_1_JSON)
+    update_file(fixture_dir, "test-1.json", "", TEST_2_JSON)
+    delete_file(fixture_dir, "usage/new.json")
+
+    changes = usage_changes()
+    assert set(changes) == {"usage", "dir1", "."}
+    assert {d: u for d, u in changes.items() if u} == {
+        d: u for d, u in walked().items() if d in changes
+    }
+    assert usage_total() == sum(size for size, _ in walked().values())
+
+
+def test_usage_removed_outside(monkeypatch, fixture_dir):
+    """Test a file removed outside the sidecar is not counted, nor counted twice once recreated."""
+    monkeypatch.setattr("sidecar.dashboard_files._usage", {})
+    monkeypatch.setattr("sidecar.dashboard_files._usage_files", {})
+    total = init_usage(fixture_dir)
+    size = Path(fixture_dir, "test-1.json").stat().st_size
+
+    Path(fixture_dir, "test-1.json").unlink()
+    with pytest.raises(exceptions.noFileExists):
+        check_file(fixture_dir, "test-1.json")
+    assert usage_total() == total - size
+
+    create_file(fixture_dir, "test-1.json", TEST_1_JSON)
+    Path(fixture_dir, "test-1.json").unlink()
+    create_file(fixture_dir, "test-1.json", TEST_1_JSON)
+    assert usage_total() == total - size + len(TEST_1_JSON)
+
+
+def test_high_water_percent(monkeypatch, fixture_dir):
+    """Test the percent high water mark is checked against the space in use on the whole volume."""
+    volume = SimpleNamespace(f_blocks=1000, f_bavail=150, f_frsize=1024)
+    monkeypatch.setattr("sidecar.dashboard_files.os.statvfs", lambda path: volume)
+    set_high_water(0, 90)
+    try:
+        assert high_water_bytes(fixture_dir) == 921600
+        create_file(fixture_dir, "dir1/fits.json", TEST_1_JSON)
+
+        volume.f_bavail = 100
+        with pytest.raises(exceptions.workingDirFull):
+            create_file(fixture_dir, "dir1/full.json", TEST_1_JSON)
+        assert not Path(fixture_dir, "dir1/full.json").exists()
+        delete_file(fixture_dir, "dir1/fits.json")
+    finally:
+        set_high_water(0)
+
+
+def test_high_water(monkeypatch, fixture_dir):
+    """Test writes over the high water mark are refused before writing."""
+    monkeypatch.setattr("sidecar.dashboard_files._usage", {})
+    monkeypatch.setattr("sidecar.dashboard_files._usage_files", {})
+    total = init_usage(fixture_dir)
+    set_high_water(total + len(TEST_1_JSON))
+    try:
+        create_file(fixture_dir, "dir1/fits.json", TEST_1_JSON)
+        with pytest.raises(exceptions.workingDirFull):
+            create_file(fixture_dir, "dir1/full.json", TEST_1_JSON)
+        assert not Path(fixture_dir, "dir1/full.json").exists()
+
+        # shrinking and deleting is always allowed
+        update_file(fixture_dir, "dir1/fits.json", "", "{}")
+        delete_file(fixture_dir, "dir1/fits.json")
+    finally:
+        set_high_water(0)
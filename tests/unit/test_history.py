@@ -0,0 +1,136 @@
+import json
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner
+
+import sidecar.exceptions as exceptions
+
+# local library
+from sidecar.dashboard_files import content_hash
+from sidecar.history import (
+    HISTORY_DIR,
+    clear_rollback,
+    cli,
+    enforce_size,
+    history_size,
+    list_versions,
+    read_version,
+    record_version,
+    restore_version,
+    rolled_back,
+)
+
+PATH = "dir1/test.json"
+
+
+def dashboard(version: int) -> str:
+    """Distinct dashboard json per version."""
+    return json.dumps({"uid": "test", "title": "test", "panels": [], "n": version})
+
+
+@pytest.fixture()
+def working_dir(tmp_path):
+    """Working dir with the dashboard dir."""
+    Path(tmp_path, "dir1").mkdir()
+    return tmp_path
+
+
+def test_record_version(working_dir):
+    """Test versions are deduplicated, compressed and limited to the last `keep`."""
+    added = record_version(working_dir, PATH, dashboard(1), keep=3)
+    assert added > 0
+    # same content as the newest version is not recorded again
+    assert record_version(working_dir, PATH, dashboard(1), keep=3) == 0
+
+    for version in range(2, 6):
+        added += record_version(working_dir, PATH, dashboard(version), keep=3)
+
+    versions = list_versions(working_dir, PATH)
+    assert len(versions) == 3
+    assert [read_version(working_dir, PATH, v["version"]) for v in versions] == [
+        dashboard(5),
+        dashboard(4),
+        dashboard(3),
+    ]
+    # removed versions release their objects
+    assert added == history_size(working_dir)
+    assert len(list(Path(working_dir, HISTORY_DIR, "objects").iterdir())) == 3
+
+
+def test_record_version_shared_content(working_dir):
+    """Test identical content of different dashboards is stored once."""
+    record_version(working_dir, PATH, dashboard(1), keep=3)
+    record_version(working_dir, "dir1/other.json", dashboard(1), keep=3)
+
+    assert len(list(Path(working_dir, HISTORY_DIR, "objects").iterdir())) == 1
+
+
+def test_enforce_size(working_dir):
+    """Test the oldest versions go first and the newest version of each path is kept."""
+    size = 0
+    for version in range(5):
+        size += record_version(working_dir, PATH, dashboard(version), keep=10)
+    size += record_version(working_dir, "dir1/other.json", dashboard(99), keep=10)
+
+    size = enforce_size(working_dir, 0, size)
+
+    assert size == history_size(working_dir)
+    assert [v["hash"] for v in list_versions(working_dir, PATH)] == [
+        content_hash(dashboard(4), ())
+    ]
+    assert len(list_versions(working_dir, "dir1/other.json")) == 1
+
+
+def test_restore_version(working_dir):
+    """Test a version is written back and marked as rolled back until cleared."""
+    record_version(working_dir, PATH, dashboard(1), keep=3)
+    record_version(working_dir, PATH, dashboard(2), keep=3)
+    Path(working_dir, PATH).write_text(dashboard(2))
+    old = list_versions(working_dir, PATH)[1]["version"]
+
+    dashboard_hash = restore_version(working_dir, PATH, old)
+
+    assert Path(working_dir, PATH).read_text() == dashboard(1)
+    assert rolled_back(working_dir, PATH, dashboard_hash)
+    assert not rolled_back(working_dir, PATH, content_hash(dashboard(2)))
+    assert clear_rollback(working_dir, PATH)
+    assert not rolled_back(working_dir, PATH, dashboard_hash)
+
+
+@pytest.mark.parametrize(
+    "path, version",
+    [
+        (PATH, "unknown"),
+        ("../test.json", "unknown"),
+        (PATH, "../../../dir1/test.json"),
+    ],
+)
+def test_restore_version_fail(working_dir, path, version):
+    """Test unknown versions and paths outside the history are refused."""
+    record_version(working_dir, PATH, dashboard(1), keep=3)
+    with pytest.raises(exceptions.noVersionExists):
+        restore_version(working_dir, path, version)
+
+
+def test_cli(working_dir):
+    """Test listing and restoring versions from the command line."""
+    record_version(working_dir, PATH, dashboard(1), keep=3)
+    record_version(working_dir, PATH, dashboard(2), keep=3)
+    runner = CliRunner()
+
+    result = runner.invoke(cli, ["--working-dir", str(working_dir), "list", PATH])
+    assert result.exit_code == 0
+    versions = [line.split()[0] for line in result.output.splitlines()]
+    assert versions == [v["version"] for v in list_versions(working_dir, PATH)]
+
+    result = runner.invoke(
+        cli, ["--working-dir", str(working_dir), "restore", PATH, versions[1]]
+    )
+    assert result.exit_code == 0
+    assert Path(working_dir, PATH).read_text() == dashboard(1)
+
+    result = runner.invoke(
+        cli, ["--working-dir", str(working_dir), "restore", PATH, "unknown"]
+    )
+    assert result.exit_code == 1
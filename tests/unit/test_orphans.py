@@ -0,0 +1,30 @@
+import threading
+from pathlib import Path
+
+# local library
+from sidecar.orphans import OrphanCollector
+
+
+def test_orphan_collector(tmp_path):
+    """Test files orphaned on two passes are removed, owned files and sidecar state are kept."""
+    Path(tmp_path, "dir1").mkdir()
+    Path(tmp_path, ".history").mkdir()
+    for path in ["owned.json", "dir1/orphan.json", "dir1/late.json", ".history/x.json"]:
+        Path(tmp_path, path).write_text("{}")
+    owned = {"owned.json"}
+    removed = []
+
+    collector = OrphanCollector(
+        str(tmp_path), lambda: owned, removed.extend, threading.Event()
+    )
+
+    # first pass only marks
+    assert collector.collect() == []
+    assert collector.candidates == {"dir1/orphan.json", "dir1/late.json"}
+
+    # a resource for the file appeared in the index meanwhile
+    owned.add("dir1/late.json")
+    Path(tmp_path, "new.json").write_text("{}")
+    assert collector.collect() == ["dir1/orphan.json"]
+    assert removed == ["dir1/orphan.json"]
+    assert collector.candidates == {"new.json"}
@@ -0,0 +1,56 @@
+import base64
+import gzip
+import json
+import textwrap
+
+import pytest
+
+import sidecar.exceptions as exceptions
+
+# local library
+from sidecar.payload import decompress_json
+
+DASHBOARD = json.dumps({"uid": "gzip", "title": "gzip", "panels": [{"id": 1}] * 100})
+
+
+def encode(data: bytes) -> str:
+    """base64 gzip payload as sent in spec.jsonGzip."""
+    return base64.b64encode(gzip.compress(data)).decode()
+
+
+def test_decompress_json():
+    """Test payloads are decompressed once, later calls are answered from the cache."""
+    encoded = encode(DASHBOARD.encode())
+
+    dashboard_json, seconds = decompress_json(encoded, 10_000)
+    assert dashboard_json == DASHBOARD
+    assert seconds is not None
+
+    assert decompress_json(encoded, 10_000) == (DASHBOARD, None)
+
+
+def test_decompress_json_wrapped():
+    """Test line wrapped base64 is accepted."""
+    encoded = encode(b'{"uid": "wrapped"}')
+    wrapped = "\n".join(textwrap.wrap(encoded, 8))
+
+    assert decompress_json(wrapped, 10_000)[0] == '{"uid": "wrapped"}'
+
+
+@pytest.mark.parametrize(
+    "encoded, expected_exception",
+    [
+        ("not base64!", exceptions.invalidJsonGzip),
+        (base64.b64encode(b"not gzip").decode(), exceptions.invalidJsonGzip),
+        (encode(b"\xff\xfe"), exceptions.invalidJsonGzip),
+        (
+            base64.b64encode(gzip.compress(b'{"uid": "truncated"}')[:-12]).decode(),
+            exceptions.invalidJsonGzip,
+        ),
+        (encode(b" " * 100_000), exceptions.dashboardTooLarge),
+    ],
+)
+def test_decompress_json_fail(encoded, expected_exception):
+    """Test invalid payloads are rejected, large ones before decompressing all of them."""
+    with pytest.raises(expected_exception):
+        decompress_json(encoded, 10_000)
@@ -0,0 +1,118 @@
+import json
+from unittest.mock import MagicMock
+
+import kopf
+import pytest
+from kopf._cogs.structs.diffs import diff
+
+# local library
+from sidecar.dashboard_files import content_hash, serialize_dashboard
+from sidecar.persistence import SlimDiffBaseStorage, json_digest, stored_hash
+
+DASHBOARD = json.dumps({"uid": "test", "title": "test", "panels": []})
+
+
+def body(dashboard_json: str, name: str = "test", dir: str = "dir1") -> kopf.Body:
+    """Resource body as seen by kopf."""
+    return kopf.Body(
+        {
+            "apiVersion": "example.co.uk/v1",
+            "kind": "GrafanaDashboard",
+            "metadata": {"name": "test", "annotations": {"team": "a"}},
+            "spec": {"dir": dir, "name": name, "json": dashboard_json},
+            "status": {"state": "ok"},
+        }
+    )
+
+
+def test_slim_diff_base_build():
+    """Test only a hash of the json is kept, other fields as kopf keeps them."""
+    essence = SlimDiffBaseStorage().build(body=body(DASHBOARD))
+
+    assert essence == {
+        "metadata": {"annotations": {"team": "a"}},
+        "spec": {"dir": "dir1", "name": "test", "json": json_digest(DASHBOARD)},
+    }
+    assert len(json.dumps(essence)) < 200
+
+
+def test_slim_diff_base_build_dashboard():
+    """Test dashboards sent as an object are kept as the digest of the json written for them."""
+    resource = body(DASHBOARD)
+    spec = dict(resource["spec"])
+    spec["dashboard"] = json.loads(spec.pop("json"))
+    essence = SlimDiffBaseStorage().build(body=kopf.Body({**resource, "spec": spec}))
+
+    assert essence == SlimDiffBaseStorage().build(
+        body=body(serialize_dashboard(spec["dashboard"]))
+    )
+
+
+@pytest.mark.parametrize(
+    "new_json, new_name, expected_fields",
+    [
+        (DASHBOARD, "test", []),
+        # semantic changes are decided by the update handler, not the digest
+        (json.dumps(json.loads(DASHBOARD), indent=2), "test", [("spec", "json")]),
+        (
+            DASHBOARD.replace('"title": "test"', '"title": "other"'),
+            "test",
+            [("spec", "json")],
+        ),
+        (DASHBOARD, "renamed", [("spec", "name")]),
+    ],
+)
+def test_slim_diff_base_diff(new_json, new_name, expected_fields):
+    """Test field diffs of dir, name and json are kept, json changes by digest."""
+    storage = SlimDiffBaseStorage()
+    old = storage.build(body=body(DASHBOARD))
+    new = storage.build(body=body(new_json, name=new_name))
+
+    assert [field for _, field, _, _ in diff(old, new)] == expected_fields
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [(json_digest(DASHBOARD), None), (DASHBOARD, content_hash(DASHBOARD))],
+)
+def test_stored_hash(value, expected):
+    """Test hashes are read from full diff-bases, slim ones only hold a digest of the raw json."""
+    assert stored_hash(value) == expected
+
+
+def test_json_digest_not_parsed(monkeypatch):
+    """Test the digest is taken without parsing the json."""
+    loads = MagicMock(side_effect=json.loads)
+    monkeypatch.setattr("json.loads", loads)
+    SlimDiffBaseStorage().build(body=body(DASHBOARD))
+
+    loads.assert_not_called()
+
+
+def test_slim_diff_base_json_gzip():
+    """Test compressed payloads are hashed, a changed payload shows as a change."""
+    storage = SlimDiffBaseStorage()
+    old = storage.build(body=kopf.Body({"spec": {"jsonGzip": "H4sIAAAA"}}))
+    new = storage.build(body=kopf.Body({"spec": {"jsonGzip": "H4sIBBBB"}}))
+
+    assert old["spec"]["jsonGzip"].startswith("sha256:")
+    assert [field for _, field, _, _ in diff(old, new)] == [("spec", "jsonGzip")]
+
+
+@pytest.mark.parametrize("full", [True, False])
+def test_slim_diff_base_fetch(full):
+    """Test a diff-base stored in full before upgrading compares equal to the slim essence."""
+    resource = body(DASHBOARD)
+    stored = (
+        kopf.AnnotationsDiffBaseStorage() if full else SlimDiffBaseStorage()
+    ).build(body=resource)
+    annotations = {
+        **resource["metadata"]["annotations"],
+        "kopf.zalando.org/last-handled-configuration": json.dumps(stored),
+    }
+    resource = kopf.Body(
+        {**resource, "metadata": {**resource["metadata"], "annotations": annotations}}
+    )
+    storage = SlimDiffBaseStorage()
+
+    assert not diff(storage.fetch(body=resource), storage.build(body=resource))
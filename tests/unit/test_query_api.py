@@ -0,0 +1,97 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+# local library
+from sidecar.query_api import QueryAPI
+
+INDEXES = {
+    "d_idx": {
+        f"uid-{i}": [{"dir": "dir1", "name": f"test-{i}", "namespace": "default"}]
+        for i in range(5)
+    },
+    "json_uids": {"grafana-1": ["uid-1", "uid-2"]},
+    "paths_idx": {"dir1/test-3.json": ["uid-3"]},
+    "error_uids": {"duplicate_dashboard_uid": ["uid-1", "uid-2"]},
+}
+
+
+@pytest.fixture(scope="module")
+def api():
+    """Serve the test indexes on a free port."""
+    api = QueryAPI(0, lambda: INDEXES)
+    api.start()
+    yield f"http://127.0.0.1:{api.port}"
+    api.stop()
+
+
+def get(url):
+    """Return the status and json body of a GET request."""
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+@pytest.mark.parametrize(
+    "path, expected_status, expected_body",
+    [
+        (
+            "/v1/dashboards/uid-0",
+            200,
+            {"uid": "uid-0", "dashboards": INDEXES["d_idx"]["uid-0"]},
+        ),
+        (
+            "/v1/grafana-uids/grafana-1",
+            200,
+            {
+                "items": [
+                    {"uid": "uid-1", "dashboards": INDEXES["d_idx"]["uid-1"]},
+                    {"uid": "uid-2", "dashboards": INDEXES["d_idx"]["uid-2"]},
+                ]
+            },
+        ),
+        (
+            "/v1/paths/dir1/test-3.json",
+            200,
+            {"items": [{"uid": "uid-3", "dashboards": INDEXES["d_idx"]["uid-3"]}]},
+        ),
+        ("/v1/errors", 200, {"duplicate_dashboard_uid": 2}),
+        (
+            "/v1/errors/duplicate_dashboard_uid?limit=1",
+            200,
+            {
+                "items": [{"uid": "uid-1", "dashboards": INDEXES["d_idx"]["uid-1"]}],
+                "next": 1,
+            },
+        ),
+        (
+            "/v1/dashboards?limit=2&offset=2",
+            200,
+            {"items": ["uid-2", "uid-3"], "next": 4},
+        ),
+        ("/v1/dashboards?offset=4", 200, {"items": ["uid-4"], "next": None}),
+        (
+            "/v1/dashboards?limit=0",
+            400,
+            {"error": "limit must be 1-1000 and offset positive"},
+        ),
+        ("/v1/dashboards/unknown", 404, {"error": "not found"}),
+        ("/v1/unknown/uid-0", 404, {"error": "not found"}),
+        ("/", 404, {"error": "not found"}),
+    ],
+)
+def test_query_api(api, path, expected_status, expected_body):
+    """Test lookups and pagination over the indexes."""
+    assert get(api + path) == (expected_status, expected_body)
+
+
+def test_query_api_read_only(api):
+    """Test the api does not accept changes."""
+    request = urllib.request.Request(api + "/v1/dashboards/uid-0", method="DELETE")
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(request)
+    assert e.value.code == 501
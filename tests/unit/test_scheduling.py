@@ -0,0 +1,264 @@
+import asyncio
+import time
+
+import pytest
+
+# local library
+from sidecar.scheduling import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_FOREGROUND,
+    PRIORITY_UPDATE,
+    AIMDController,
+    Batcher,
+    FairScheduler,
+    RetryBudget,
+    WarmStart,
+)
+
+
+async def run_all(scheduler, namespaces, priorities=None):
+    """Queue one item per namespace (in order) behind a running item, return the run order."""
+    order = []
+
+    async def item(namespace, priority):
+        await scheduler.acquire(namespace, priority)
+        order.append(namespace)
+        await asyncio.sleep(0)
+        scheduler.release(priority)
+
+    priorities = priorities or [PRIORITY_FOREGROUND] * len(namespaces)
+    await scheduler.acquire("running")
+    tasks = [
+        asyncio.create_task(item(namespace, priority))
+        for namespace, priority in zip(namespaces, priorities)
+    ]
+    await asyncio.sleep(0)
+    scheduler.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_fair_share():
+    """Test a namespace with a backlog does not starve a later namespace."""
+    scheduler = FairScheduler(1)
+    order = asyncio.run(run_all(scheduler, ["noisy"] * 10 + ["quiet"] * 2))
+
+    assert order.index("quiet") <= 1
+    assert order[:4].count("quiet") == 2
+    assert scheduler.active == 0 and not scheduler.waiting(PRIORITY_BACKGROUND)
+
+
+@pytest.mark.parametrize(
+    "weights, expected_heavy",
+    [
+        ({}, 3),
+        ({"heavy": 2}, 4),
+        ({"heavy": 3}, 4),
+    ],
+)
+def test_weighted_share(weights, expected_heavy):
+    """Test namespaces share slots in proportion to their weight."""
+    scheduler = FairScheduler(1, weights)
+    order = asyncio.run(run_all(scheduler, ["heavy"] * 10 + ["light"] * 10))
+
+    assert order[:6].count("heavy") == expected_heavy
+
+
+def test_cancel_waiting():
+    """Test a cancelled waiter leaves the queue and does not take a slot."""
+
+    async def cancel():
+        scheduler = FairScheduler(1)
+        await scheduler.acquire("a")
+        waiter = asyncio.create_task(scheduler.acquire("b"))
+        await asyncio.sleep(0)
+        assert scheduler.depth("b") == 1
+
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.depth("b") == 0
+
+        scheduler.release()
+        return scheduler
+
+    scheduler = asyncio.run(cancel())
+    assert scheduler.active == 0 and not scheduler.waiting(PRIORITY_BACKGROUND)
+
+
+def test_priority():
+    """Test waiting items run by priority class, fair within a class."""
+    scheduler = FairScheduler(1)
+    order = asyncio.run(
+        run_all(
+            scheduler,
+            [
+                "reconcile-a",
+                "reconcile-b",
+                "update",
+                "create-a",
+                "create-a",
+                "create-b",
+            ],
+            [PRIORITY_BACKGROUND] * 2 + [PRIORITY_UPDATE] + [PRIORITY_FOREGROUND] * 3,
+        )
+    )
+
+    assert order == [
+        "create-a",
+        "create-b",
+        "create-a",
+        "update",
+        "reconcile-a",
+        "reconcile-b",
+    ]
+
+
+def test_background_slots():
+    """Test background items leave slots free for foreground items."""
+
+    async def fill():
+        scheduler = FairScheduler(4)
+        tasks = [
+            asyncio.create_task(scheduler.acquire("a", PRIORITY_BACKGROUND))
+            for _ in range(4)
+        ]
+        await asyncio.sleep(0)
+        assert scheduler.active == scheduler.active_background == 2
+        assert scheduler.depth("a", PRIORITY_BACKGROUND) == 2
+
+        # foreground does not wait behind background
+        await asyncio.wait_for(scheduler.acquire("b"), 1)
+        assert scheduler.active == 3
+
+        scheduler.release(PRIORITY_BACKGROUND)
+        await asyncio.sleep(0)
+        assert scheduler.active_background == 2
+        assert scheduler.depth("a") == 1
+
+        for task in tasks:
+            task.cancel()
+
+    asyncio.run(fill())
+
+
+def test_resize():
+    """Test growing the slots hands them to waiting items."""
+
+    async def grow():
+        scheduler = FairScheduler(1)
+        await scheduler.acquire("a")
+        waiter = asyncio.create_task(scheduler.acquire("b"))
+        await asyncio.sleep(0)
+        assert scheduler.depth("b") == 1
+
+        scheduler.resize(2)
+        await asyncio.wait_for(waiter, 1)
+        assert scheduler.active == 2
+
+        # running items are not interrupted
+        scheduler.resize(1)
+        assert scheduler.active == 2 and scheduler.background_slots == 1
+
+    asyncio.run(grow())
+
+
+@pytest.mark.parametrize(
+    "windows, expected_limit, expected_decisions",
+    [
+        ([(0.01, False)], 8, ["hold"]),
+        ([(0.2, False)], 4, ["decrease"]),
+        ([(0.01, True)], 4, ["decrease"]),
+        ([(0.2, False)] * 4, 2, ["decrease", "decrease", "hold", "hold"]),
+        (
+            [(0.2, False), (0.01, False), (0.01, False)],
+            6,
+            ["decrease", "increase", "increase"],
+        ),
+    ],
+)
+def test_aimd_controller(windows, expected_limit, expected_decisions):
+    """Test the limit decreases multiplicatively on slow or failed windows and increases additively."""
+    controller = AIMDController(2, 8, 0.1, window=3)
+    decisions = []
+    for seconds, error in windows:
+        decisions.append(controller.record(seconds))
+        decisions.append(controller.record(seconds, error))
+        decisions.append(controller.record(seconds))
+
+    assert controller.slots == expected_limit
+    assert [d for d in decisions if d is not None] == expected_decisions
+
+
+def test_retry_budget():
+    """Test retry delays back off exponentially with jitter until the budget is spent."""
+    budget = RetryBudget(budget=4, base=1, cap=5)
+    delays = [budget.next_delay("a") for _ in range(4)]
+
+    assert all(0 <= delay <= limit for delay, limit in zip(delays, [1, 2, 4, 5]))
+    assert budget.pending() == 1
+    assert budget.next_delay("a") is None
+    assert budget.pending() == 0
+
+    budget.next_delay("b")
+    budget.reset("b")
+    assert budget.pending() == 0
+
+
+def test_warm_start():
+    """Test checks are rate limited, missing files first, existing files spread over the window."""
+
+    async def start():
+        warm_start = WarmStart(window=0.2, rate=100)
+        order = []
+
+        async def check(name, missing):
+            await warm_start.wait(missing)
+            order.append((name, time.monotonic()))
+
+        begin = time.monotonic()
+        tasks = [asyncio.create_task(check(f"verify-{i}", False)) for i in range(5)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(check(f"missing-{i}", True)) for i in range(5)]
+        await asyncio.sleep(0)
+        assert warm_start.pending(True) == 5 and warm_start.pending(False) == 5
+
+        await asyncio.gather(*tasks)
+        assert warm_start.pending(True) == warm_start.pending(False) == 0
+        await asyncio.sleep(0.2)
+        assert not warm_start.active()
+
+        # after the warm start checks pass straight through
+        await asyncio.wait_for(warm_start.wait(False), 0.01)
+        return begin, order
+
+    begin, order = asyncio.run(start())
+    names = [name for name, _ in order]
+    assert all(name.startswith("missing") for name in names[:5])
+    # rate limited: 10 checks at 100/s take at least ~0.09s
+    assert order[-1][1] - begin >= 0.08
+
+
+def test_batcher():
+    """Test items submitted within the window are flushed together, per key and up to max size."""
+    flushed = []
+
+    async def flush(key, items):
+        flushed.append((key, items))
+        return [ValueError(item) if item == "bad" else item.upper() for item in items]
+
+    async def submit_all():
+        batcher = Batcher(0.05, flush, max_size=3)
+        results = await asyncio.gather(
+            *[batcher.submit("a", item) for item in ["x", "y", "z", "w"]],
+            batcher.submit("b", "bad"),
+            return_exceptions=True,
+        )
+        assert not batcher.batches
+        return results
+
+    results = asyncio.run(submit_all())
+
+    assert results[:4] == ["X", "Y", "Z", "W"]
+    assert isinstance(results[4], ValueError)
+    assert sorted(flushed) == [("a", ["w"]), ("a", ["x", "y", "z"]), ("b", ["bad"])]
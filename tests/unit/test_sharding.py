@@ -0,0 +1,51 @@
+import collections
+
+import pytest
+
+# local library
+from sidecar.sharding import HashRing, MembershipRefresher
+
+KEYS = [f"namespace-{i % 10}/uid-{i}" for i in range(10000)]
+
+
+@pytest.mark.parametrize("members", [["a"], ["a", "b", "c"], ["a", "b", "c", "d", "e"]])
+def test_hash_ring_distribution(members):
+    ring = HashRing(members)
+    owners = collections.Counter(ring.owner(key) for key in KEYS)
+
+    assert set(owners) == set(members)
+    # roughly balanced
+    for count in owners.values():
+        assert abs(count - len(KEYS) / len(members)) < len(KEYS) / len(members) * 0.35
+
+
+def test_hash_ring_stable():
+    """adding a member only moves keys to the new member"""
+    before = HashRing(["a", "b", "c"])
+    after = HashRing(["a", "b", "c", "d"])
+
+    moved = [key for key in KEYS if before.owner(key) != after.owner(key)]
+
+    assert all(after.owner(key) == "d" for key in moved)
+    assert len(moved) < len(KEYS) / 3
+
+
+def test_hash_ring_empty():
+    assert HashRing([]).owner("key") is None
+
+
+def test_membership_refresher():
+    discovered = [["a"], ["a"], ["a", "b"], OSError("dns")]
+    changes = []
+
+    def discover():
+        result = discovered.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    refresher = MembershipRefresher(discover, changes.append)
+    for _ in range(4):
+        refresher.refresh()
+
+    assert changes == [["a"], ["a", "b"]]
@@ -1,23 +1,68 @@
+import asyncio
+import base64
+import collections
+import gzip
 import json
 import logging
+import os
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 from pathlib import Path
+from types import SimpleNamespace
 from unittest.mock import MagicMock
 
 import kopf
 import pytest
-from prometheus_client import REGISTRY
+from kopf._cogs.structs.references import match_namespace
+from kopf._core.intents.causes import ChangingCause
+from prometheus_client import REGISTRY, CollectorRegistry
+from prometheus_client.multiprocess import MultiProcessCollector
 
 import sidecar.exceptions as exceptions
 
 # local library
+from sidecar.config_maps import ConfigMapCache
+from sidecar.dashboard_files import canonicalize, content_hash, create_file
+from sidecar.history import list_versions, restore_version
+from sidecar.persistence import SlimDiffBaseStorage
+from sidecar.scheduling import Batcher, FairScheduler, RetryBudget
+from sidecar.sharding import HashRing
 from sidecar.sidecar import (
+    check_drift,
+    config_map_event,
+    config_map_refs,
+    configure,
     create,
+    d_idx,
     delete,
+    delete_event,
     error_count,
+    error_uids,
+    fair_delete,
+    fair_reconcile,
+    flush_deletes,
     get_dashboard_json_meta,
+    in_shard,
+    json_uids,
+    kopf_namespaces,
+    parse_high_water,
+    paths_idx,
+    persistence_name,
     reconcile,
+    reconcile_loop,
+    record_history,
+    register_delete,
+    register_reconcile,
+    remove_orphans,
     resource_count,
+    run_fair,
+    set_shard_members,
+    set_status_ok,
+    split_namespaces,
     update,
+    validate_dashboard,
 )
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
@@ -61,6 +106,7 @@ UID = "c145c09b-b030-433d-9b9c-e1385e0683c6"
 TEST_1_JSON = open_json_fixture("test-1.json")
 TEST_2_JSON = open_json_fixture("dir1/test-2.json")
 INVALID_JSON = "invalid json"
+TEST_2_JSON_NEW_VERSION = json.dumps({**json.loads(TEST_2_JSON), "version": 2})
 
 
 # Create Tests
@@ -109,6 +155,176 @@ def test_create_pass(
     assert json.loads(p.read_text()) == json.loads(expected_json)
 
 
+def test_create_json_gzip(monkeypatch, fixtures_dir):
+    """Test dashboards sent compressed are decompressed before validation and written as json."""
+    monkeypatch.setattr("sidecar.sidecar._working_dir", fixtures_dir)
+    encoded = base64.b64encode(gzip.compress(TEST_2_JSON.encode())).decode()
+    spec = {"dir": "create-ok", "name": "gzip", "jsonGzip": encoded}
+    before = (
+        REGISTRY.get_sample_value(
+            f"{metrics_prefix}_json_gzip_decompress_seconds_count"
+        )
+        or 0
+    )
+
+    assert json_uids(UID, spec, LOGGER) == {"222222222": UID}
+    create({}, MagicMock(), UID, spec, LOGGER)
+
+    content = Path(fixtures_dir, "create-ok/gzip.json").read_text()
+    assert json.loads(content) == json.loads(TEST_2_JSON)
+    # decompressed once for the index and the handler
+    after = REGISTRY.get_sample_value(
+        f"{metrics_prefix}_json_gzip_decompress_seconds_count"
+    )
+    assert 1 == after - before
+
+
+def test_create_json_gzip_fail(monkeypatch, fixtures_dir):
+    """Test payloads which are not base64 gzip put the resource in error."""
+    monkeypatch.setattr("sidecar.sidecar._working_dir", fixtures_dir)
+    patch = SimpleNamespace(status={})
+    spec = {"dir": "create-ok", "name": "gzip", "jsonGzip": "not gzip"}
+
+    assert d_idx(UID, spec)[UID]["size"] == 0
+    with pytest.raises(kopf.PermanentError):
+        create({}, patch, UID, spec, LOGGER)
+
+    assert patch.status["reason"] == "invalid_json_gzip"
+
+
+def test_create_dashboard_object(monkeypatch, fixtures_dir):
+    """Test dashboards sent as an object are indexed and validated decoded and written as json."""
+    monkeypatch.setattr("sidecar.sidecar._working_dir", fixtures_dir)
+    monkeypatch.setattr("sidecar.sidecar._canonical_json", True)
+    spec = {"dir": "create-ok", "name": "object", "dashboard": json.loads(TEST_2_JSON)}
+
+    assert json_uids(UID, spec, LOGGER) == {"222222222": UID}
+    assert d_idx(UID, spec)[UID]["hash"] == content_hash(TEST_2_JSON)
+    create({}, MagicMock(), UID, spec, LOGGER)
+
+    content = Path(fixtures_dir, "create-ok/object.json").read_text()
+    assert content == canonicalize(TEST_2_JSON)
+
+
+@pytest.mark.parametrize("slim", [False, True])
+def test_update_to_dashboard_object(monkeypatch, fixtures_dir, slim):
+    """Test converting a resource from the json string to the object form does not rewrite its file."""
+    monkeypatch.setattr("sidecar.sidecar._working_dir", fixtures_dir)
+    path = Path(fixtures_dir, "dir1/test-2.json")
+    mtime = path.stat().st_mtime_ns
+    old_spec = {"dir": "dir1", "name": "test-2", "json": TEST_2_JSON}
+    spec = {"dir": "dir1", "name": "test-2", "dashboard": json.loads(TEST_2_JSON)}
+    old, new = {"spec": old_spec}, {"spec": spec}
+    if slim:
+        storage = SlimDiffBaseStorage()
+        old = storage.build(body=kopf.Body(old))
+        new = storage.build(body=kopf.Body(new))
+    diff = (
+        ("remove", ("spec", "json"), TEST_2_JSON, None),
+        ("add", ("spec", "dashboard"), None, spec["dashboard"]),
+    )
+
+    patch = SimpleNamespace(status={})
+    update({}, patch, UID, spec, {}, old, new, diff, LOGGER)
+
+    assert path.stat().st_mtime_ns == mtime
+    assert patch.status["state"] == "ok"
+
+
+def test_create_config_map_ref(monkeypatch, fixtures_dir):
+    """Test dashboards read their json from a ConfigMap key, an error when refs are disabled."""
+    monkeypatch.setattr("sidecar.sidecar._working_dir", fixtures_dir)
+    spec = {
+        "dir": "create-ok",
+        "name": "from-cm",
+        "jsonFrom": {"configMapKeyRef": {"name": "dashboards", "key": "test.json"}},
+    }
+
+    patch = SimpleNamespace(status={})
+    with pytest.raises(kopf.PermanentError):
+        create({}, patch, UID, spec, LOGGER, namespace="team-a")
+    assert patch.status["reason"] == "config_map_refs_disabled"
+
+    monkeypatch.setattr(
+        "sidecar.sidecar._config_maps",
+        ConfigMapCache(lambda namespace, name: ("1", {"test.json": TEST_2_JSON})),
+    )
+    create({}, MagicMock(), UID, spec, LOGGER, namespace="team-a")
+
+    content = Path(fixtures_dir, "create-ok/from-cm.json").read_text()
+    assert content == TEST_2_JSON
+    assert config_map_refs(UID, spec, "team-a") == {
+        ("team-a", "dashboards"): {
+            "uid": UID,
+            "dir": "create-ok",
+            "name": "from-cm",
+            "configMap": "dashboards",
+            "key": "test.json",
+        }
+    }
+    # read from the cache by the indexes, drift is not checked against the ConfigMap
+    assert d_idx(UID, spec, "team-a")[UID]["hash"] == ""
+
+
+def test_config_map_event(monkeypatch, fixtures_dir):
+    """Test a changed ConfigMap rewrites the file of every dashboard reading from it."""
+    monkeypatch.setattr("sidecar.sidecar._working_dir", fixtures_dir)
+    monkeypatch.setattr("sidecar.sidecar._scheduler", FairScheduler(1))
+    cache = ConfigMapCache(lambda namespace, name: pytest.fail("fetched"))
+    monkeypatch.setattr("sidecar.sidecar._config_maps", cache)
+    refs = [
+        {"uid": f"uid-{i}", "dir": "create-ok", "name": f"cm-{i}"} for i in range(3)
+    ]
+    for ref in refs[:2]:
+        create_file(fixtures_dir, f'create-ok/{ref["name"]}.json', TEST_2_JSON)
+    monkeypatch.setattr(
+        "sidecar.sidecar._config_map_refs",
+        {
+            ("team-cm", "dashboards"): [
+                {**ref, "configMap": "dashboards", "key": "test.json"} for ref in refs
+            ]
+        },
+    )
+    changed = TEST_2_JSON.replace('"title": "test-2"', '"title": "changed"')
+    assert changed != TEST_2_JSON
+    body = {"metadata": {"resourceVersion": "2"}, "data": {"test.json": changed}}
+
+    def updates(result):
+        return (
+            REGISTRY.get_sample_value(
+                f"{metrics_prefix}_config_map_updates_total", {"result": result}
+            )
+            or 0
+        )
+
+    before = {result: updates(result) for result in ("updated", "missing")}
+    for _ in range(2):
+        # the same resource version is not refreshed again
+        asyncio.run(config_map_event("MODIFIED", body, "team-cm", "dashboards", LOGGER))
+
+    for ref in refs[:2]:
+        content = Path(fixtures_dir, f'create-ok/{ref["name"]}.json').read_text()
+        assert content == changed
+    # not created yet, left to create
+    assert not Path(fixtures_dir, "create-ok/cm-2.json").exists()
+    assert 2 == updates("updated") - before["updated"]
+    assert 1 == updates("missing") - before["missing"]
+
+
+def test_create_canonical_json(monkeypatch, fixtures_dir):
+    """Test create writes canonical json when configured."""
+    monkeypatch.setattr("sidecar.sidecar._working_dir", fixtures_dir)
+    monkeypatch.setattr("sidecar.sidecar._canonical_json", True)
+
+    spec = {"dir": "create-ok", "name": "canonical", "json": TEST_2_JSON}
+    create({}, MagicMock(), UID, spec, LOGGER)
+
+    content = Path(fixtures_dir, "create-ok/canonical.json").read_text()
+    assert content == json.dumps(
+        json.loads(TEST_2_JSON), sort_keys=True, separators=(",", ":")
+    )
+
+
 @pytest.mark.parametrize(
     "json_uids, spec, expected_error",
     [
@@ -169,6 +385,11 @@ def test_create_pass(
             },
             "invalid_json_uid_unexpected_characters",
         ),
+        (
+            {},
+            {"dir": "test-2", "name": "test-2", "json": " " * 1025 + TEST_2_JSON},
+            "dashboard_too_large",
+        ),
     ],
 )
 def test_create_fail(
@@ -176,6 +397,7 @@ def test_create_fail(
 ):
     """Test create fail."""
     monkeypatch.setattr("sidecar.sidecar._working_dir", fixtures_dir)
+    monkeypatch.setattr("sidecar.sidecar._max_dashboard_size", len(TEST_2_JSON) + 1024)
 
     # set to 0 if this metric is empty
     before = (
@@ -200,6 +422,26 @@ def test_create_fail(
 
 
 # Update Tests
+def test_update_too_large_not_parsed(monkeypatch, fixtures_dir):
+    """Test oversize json is rejected without parsing it, not even to compare with the old json."""
+    monkeypatch.setattr("sidecar.sidecar._working_dir", fixtures_dir)
+    monkeypatch.setattr("sidecar.sidecar._max_dashboard_size", len(TEST_2_JSON))
+    spec = {"dir": "dir1", "name": "test-2", "json": TEST_2_JSON + " "}
+    storage = SlimDiffBaseStorage()
+    old = storage.build(body=kopf.Body({"spec": {**spec, "json": TEST_2_JSON}}))
+    new = storage.build(body=kopf.Body({"spec": spec}))
+    diff = (("change", ("spec", "json"), old["spec"]["json"], new["spec"]["json"]),)
+    loads = MagicMock(side_effect=json.loads)
+    monkeypatch.setattr("json.loads", loads)
+    patch = SimpleNamespace(status={})
+
+    with pytest.raises(kopf.PermanentError):
+        update({}, patch, UID, spec, {}, old, new, diff, LOGGER)
+
+    assert patch.status["reason"] == "dashboard_too_large"
+    loads.assert_not_called()
+
+
 @pytest.mark.parametrize(
     "json_uids, spec, status, old, new, diff, expected_updates, expected_path, expected_json",
     [
@@ -322,6 +564,21 @@ def test_update_pass(
     assert json.loads(p.read_text()) == json.loads(expected_json)
 
 
+def test_update_slim_diff_base(monkeypatch, fixtures_dir):
+    """Test updates write the json of the spec when the diff-base only holds its hash."""
+    monkeypatch.setattr("sidecar.sidecar._working_dir", fixtures_dir)
+    spec = {"dir": "dir1", "name": "test-2", "json": TEST_1_JSON}
+    storage = SlimDiffBaseStorage()
+    old = storage.build(body=kopf.Body({"spec": {**spec, "json": TEST_2_JSON}}))
+    new = storage.build(body=kopf.Body({"spec": spec}))
+    diff = (("change", ("spec", "json"), old["spec"]["json"], new["spec"]["json"]),)
+
+    update({}, MagicMock(), UID, spec, {}, old, new, diff, LOGGER)
+
+    p = Path(fixtures_dir, "dir1/test-2.json")
+    assert json.loads(p.read_text()) == json.loads(TEST_1_JSON)
+
+
 @pytest.mark.parametrize(
     "json_uids, spec, status, old, new, diff, expected_updates, expected_path, expected_json",
     [
@@ -338,6 +595,25 @@ def test_update_pass(
             "dir1/test-2.json",
             TEST_2_JSON,
         ),
+        # volatile field change only
+        (
+            {},
+            {"dir": "dir1", "name": "test-2", "json": TEST_2_JSON_NEW_VERSION},
+            {"reason": "", "state": "ok"},
+            {"spec": {"dir": "dir1", "name": "test-2", "json": TEST_2_JSON}},
+            {
+                "spec": {
+                    "dir": "dir1",
+                    "name": "test-2",
+                    "json": TEST_2_JSON_NEW_VERSION,
+                }
+            },
+            (("change", ("spec", "json"), TEST_2_JSON, TEST_2_JSON_NEW_VERSION),),
+            # expected results
+            ["json"],
+            "dir1/test-2.json",
+            TEST_2_JSON,
+        ),
     ],
 )
 def test_update_pass_nothing_to_do(
@@ -383,7 +659,7 @@ def test_update_pass_nothing_to_do(
 
     p = Path(fixtures_dir, expected_path)
     assert p.is_file() is True
-    assert json.loads(p.read_text()) == json.loads(expected_json)
+    assert p.read_text() == expected_json
 
 
 @pytest.mark.parametrize(
@@ -860,6 +1136,29 @@ def test_reconcile(
     assert json.loads(check_path.read_text()) == json.loads(expected_json)
 
 
+def test_reconcile_rolled_back(monkeypatch, fixtures_dir, caplog):
+    """Test a dashboard restored from the history is not reported as drift until the resource changes."""
+    monkeypatch.setattr("sidecar.sidecar._working_dir", fixtures_dir)
+    monkeypatch.setattr("sidecar.sidecar._history_versions", 3)
+    spec = {"dir": "dir1", "name": "rollback", "json": TEST_1_JSON}
+    patch = SimpleNamespace(status={})
+
+    record_history("dir1/rollback.json", TEST_2_JSON, LOGGER)
+    create({}, patch, UID, spec, LOGGER)
+    version = list_versions(fixtures_dir, "dir1/rollback.json")[1]["version"]
+    restore_version(fixtures_dir, "dir1/rollback.json", version)
+
+    with caplog.at_level(logging.INFO):
+        reconcile({}, patch, UID, spec, {"reason": "", "state": "ok"}, LOGGER)
+    assert patch.status["reason"] == "rolled_back"
+    assert "json drift" not in caplog.text
+
+    # a write of the resource ends the rollback
+    record_history("dir1/rollback.json", TEST_1_JSON, LOGGER)
+    reconcile({}, patch, UID, spec, {"reason": "", "state": "ok"}, LOGGER)
+    assert patch.status["reason"] == "json_mismatch"
+
+
 @pytest.mark.parametrize(
     "index, expected_resource_count",
     [
@@ -887,7 +1186,7 @@ def test_resource_count(caplog, index, expected_resource_count):
     "json_str, expected_title, expected_uid",
     [
         (
-            '{"title": "test", "uid": "test"}',
+            '{"title": "test", "uid": "test", "panels": []}',
             "test",
             "test",
         ),
@@ -950,6 +1249,64 @@ def test_dashboard_json_meta_fail(dashboard_json, expected_exception):
         get_dashboard_json_meta(dashboard_json)
 
 
+def test_managed_bytes(monkeypatch):
+    """Test total size of managed dashboards."""
+    monkeypatch.setattr(
+        "sidecar.sidecar._d_idx",
+        {
+            "1": [{"dir": "dir1", "name": "test-2", "hash": "", "size": 100}],
+            "2": [{"dir": "dir2", "name": "test-3", "hash": "", "size": 50}],
+        },
+    )
+
+    assert REGISTRY.get_sample_value(f"{metrics_prefix}_managed_bytes") == 150
+
+
+@pytest.mark.parametrize(
+    "dashboard_json, expected_index",
+    [
+        (TEST_2_JSON, {"222222222": UID}),
+        ('{"title": "test"}', None),
+        (INVALID_JSON, None),
+        # invalid dashboards are never written, their uid is not taken
+        ('{"title": "test", "uid": "' + "a" * 41 + '"}', None),
+        ('{"title": "test", "uid": "u", "panels": [{"id": 1}, {"id": 1}]}', None),
+    ],
+)
+def test_json_uids(dashboard_json, expected_index):
+    """Test dashboard uid index."""
+    assert json_uids(UID, {"json": dashboard_json}, LOGGER) == expected_index
+    dashboard = json.loads(dashboard_json) if dashboard_json != INVALID_JSON else []
+    assert json_uids(UID, {"dashboard": dashboard}, LOGGER) == expected_index
+
+
+def test_json_uids_parsed_once(monkeypatch):
+    """Test the uid and content hash of the same json are read from a single parse."""
+    dashboard_json = TEST_2_JSON.replace("222222222", "parsed-once")
+    loads = MagicMock(side_effect=json.loads)
+    monkeypatch.setattr("sidecar.validation.json.loads", loads)
+
+    d_idx(UID, {"dir": "", "name": "once", "json": dashboard_json})
+    assert json_uids(UID, {"json": dashboard_json}, LOGGER) == {"parsed-once": UID}
+    assert loads.call_count == 1
+
+
+@pytest.mark.parametrize(
+    "status, expected_index",
+    [({}, {"other-shard": UID}), ({"state": "error"}, None)],
+)
+def test_json_uids_other_shard(monkeypatch, status, expected_index):
+    """Test other shards' dashboards are indexed by uid without parsing, unless their owner failed them."""
+    monkeypatch.setattr("sidecar.sidecar._shard_ring", HashRing(["sidecar-1"]))
+    monkeypatch.setattr("sidecar.sidecar._shard_self", "sidecar-0")
+    dashboard_json = TEST_2_JSON.replace("222222222", "other-shard")
+    loads = MagicMock(side_effect=json.loads)
+    monkeypatch.setattr("json.loads", loads)
+
+    assert json_uids(UID, {"json": dashboard_json}, LOGGER, status) == expected_index
+    assert loads.call_count == 0
+
+
 @pytest.mark.parametrize(
     "error_index, expected_error_counts",
     [
@@ -982,3 +1339,730 @@ def test_error_count(caplog, error_index, expected_error_counts):
             f"{metrics_prefix}_resource_errors", {"error": error_type}
         )
         assert expected_count == (after - metrics_before[error_type])
+
+
+@pytest.mark.parametrize(
+    "path, content_store, expected_result, expected_log_message, expected_status",
+    [
+        ("dir1/test-2.json", False, "ok", "", None),
+        (
+            "dir1/test-3.json",
+            False,
+            "json_mismatch",
+            "json drift for",
+            {"state": "warning", "reason": "json_mismatch"},
+        ),
+        (
+            "dir1/missing.json",
+            False,
+            "no_file_exists",
+            "recreating",
+            {"hash": content_hash(TEST_2_JSON), "observedGeneration": 1},
+        ),
+        ("dir1/missing.json", True, "restored", "restored missing file", None),
+    ],
+)
+def test_check_drift(
+    monkeypatch,
+    fixtures_dir,
+    caplog,
+    path,
+    content_store,
+    expected_result,
+    expected_log_message,
+    expected_status,
+):
+    """Test working dir watcher drift check, drifted dashboards reconciled from their resource."""
+    monkeypatch.setattr("sidecar.sidecar._working_dir", fixtures_dir)
+    monkeypatch.setattr("sidecar.sidecar._content_store", content_store)
+    name = Path(path).stem
+    dashboard = {
+        "dir": "dir1",
+        "name": name,
+        "namespace": "default",
+        "resource": name,
+        "hash": content_hash(TEST_2_JSON),
+    }
+    monkeypatch.setattr("sidecar.sidecar._d_idx", {UID: [dashboard]})
+    monkeypatch.setattr(
+        "sidecar.sidecar._indexes", {"paths_idx": {path: [UID]}, "json_uids": {}}
+    )
+    api = MagicMock()
+    api.get_namespaced_custom_object.return_value = {
+        "metadata": {"generation": 1},
+        "spec": {"dir": "dir1", "name": name, "json": TEST_2_JSON},
+        "status": {"state": "ok"},
+    }
+    monkeypatch.setattr("kubernetes.client.CustomObjectsApi", lambda: api)
+    if content_store:
+        create_file(fixtures_dir, path, TEST_2_JSON, True)
+        Path(fixtures_dir, path).unlink()
+
+    before = (
+        REGISTRY.get_sample_value(
+            f"{metrics_prefix}_drift_events_total", {"result": expected_result}
+        )
+        or 0
+    )
+
+    with caplog.at_level(logging.INFO):
+        check_drift(path)
+        # paths not owned by a resource are ignored
+        check_drift("dir1/not-owned.json")
+
+    after = REGISTRY.get_sample_value(
+        f"{metrics_prefix}_drift_events_total", {"result": expected_result}
+    )
+    assert 1 == (after - before)
+    assert expected_log_message in caplog.text
+
+    if expected_status is None:
+        api.patch_namespaced_custom_object.assert_not_called()
+    else:
+        (*_, resource, body), _ = api.patch_namespaced_custom_object.call_args
+        assert resource == name
+        assert expected_status.items() <= body["status"].items()
+    if expected_result in ("restored", "no_file_exists"):
+        assert Path(fixtures_dir, path).read_text() == TEST_2_JSON
+
+
+@pytest.mark.parametrize(
+    "status, meta, expected_patch",
+    [
+        (
+            {},
+            {"generation": 1},
+            {
+                "state": "ok",
+                "reason": "",
+                "observedGeneration": 1,
+                "hash": content_hash(TEST_2_JSON),
+            },
+        ),
+        (
+            {
+                "state": "ok",
+                "reason": "",
+                "observedGeneration": 1,
+                "hash": content_hash(TEST_2_JSON),
+            },
+            {"generation": 2},
+            {"observedGeneration": 2},
+        ),
+        (
+            {
+                "state": "ok",
+                "reason": "",
+                "observedGeneration": 1,
+                "hash": content_hash(TEST_2_JSON),
+            },
+            {"generation": 1},
+            {},
+        ),
+    ],
+)
+def test_set_status_ok(status, meta, expected_patch):
+    """Test status patch only includes changed fields."""
+    patch = SimpleNamespace(status={})
+
+    set_status_ok(patch, status, meta, TEST_2_JSON)
+
+    assert patch.status == expected_patch
+
+
+def test_update_status_skipped(monkeypatch, fixtures_dir):
+    """Test re-applying unchanged content writes neither file nor status."""
+    monkeypatch.setattr("sidecar.sidecar._working_dir", fixtures_dir)
+    patch = SimpleNamespace(status={})
+    spec = {"dir": "dir1", "name": "test-2", "json": TEST_2_JSON_NEW_VERSION}
+    status = {
+        "state": "ok",
+        "reason": "",
+        "observedGeneration": 2,
+        "hash": content_hash(TEST_2_JSON),
+    }
+    before = (
+        REGISTRY.get_sample_value(
+            f"{metrics_prefix}_skipped_writes_total", {"type": "status"}
+        )
+        or 0
+    )
+
+    update(
+        {},
+        patch,
+        UID,
+        spec,
+        status,
+        {"spec": {**spec, "json": TEST_2_JSON}},
+        {"spec": spec},
+        (("change", ("spec", "json"), TEST_2_JSON, TEST_2_JSON_NEW_VERSION),),
+        LOGGER,
+        {"generation": 2},
+    )
+
+    after = REGISTRY.get_sample_value(
+        f"{metrics_prefix}_skipped_writes_total", {"type": "status"}
+    )
+    assert 1 == (after - before)
+    assert patch.status == {}
+    assert Path(fixtures_dir, "dir1/test-2.json").read_text() == TEST_2_JSON
+
+
+@pytest.fixture(scope="module")
+def validation_pool():
+    """Validation process pool"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        yield pool
+
+
+@pytest.mark.parametrize(
+    "dashboard_json, expected_exception",
+    [
+        (TEST_2_JSON, None),
+        (INVALID_JSON, exceptions.invalidJson),
+        ('{"title": "test"}', exceptions.invalidJsonNoUid),
+        (
+            '{"title": "test`fail", "uid": "1"}',
+            exceptions.invalidJsonTitleUnexpectedCharacters,
+        ),
+    ],
+)
+def test_validate_dashboard_offload(
+    monkeypatch, validation_pool, dashboard_json, expected_exception
+):
+    """Test validation in the process pool matches in process validation."""
+    monkeypatch.setattr("sidecar.sidecar._validation_pool", validation_pool)
+    monkeypatch.setattr("sidecar.sidecar._validation_offload_size", 0)
+    monkeypatch.setattr(
+        "sidecar.dashboard_files._json_cache", collections.OrderedDict()
+    )
+
+    before = (
+        REGISTRY.get_sample_value(f"{metrics_prefix}_validation_seconds_count") or 0
+    )
+
+    if expected_exception is None:
+        assert validate_dashboard(dashboard_json) == ("222222222", "test-2")
+    else:
+        with pytest.raises(expected_exception):
+            validate_dashboard(dashboard_json)
+
+    after = REGISTRY.get_sample_value(f"{metrics_prefix}_validation_seconds_count")
+    assert 1 == (after - before)
+    assert REGISTRY.get_sample_value(f"{metrics_prefix}_validation_queue") == 0
+
+
+def test_validate_dashboard_in_process(monkeypatch, validation_pool):
+    """Test dashboards under the offload size are validated in process."""
+    monkeypatch.setattr("sidecar.sidecar._validation_pool", validation_pool)
+    monkeypatch.setattr(
+        "sidecar.sidecar._validation_offload_size", len(TEST_2_JSON) + 1
+    )
+
+    before = (
+        REGISTRY.get_sample_value(f"{metrics_prefix}_validation_seconds_count") or 0
+    )
+
+    assert validate_dashboard(TEST_2_JSON) == ("222222222", "test-2")
+
+    after = REGISTRY.get_sample_value(f"{metrics_prefix}_validation_seconds_count") or 0
+    assert before == after
+
+
+def test_validate_dashboard_cached(monkeypatch, validation_pool):
+    """Test json validated in the pool is indexed from the cache, parsed json is not offloaded again."""
+    monkeypatch.setattr("sidecar.sidecar._validation_pool", validation_pool)
+    monkeypatch.setattr("sidecar.sidecar._validation_offload_size", 0)
+    monkeypatch.setattr(
+        "sidecar.dashboard_files._json_cache", collections.OrderedDict()
+    )
+    loads = MagicMock(side_effect=json.loads)
+    monkeypatch.setattr("json.loads", loads)
+    spec = {"dir": "dir1", "name": "test-2", "json": TEST_2_JSON}
+    status = {"observedGeneration": 1, "hash": "written"}
+
+    # left to the pool: not parsed by the indexes, hashed from the status of the generation
+    assert json_uids(UID, spec, LOGGER) == {"222222222": UID}
+    assert d_idx(UID, spec, "", status, {"generation": 1})[UID]["hash"] == "written"
+    assert d_idx(UID, spec, "", status, {"generation": 2})[UID]["hash"] == ""
+    assert loads.call_count == 0
+
+    before = REGISTRY.get_sample_value(f"{metrics_prefix}_validation_seconds_count")
+    assert validate_dashboard(TEST_2_JSON) == ("222222222", "test-2")
+    assert validate_dashboard(TEST_2_JSON) == ("222222222", "test-2")
+    after = REGISTRY.get_sample_value(f"{metrics_prefix}_validation_seconds_count")
+    assert 1 == (after - before)
+
+    assert d_idx(UID, spec, "", status, {"generation": 2})[UID]["hash"] == (
+        content_hash(TEST_2_JSON)
+    )
+    assert loads.call_count == 0
+
+
+@pytest.mark.parametrize(
+    "label_selector, field_selector",
+    [
+        ("", ""),
+        ("example.co.uk/team=developers", "metadata.namespace!=kube-system"),
+    ],
+)
+def test_configure_selectors(monkeypatch, label_selector, field_selector):
+    """Test server side selectors applied to the grafana dashboard watch."""
+    monkeypatch.setattr("sidecar.sidecar._label_selector", label_selector)
+    monkeypatch.setattr("sidecar.sidecar._field_selector", field_selector)
+    settings = kopf.OperatorSettings()
+
+    configure(settings)
+
+    resource = kopf.Resource("example.co.uk", "v1", "grafanadashboards")
+    assert list(settings.watching.label_selectors.collect(resource)) == (
+        [label_selector] if label_selector else []
+    )
+    assert list(settings.watching.field_selectors.collect(resource)) == (
+        [field_selector] if field_selector else []
+    )
+
+
+def test_shard_members(monkeypatch, fixtures_dir):
+    """Test resources split between shards and released on membership change."""
+    monkeypatch.setattr("sidecar.sidecar._working_dir", fixtures_dir)
+    monkeypatch.setattr("sidecar.sidecar._shard_ring", None)
+    monkeypatch.setattr("sidecar.sidecar._shard_self", "sidecar-0")
+    uids = [f"uid-{i}" for i in range(100)]
+    monkeypatch.setattr(
+        "sidecar.sidecar._d_idx",
+        {uid: [{"dir": "dir1", "name": uid, "namespace": "default"}] for uid in uids},
+    )
+    for uid in uids:
+        Path(fixtures_dir, f"dir1/{uid}.json").write_text(TEST_2_JSON)
+
+    # not sharded
+    assert all(in_shard("default", uid) for uid in uids)
+
+    set_shard_members(["sidecar-1", "sidecar-2"])
+
+    owned = [uid for uid in uids if in_shard("default", uid)]
+    assert 0 < len(owned) < len(uids)
+    for uid in uids:
+        assert Path(fixtures_dir, f"dir1/{uid}.json").is_file() is (uid in owned)
+
+
+def test_shard_members_adopt(monkeypatch, fixtures_dir):
+    """Test dashboards moving into the shard are read from the api server and written."""
+    monkeypatch.setattr("sidecar.sidecar._working_dir", fixtures_dir)
+    monkeypatch.setattr("sidecar.sidecar._shard_self", "sidecar-0")
+    monkeypatch.setattr(
+        "sidecar.sidecar._shard_ring", HashRing(["sidecar-0", "sidecar-1"])
+    )
+    uids = [f"uid-{i}" for i in range(50)]
+    monkeypatch.setattr(
+        "sidecar.sidecar._d_idx",
+        {
+            uid: [{"dir": "dir1", "name": uid, "namespace": "default", "resource": uid}]
+            for uid in uids
+        },
+    )
+    read = []
+
+    def read_dashboard(namespace, name):
+        read.append(name)
+        dashboard = {**json.loads(TEST_2_JSON), "uid": name, "title": name}
+        return {"dir": "dir1", "name": name, "dashboard": dashboard}
+
+    monkeypatch.setattr("sidecar.sidecar.read_dashboard", read_dashboard)
+    before = [uid for uid in uids if in_shard("default", uid)]
+
+    # sidecar-1 left, its dashboards move to sidecar-0
+    set_shard_members(["sidecar-0"])
+
+    assert sorted(read) == sorted(set(uids) - set(before))
+    for uid in read:
+        assert (
+            json.loads(Path(fixtures_dir, f"dir1/{uid}.json").read_text())["uid"] == uid
+        )
+
+
+def test_fair_reconcile_moved_shard(monkeypatch):
+    """Test the reconcile timer of a dashboard which moved to another shard does nothing."""
+    monkeypatch.setattr("sidecar.sidecar._shard_self", "sidecar-0")
+    monkeypatch.setattr("sidecar.sidecar._shard_ring", HashRing(["sidecar-1"]))
+    monkeypatch.setattr(
+        "sidecar.sidecar.run_fair", MagicMock(side_effect=AssertionError)
+    )
+
+    spec = {"dir": "dir1", "name": "test", "json": TEST_2_JSON}
+    assert asyncio.run(fair_reconcile(spec=spec, namespace="default", uid=UID)) is None
+
+
+@pytest.mark.parametrize(
+    "persistence_name, expected_finalizer",
+    [
+        ("", "kopf.nolar.org/GrafanaDashboardSidecarFinalizerMarker"),
+        (
+            "sidecar-0.worker-1",
+            "sidecar-0.worker-1.kopf.zalando.org/GrafanaDashboardSidecarFinalizerMarker",
+        ),
+    ],
+)
+def test_configure_persistence(monkeypatch, persistence_name, expected_finalizer):
+    """Test sharded sidecars and workers keep their own finalizer, kopf annotations are shared."""
+    monkeypatch.setattr("sidecar.sidecar._persistence_name", persistence_name)
+    settings = kopf.OperatorSettings()
+    default = kopf.OperatorSettings()
+
+    configure(settings)
+
+    assert settings.persistence.finalizer == expected_finalizer
+    assert settings.persistence.diffbase_storage.prefix == "kopf.zalando.org"
+    assert type(settings.persistence.progress_storage) is type(
+        default.persistence.progress_storage
+    )
+
+
+@pytest.mark.parametrize("finalizers", [True, False])
+def test_other_workers_blind(monkeypatch, finalizers):
+    """Test only the owning worker matches a change, others store no state for it."""
+    monkeypatch.setattr("sidecar.sidecar._finalizers", finalizers)
+    monkeypatch.setattr("sidecar.sidecar._shard_ring", None)
+    monkeypatch.setattr(
+        "sidecar.sidecar._worker_ring", HashRing([f"worker-{i}" for i in range(3)])
+    )
+    registry = kopf.get_default_registry()
+    monkeypatch.setattr(
+        registry._changing, "_handlers", list(registry._changing._handlers)
+    )
+    register_delete(registry)
+    cause = ChangingCause(
+        logger=LOGGER,
+        indices={},
+        resource=kopf.Resource("example.co.uk", "v1", "grafanadashboards"),
+        patch=kopf.Patch(),
+        memo=kopf.Memo(),
+        body=kopf.Body({"metadata": {"namespace": "team-a", "uid": UID}, "spec": {}}),
+        initial=False,
+        reason=kopf.Reason.UPDATE,
+    )
+
+    matched = []
+    for worker in range(3):
+        monkeypatch.setattr("sidecar.sidecar._worker_self", f"worker-{worker}")
+        if registry._changing.prematch(cause=cause):
+            matched.append(worker)
+
+    assert len(matched) == 1
+
+
+def test_persistence_name():
+    assert persistence_name("sidecar-0", "worker-1") == "sidecar-0.worker-1"
+    assert persistence_name("", "Worker_0") == "worker-0"
+
+
+@pytest.mark.parametrize(
+    "namespaces, processes, expected",
+    [
+        (["a", "b", "c"], 2, [["a", "c"], ["b"]]),
+        (["c", "b", "a"], 3, [["a"], ["b"], ["c"]]),
+        (["a"], 2, [None, None]),
+        ([], 2, [None, None]),
+        (["a", "team-*"], 2, [None, None]),
+    ],
+)
+def test_split_namespaces(namespaces, processes, expected):
+    """Test explicit namespaces split into disjoint watches per worker."""
+    assert [split_namespaces(namespaces, w, processes) for w in range(processes)] == (
+        expected
+    )
+
+
+@pytest.mark.parametrize(
+    "namespaces, expected_watched",
+    [
+        (["team-*", "!team-x"], ["team-a"]),
+        (["!team-x", "team-*"], ["team-a"]),
+        (["!kube-*"], ["team-a", "team-x", "default"]),
+        (["team-*", "default"], ["team-a", "team-x", "default"]),
+    ],
+)
+def test_kopf_namespaces(namespaces, expected_watched):
+    """Test exclusions apply to all repeated namespace values as kopf matches them."""
+    patterns = kopf_namespaces(namespaces)
+    watched = [
+        name
+        for name in ["team-a", "team-x", "default", "kube-system"]
+        if any(match_namespace(name, pattern) for pattern in patterns)
+    ]
+
+    assert watched == expected_watched
+
+
+def test_worker_ring(monkeypatch):
+    """Test namespaces shared between workers are handled by exactly one worker."""
+    monkeypatch.setattr("sidecar.sidecar._shard_ring", None)
+    monkeypatch.setattr(
+        "sidecar.sidecar._worker_ring", HashRing([f"worker-{i}" for i in range(3)])
+    )
+    handled = collections.Counter()
+    for worker in range(3):
+        monkeypatch.setattr("sidecar.sidecar._worker_self", f"worker-{worker}")
+        for i in range(100):
+            if in_shard(f"namespace-{i}", "uid"):
+                handled[f"namespace-{i}"] += 1
+                handled[worker] += 1
+
+    assert all(handled[f"namespace-{i}"] == 1 for i in range(100))
+    assert all(handled[worker] > 0 for worker in range(3))
+
+
+WORKER_GAUGES = """
+import sidecar.sidecar as sidecar
+sidecar._d_idx = {"uid": [{"dir": "", "name": "test", "hash": "", "size": 10}]}
+sidecar.export_gauges()
+"""
+
+
+def test_worker_gauges(tmp_path):
+    """Test gauges computed by two workers are summed in the multiprocess registry."""
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path))
+    env["PYTHONPATH"] = os.pathsep.join(
+        [str(Path(__file__).parents[2] / "src"), env.get("PYTHONPATH", "")]
+    )
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", WORKER_GAUGES], env=env, check=True)
+
+    registry = CollectorRegistry()
+    MultiProcessCollector(registry, path=str(tmp_path))
+    assert registry.get_sample_value(f"{metrics_prefix}_managed_bytes") == 20
+    assert registry.get_sample_value(f"{metrics_prefix}_shard_owned_resources") == 2
+
+
+def test_run_fair(monkeypatch):
+    """Test handlers run in the executor with their namespace, freeing the slot after errors."""
+    scheduler = FairScheduler(1)
+    monkeypatch.setattr("sidecar.sidecar._scheduler", scheduler)
+
+    def handler(namespace, uid, **kwargs):
+        if uid == "fail":
+            raise kopf.PermanentError("failed")
+        return f"{namespace}/{uid}"
+
+    assert asyncio.run(run_fair(handler, namespace="team-a", uid="ok")) == "team-a/ok"
+    with pytest.raises(kopf.PermanentError):
+        asyncio.run(run_fair(handler, namespace="team-a", uid="fail"))
+
+    assert scheduler.active == 0
+    assert (
+        REGISTRY.get_sample_value(
+            f"{metrics_prefix}_fair_queue_depth", {"namespace": "team-a"}
+        )
+        == 0
+    )
+    assert (
+        REGISTRY.get_sample_value(
+            f"{metrics_prefix}_fair_queue_wait_seconds_count", {"namespace": "team-a"}
+        )
+        == 2
+    )
+
+
+def test_fair_delete_batched(monkeypatch, fixtures_dir, caplog):
+    """Test deletes arriving together are deleted in one batch and all handlers return."""
+    monkeypatch.setattr("sidecar.sidecar._working_dir", fixtures_dir)
+    monkeypatch.setattr("sidecar.sidecar._scheduler", FairScheduler(1))
+    monkeypatch.setattr("sidecar.sidecar._delete_batcher", Batcher(0.05, flush_deletes))
+    Path(fixtures_dir, "teardown").mkdir()
+    specs = [
+        {"dir": "teardown", "name": f"dashboard-{i}", "json": TEST_2_JSON}
+        for i in range(20)
+    ]
+    for spec in specs:
+        create_file(fixtures_dir, f'teardown/{spec["name"]}.json', spec["json"])
+    before = REGISTRY.get_sample_value(f"{metrics_prefix}_delete_batch_size_count")
+
+    async def teardown():
+        await asyncio.gather(
+            *[
+                fair_delete(
+                    uid=f"uid-{i}",
+                    spec=spec,
+                    status={},
+                    logger=LOGGER,
+                    namespace="team-a",
+                    patch=SimpleNamespace(status={}),
+                )
+                for i, spec in enumerate(specs)
+            ]
+        )
+
+    with caplog.at_level(logging.INFO):
+        asyncio.run(teardown())
+
+    assert Path(fixtures_dir, "teardown").exists() is False
+    after = REGISTRY.get_sample_value(f"{metrics_prefix}_delete_batch_size_count")
+    assert 1 == after - (before or 0)
+    assert "deleted 20/20 dashboards in namespace: team-a" in caplog.text
+
+
+@pytest.mark.parametrize(
+    "finalizers, event_type, expected_deleted",
+    [
+        (False, "DELETED", True),
+        (False, "MODIFIED", False),
+        (True, "DELETED", False),
+    ],
+)
+def test_delete_event(
+    monkeypatch, fixtures_dir, finalizers, event_type, expected_deleted
+):
+    """Test dashboards are deleted on the deletion event only without finalizers."""
+    monkeypatch.setattr("sidecar.sidecar._working_dir", fixtures_dir)
+    monkeypatch.setattr("sidecar.sidecar._finalizers", finalizers)
+    monkeypatch.setattr("sidecar.sidecar._scheduler", FairScheduler(1))
+    spec = {"dir": "dir1", "name": "test-2", "json": TEST_2_JSON}
+
+    asyncio.run(
+        delete_event(
+            type=event_type,
+            uid=UID,
+            spec=spec,
+            status={},
+            logger=LOGGER,
+            namespace="team-a",
+            patch=SimpleNamespace(status={}),
+        )
+    )
+
+    assert Path(fixtures_dir, "dir1/test-2.json").is_file() is not expected_deleted
+
+
+@pytest.mark.parametrize("finalizers", [True, False])
+def test_register_delete(monkeypatch, finalizers):
+    """Test the delete handler only requires a finalizer with finalizers."""
+    monkeypatch.setattr("sidecar.sidecar._finalizers", finalizers)
+    registry = kopf.OperatorRegistry()
+
+    register_delete(registry)
+
+    (handler,) = registry._changing.get_all_handlers()
+    assert handler.id == "delete"
+    assert handler.requires_finalizer is finalizers
+
+
+@pytest.mark.parametrize("finalizers", [True, False])
+def test_register_reconcile(monkeypatch, finalizers):
+    """Test reconcile is a kopf timer (requiring a finalizer) only with finalizers."""
+    monkeypatch.setattr("sidecar.sidecar._finalizers", finalizers)
+    registry = kopf.OperatorRegistry()
+
+    register_reconcile(registry)
+
+    timers = registry._spawning.get_all_handlers()
+    assert [h.id for h in timers] == (["reconcile"] if finalizers else [])
+    assert all(h.requires_finalizer for h in timers)
+    activities = {h.id for h in registry._activities.get_all_handlers()}
+    assert ("reconcile-loop" in activities) is not finalizers
+
+
+def test_reconcile_loop(monkeypatch):
+    """Test the reconcile loop reconciles each indexed resource of this shard from the api server."""
+    monkeypatch.setattr("sidecar.sidecar._scheduler", FairScheduler(2))
+    monkeypatch.setattr("sidecar.sidecar.RECONCILE_INITIAL_DELAY", 0)
+    monkeypatch.setattr("sidecar.sidecar._shard_self", "sidecar-0")
+    monkeypatch.setattr(
+        "sidecar.sidecar._shard_ring", HashRing(["sidecar-0", "sidecar-1"])
+    )
+    uids = [f"uid-{i}" for i in range(20)]
+    monkeypatch.setattr(
+        "sidecar.sidecar._d_idx",
+        {
+            uid: [{"dir": "dir1", "name": uid, "namespace": "default", "resource": uid}]
+            for uid in uids
+        },
+    )
+    reconciled = []
+    monkeypatch.setattr(
+        "sidecar.sidecar.reconcile_resource",
+        lambda uid, dashboard: reconciled.append(uid),
+    )
+
+    async def first_pass():
+        task = asyncio.create_task(reconcile_loop())
+        while len(reconciled) < len([u for u in uids if in_shard("default", u)]):
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    asyncio.run(asyncio.wait_for(first_pass(), 5))
+
+    assert sorted(reconciled) == sorted(u for u in uids if in_shard("default", u))
+
+
+def test_remove_orphans(monkeypatch, fixtures_dir):
+    """Test orphaned files are removed with their empty dir, vanished files are ignored."""
+    monkeypatch.setattr("sidecar.sidecar._working_dir", fixtures_dir)
+    Path(fixtures_dir, "orphans").mkdir()
+    create_file(fixtures_dir, "orphans/gone.json", TEST_2_JSON)
+    before = REGISTRY.get_sample_value(f"{metrics_prefix}_orphan_files_removed_total")
+
+    remove_orphans(["orphans/gone.json", "orphans/vanished.json"])
+
+    assert Path(fixtures_dir, "orphans").exists() is False
+    after = REGISTRY.get_sample_value(f"{metrics_prefix}_orphan_files_removed_total")
+    assert 1 == after - (before or 0)
+
+
+def test_create_transient_retry(monkeypatch, fixtures_dir):
+    """Test transient file system errors are retried with backoff until the budget is spent."""
+    monkeypatch.setattr("sidecar.sidecar._working_dir", fixtures_dir)
+    monkeypatch.setattr("sidecar.sidecar._retry_budget", RetryBudget(budget=2, base=1))
+
+    def create_file(*args):
+        raise exceptions.noSpaceLeft
+
+    monkeypatch.setattr("sidecar.sidecar.create_file", create_file)
+    spec = {"dir": "create-ok", "name": "transient", "json": TEST_2_JSON}
+
+    for _ in range(2):
+        patch = MagicMock()
+        with pytest.raises(kopf.TemporaryError) as e:
+            create({}, patch, UID, spec, LOGGER)
+        assert 0 <= e.value.delay <= 2
+        assert patch.status.__setitem__.call_args_list[-1].args == ("state", "retrying")
+
+    with pytest.raises(kopf.PermanentError):
+        create({}, MagicMock(), UID, spec, LOGGER)
+    assert (
+        REGISTRY.get_sample_value(
+            f"{metrics_prefix}_transient_error_retries_total",
+            {"error": "no_space_left", "result": "exhausted"},
+        )
+        >= 1
+    )
+
+
+def test_parse_high_water():
+    """Test high water marks in bytes and as a percentage of the volume in use."""
+    assert parse_high_water("0") == (0, 0)
+    assert parse_high_water("1048576") == (1048576, 0)
+    assert parse_high_water("50%") == (0, 50)
+    with pytest.raises(ValueError):
+        parse_high_water("1GiB")
+
+
+@pytest.mark.parametrize(
+    "status, expected_index",
+    [
+        ({}, None),
+        ({"reason": "ok", "state": "ok"}, None),
+        ({"reason": "invalid_json", "state": "error"}, {"invalid_json": UID}),
+    ],
+)
+def test_error_uids(status, expected_index):
+    """Test resource uid by error code index."""
+    assert error_uids(UID, status) == expected_index
+
+
+def test_paths_idx():
+    """Test resource uid by dashboard path index."""
+    assert paths_idx(UID, {"dir": "dir1", "name": "test-2"}) == {
+        "dir1/test-2.json": UID
+    }
@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+import sidecar.exceptions as exceptions
+
+# local library
+from sidecar.validation import apply_rules, get_dashboard_json_meta, get_dashboard_meta
+
+
+def dashboard(**fields):
+    """Minimal valid dashboard json with fields overridden"""
+    return json.dumps({"title": "test", "uid": "test", "panels": [], **fields})
+
+
+@pytest.mark.parametrize(
+    "dashboard_json",
+    [
+        dashboard(),
+        dashboard(panels=[{"id": 1}, {"id": 2, "panels": [{"id": 3}]}]),
+        dashboard(schemaVersion=27),
+        dashboard(templating={"list": [{"name": "a", "options": [1, 2]}]}),
+        # legacy rows
+        json.dumps({"title": "t", "uid": "u", "rows": [{"panels": [{"id": 1}]}]}),
+    ],
+)
+def test_rules_pass(dashboard_json):
+    assert get_dashboard_json_meta(dashboard_json)[0] in ("test", "u")
+
+
+@pytest.mark.parametrize(
+    "dashboard_json, expected_exception",
+    [
+        (
+            json.dumps({"title": "test", "uid": "test"}),
+            exceptions.invalidJsonNoPanels,
+        ),
+        (dashboard(panels={}), exceptions.invalidJsonNoPanels),
+        (
+            dashboard(panels=[{"id": 1}, {"id": 1}]),
+            exceptions.invalidJsonDuplicatePanelId,
+        ),
+        # nested in a collapsed row
+        (
+            dashboard(panels=[{"id": 1}, {"id": 2, "panels": [{"id": 1}]}]),
+            exceptions.invalidJsonDuplicatePanelId,
+        ),
+        (
+            json.dumps(
+                {"title": "t", "uid": "u", "rows": [{"panels": [{"id": 1}, {"id": 1}]}]}
+            ),
+            exceptions.invalidJsonDuplicatePanelId,
+        ),
+        (dashboard(schemaVersion="27"), exceptions.invalidJsonSchemaVersion),
+        (dashboard(schemaVersion=0), exceptions.invalidJsonSchemaVersion),
+        (
+            dashboard(templating={"list": [{"name": str(i)} for i in range(101)]}),
+            exceptions.invalidJsonTemplatingTooLarge,
+        ),
+        (
+            dashboard(templating={"list": [{"name": "a", "options": [0] * 10001}]}),
+            exceptions.invalidJsonTemplatingTooLarge,
+        ),
+    ],
+)
+def test_rules_fail(dashboard_json, expected_exception):
+    with pytest.raises(expected_exception):
+        get_dashboard_json_meta(dashboard_json)
+
+
+def test_rules_after_meta_checks():
+    """uid/title errors take precedence over rule errors"""
+    with pytest.raises(exceptions.invalidJsonNoUid):
+        get_dashboard_json_meta(json.dumps({"title": "test"}))
+
+
+@pytest.mark.parametrize(
+    "dashboard_object, expected_exception",
+    [
+        ({"title": "test", "uid": "test", "panels": []}, None),
+        ({"title": "test", "panels": []}, exceptions.invalidJsonNoUid),
+        (
+            {"title": "test", "uid": "test", "panels": [{"id": 1}, {"id": 1}]},
+            exceptions.invalidJsonDuplicatePanelId,
+        ),
+        (["not", "a", "dashboard"], exceptions.invalidJson),
+    ],
+)
+def test_dashboard_meta(dashboard_object, expected_exception):
+    """decoded dashboards (spec.dashboard) get the same checks as json"""
+    if expected_exception is None:
+        assert get_dashboard_meta(dashboard_object) == ("test", "test")
+        return
+    with pytest.raises(expected_exception):
+        get_dashboard_meta(dashboard_object)
+
+
+def test_apply_rules_not_object():
+    assert apply_rules(["not", "a", "dashboard"]) is None
@@ -0,0 +1,83 @@
+import time
+from pathlib import Path
+
+import pytest
+
+# local library
+from sidecar.watcher import WorkingDirWatcher
+
+
+@pytest.fixture()
+def watcher(tmp_path):
+    """Start a watcher on an empty working dir recording handled paths"""
+    handled = []
+    Path(tmp_path, "dir1").mkdir()
+    Path(tmp_path, ".blobs").mkdir()
+
+    w = WorkingDirWatcher(
+        tmp_path, handled.append, rate=100, settle=0.1, ignore=(".blobs",)
+    )
+    w.handled = handled
+    w.start()
+    # allow the watches to be added
+    time.sleep(0.2)
+    yield w
+    w.stop()
+    w.join()
+
+
+def wait_for(watcher, count, timeout=5):
+    """Wait until the watcher has handled count paths"""
+    end = time.monotonic() + timeout
+    while len(watcher.handled) < count and time.monotonic() < end:
+        time.sleep(0.05)
+
+
+@pytest.mark.parametrize(
+    "operation, expected_paths",
+    [
+        ("create", ["dir1/test.json"]),
+        ("delete", ["dir1/existing.json"]),
+        ("new-dir", ["dir2/test.json"]),
+    ],
+)
+def test_watcher_events(watcher, operation, expected_paths):
+    working_dir = watcher.working_dir
+
+    if operation == "create":
+        Path(working_dir, "dir1/test.json").write_text("{}")
+        # repeated writes are collapsed into a single check
+        Path(working_dir, "dir1/test.json").write_text("{}")
+    elif operation == "delete":
+        Path(working_dir, "dir1/existing.json").write_text("{}")
+        Path(working_dir, "dir1/existing.json").unlink()
+    elif operation == "new-dir":
+        Path(working_dir, "dir2").mkdir()
+        time.sleep(0.2)
+        Path(working_dir, "dir2/test.json").write_text("{}")
+
+    wait_for(watcher, len(expected_paths))
+    time.sleep(0.3)
+
+    assert watcher.handled == expected_paths
+
+
+def test_watcher_ignored(watcher):
+    Path(watcher.working_dir, ".blobs/abc").write_text("{}")
+    Path(watcher.working_dir, "dir1/not-a-dashboard.txt").write_text("{}")
+    Path(watcher.working_dir, "dir1/test.json").write_text("{}")
+
+    wait_for(watcher, 1)
+    time.sleep(0.3)
+
+    assert watcher.handled == ["dir1/test.json"]
+
+
+def test_watcher_rate_limit(tmp_path):
+    w = WorkingDirWatcher(tmp_path, lambda path: None, rate=2, settle=0)
+    for i in range(5):
+        w.pending[f"test-{i}.json"] = 0
+
+    w.handle_pending()
+
+    assert len(w.pending) == 3